@@ -0,0 +1,348 @@
+import asyncio
+import fcntl
+import json
+import math
+import os
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.http import FileResponse, JsonResponse
+
+from .cache import _alive, _atomic_write
+from .metrics import count, stage
+
+# Admission control for the expensive endpoints. Each pool (ADMISSION_LIMITS) runs
+# at most so many requests at once over every worker on the host, with at most
+# ADMISSION_QUEUE more waiting for up to ADMISSION_MAX_WAIT seconds, and the
+# estimated memory of everything running kept under ADMISSION_MEMORY_BYTES. A
+# request that can't get in is refused straight away with a 503 and a Retry-After.
+# Requests wait for their slot on the event loop, before they are handed to an
+# executor (see executors.py), so a waiting request holds neither a thread nor a
+# place in an executor's queue.
+
+_control = None
+
+
+class Overloaded(Exception):
+    # `wait` is the Retry-After, in seconds
+    def __init__(self, message, wait):
+        super().__init__(message)
+        self.wait = wait
+
+
+class AdmissionControl:
+    # The running and waiting requests of every worker are tickets in one small
+    # JSON file, only read and changed under an exclusive flock. Tickets of a
+    # worker that died are dropped the next time anyone looks.
+    def __init__(self, directory, limits, queue_sizes, max_wait, memory_bytes):
+        self.directory = directory
+        self.limits = limits
+        self.queue_sizes = queue_sizes
+        self.max_wait = max_wait
+        self.memory_bytes = memory_bytes
+
+    @contextmanager
+    def _state(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "state.json")
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(path) as f:
+                    before = f.read()
+                state = json.loads(before)
+            except (FileNotFoundError, ValueError):
+                before = None
+                state = {"tickets": {}, "service_time": {}}
+            state["tickets"] = {
+                ticket: entry
+                for ticket, entry in state["tickets"].items()
+                if _alive(entry["pid"])
+            }
+            try:
+                yield state
+            finally:
+                after = json.dumps(state)
+                if after != before:
+                    _atomic_write(path, after.encode())
+
+    def _try_admit(self, state, ticket, pool, cost):
+        tickets = state["tickets"]
+        running = [entry for entry in tickets.values() if entry["running"]]
+        if sum(entry["pool"] == pool for entry in running) >= self.limits[pool]:
+            return False
+        # First come, first served within a pool
+        for other, entry in tickets.items():
+            if other == ticket:
+                break
+            if entry["pool"] == pool and not entry["running"]:
+                return False
+        # A request bigger than the whole budget still runs, on its own
+        if (
+            running
+            and sum(entry["cost"] for entry in running) + cost > self.memory_bytes
+        ):
+            return False
+        tickets[ticket] = {
+            "pool": pool,
+            "cost": cost,
+            "pid": os.getpid(),
+            "since": time.time(),
+            "running": True,
+        }
+        return True
+
+    def _retry_after(self, state, pool, ahead):
+        # Seconds until the requests ahead have gone through, from the recent
+        # average time a request of this pool holds its slot
+        service_time = state["service_time"].get(pool, 1.0)
+        return max(1, math.ceil((ahead + 1) / self.limits[pool] * service_time))
+
+    def _refuse(self, state, pool, reason, message):
+        waiting = sum(
+            entry["pool"] == pool and not entry["running"]
+            for entry in state["tickets"].values()
+        )
+        count("admission_rejected_total", pool=pool, reason=reason)
+        raise Overloaded(message, self._retry_after(state, pool, waiting))
+
+    def _admission(self, pool, cost):
+        # A generator yielding how long to wait before trying again, and returning
+        # the ticket once admitted. Raises Overloaded when the queue is full or the
+        # wait is over; a ticket abandoned while waiting (the generator is closed)
+        # is given back.
+        ticket = uuid.uuid4().hex
+        with self._state() as state:
+            if self._try_admit(state, ticket, pool, cost):
+                return ticket
+            waiting = sum(
+                entry["pool"] == pool and not entry["running"]
+                for entry in state["tickets"].values()
+            )
+            if waiting >= self.queue_sizes[pool]:
+                self._refuse(state, pool, "queue_full", "Too many requests are waiting")
+            state["tickets"][ticket] = {
+                "pool": pool,
+                "cost": cost,
+                "pid": os.getpid(),
+                "since": time.time(),
+                "running": False,
+            }
+
+        deadline = time.monotonic() + self.max_wait
+        delay = 0.01
+        try:
+            while True:
+                yield delay
+                delay = min(delay * 2, 0.1)
+                with self._state() as state:
+                    if self._try_admit(state, ticket, pool, cost):
+                        return ticket
+                    if time.monotonic() >= deadline:
+                        del state["tickets"][ticket]
+                        self._refuse(
+                            state,
+                            pool,
+                            "timeout",
+                            f"No capacity within {self.max_wait:g} seconds",
+                        )
+        except Overloaded:
+            raise
+        except BaseException:
+            self.release(ticket)
+            raise
+
+    def acquire(self, pool, cost):
+        # Returns a ticket to release() once the request is done, or raises
+        # Overloaded. Blocks the calling thread while it waits.
+        attempts = self._admission(pool, cost)
+        try:
+            while True:
+                time.sleep(next(attempts))
+        except StopIteration as admitted:
+            return admitted.value
+        finally:
+            attempts.close()
+
+    async def acquire_async(self, pool, cost):
+        # acquire() for the event loop. Each attempt locks, reads and writes the
+        # state file on a thread, as flock can block for as long as other workers
+        # hold it; between attempts the request waits on the loop without holding
+        # a thread.
+        loop = asyncio.get_running_loop()
+        attempts = self._admission(pool, cost)
+        while True:
+            attempt = asyncio.ensure_future(asyncio.to_thread(_attempt, attempts))
+            try:
+                admitted, value = await asyncio.shield(attempt)
+            except asyncio.CancelledError:
+                # The attempt runs to the end on its thread regardless, give back
+                # whatever it got once it's done
+                attempt.add_done_callback(
+                    lambda _: loop.run_in_executor(
+                        None, self._abandon, attempts, attempt
+                    )
+                )
+                raise
+            if admitted:
+                return value
+            try:
+                await asyncio.sleep(value)
+            except asyncio.CancelledError:
+                loop.run_in_executor(None, attempts.close)
+                raise
+
+    def _abandon(self, attempts, attempt):
+        # The ticket of a request that went away while an attempt was running
+        if not attempt.cancelled() and attempt.exception() is None:
+            admitted, ticket = attempt.result()
+            if admitted:
+                self.release(ticket)
+                return
+        attempts.close()
+
+    def release(self, ticket):
+        with self._state() as state:
+            entry = state["tickets"].pop(ticket, None)
+            if entry is not None and entry["running"]:
+                held = time.time() - entry["since"]
+                previous = state["service_time"].get(entry["pool"], held)
+                state["service_time"][entry["pool"]] = 0.8 * previous + 0.2 * held
+
+    def gauges(self):
+        running = Counter(dict.fromkeys(self.limits, 0))
+        queued = Counter(dict.fromkeys(self.limits, 0))
+        memory = 0
+        with self._state() as state:
+            for entry in state["tickets"].values():
+                if entry["running"]:
+                    running[entry["pool"]] += 1
+                    memory += entry["cost"]
+                else:
+                    queued[entry["pool"]] += 1
+        return {
+            "admission_running": (
+                "Requests running per admission pool, over all workers",
+                [({"pool": pool}, value) for pool, value in running.items()],
+            ),
+            "admission_queued": (
+                "Requests waiting for admission per pool, over all workers",
+                [({"pool": pool}, value) for pool, value in queued.items()],
+            ),
+            "admission_limit": (
+                "Requests each admission pool runs at once",
+                [({"pool": pool}, value) for pool, value in self.limits.items()],
+            ),
+            "admission_memory_bytes": (
+                "Estimated memory of the admitted requests",
+                [({}, memory)],
+            ),
+        }
+
+
+def _attempt(attempts):
+    # Run _admission() up to its next wait: (True, ticket) once admitted, otherwise
+    # (False, seconds to wait). A StopIteration can't be passed through a future.
+    try:
+        return False, next(attempts)
+    except StopIteration as admitted:
+        return True, admitted.value
+
+
+def get_control():
+    global _control
+    if _control is None and settings.ADMISSION_DIR:
+        _control = AdmissionControl(
+            str(settings.ADMISSION_DIR),
+            settings.ADMISSION_LIMITS,
+            settings.ADMISSION_QUEUE,
+            settings.ADMISSION_MAX_WAIT,
+            settings.ADMISSION_MEMORY_BYTES,
+        )
+    return _control
+
+
+def admission_gauges():
+    control = get_control()
+    return control.gauges() if control else {}
+
+
+async def _enter(pool, cost):
+    control = get_control()
+    if control is None:
+        return None
+    with stage("admission"):
+        return await control.acquire_async(pool, cost)
+
+
+def _refused(overloaded):
+    response = JsonResponse({"error": str(overloaded)}, status=503)
+    response["Retry-After"] = str(overloaded.wait)
+    return response
+
+
+def _hold(response, ticket):
+    # A streamed response (other than a finished file) is still working while it's
+    # sent, keep its slot until it's closed
+    if ticket is None:
+        return response
+    if response.streaming and not isinstance(response, FileResponse):
+        response._resource_closers.append(lambda: get_control().release(ticket))
+    else:
+        get_control().release(ticket)
+    return response
+
+
+def upload_size(request):
+    return int(request.META.get("CONTENT_LENGTH") or 0)
+
+
+def admit(pool, estimate=upload_size, authenticate=None):
+    # For async views, outside offload(): wait for one of `pool`'s slots on the
+    # event loop, then run the view. `authenticate(request)` comes first, a
+    # response it returns (e.g. a 401) is sent straight away without taking a slot
+    # or a place in the queue. `estimate(request)` is the memory in bytes the
+    # request is expected to need; it runs on a thread, so it may parse the body.
+    def decorator(view):
+        @wraps(view)
+        async def admitted_view(request, *args, **kwargs):
+            if authenticate is not None:
+                refusal = authenticate(request)
+                if refusal is not None:
+                    return refusal
+            try:
+                cost = await asyncio.to_thread(estimate, request)
+                ticket = await _enter(pool, cost)
+            except Overloaded as e:
+                return _refused(e)
+            try:
+                response = await view(request, *args, **kwargs)
+            except BaseException:
+                if ticket is not None:
+                    get_control().release(ticket)
+                raise
+            return _hold(response, ticket)
+
+        return admitted_view
+
+    return decorator
+
+
+class AdmissionViewMixin:
+    # admit() for class-based views, in the pool named by `admission_pool`. Goes
+    # before OffloadViewMixin in the bases, so that it wraps the offloaded view.
+    admission_pool = None
+
+    @classmethod
+    def memory_estimate(cls, request):
+        return upload_size(request)
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return admit(cls.admission_pool, cls.memory_estimate)(
+            super().as_view(**initkwargs)
+        )
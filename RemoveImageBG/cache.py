@@ -0,0 +1,348 @@
+import atexit
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+
+# The counts of every process that has exited, in a SharedCounters directory
+FOLDED_FILE = "folded.json"
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedCounters:
+    # Counters that add up across gunicorn workers. Every process keeps its own
+    # totals and writes them to its own file in `directory` at most once per
+    # `flush_interval`; reading the counters sums the files of all processes.
+    def __init__(self, directory, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last_flush = 0.0
+        atexit.register(self.flush)
+
+    def _ensure_process(self):
+        # Start from zero in a freshly forked worker, and name the file so a
+        # recycled pid never overwrites the totals of a worker that has exited
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._counts = Counter()
+            self._filename = f"{self._pid}-{time.time_ns()}.json"
+
+    def incr(self, name, amount=1):
+        if amount:
+            self.incr_many({name: amount})
+
+    def incr_many(self, amounts):
+        # Several counters under one lock, e.g. the buckets of a histogram
+        with self._lock:
+            self._ensure_process()
+            self._counts.update(amounts)
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._ensure_process()
+            counts = dict(self._counts)
+            self._last_flush = time.monotonic()
+        if not counts:
+            return
+        try:
+            _atomic_write(
+                os.path.join(self.directory, self._filename),
+                json.dumps(counts).encode(),
+            )
+        except OSError:
+            pass
+
+    def _fold(self, counts):
+        # Add the files of processes that have exited (and of earlier processes
+        # with a pid since recycled) into one, so the directory doesn't keep a file
+        # for every worker, pool process and restart there ever was
+        files = {}
+        for name in counts:
+            pid, _, started = name[: -len(".json")].partition("-")
+            try:
+                files.setdefault(int(pid), []).append((int(started), name))
+            except ValueError:
+                # FOLDED_FILE
+                continue
+        stale = []
+        for pid, names in files.items():
+            names.sort()
+            if _alive(pid):
+                # Only the newest file can be the living process's
+                names = names[:-1]
+            stale += [name for _, name in names]
+        if not stale:
+            return
+
+        folded = Counter(counts.get(FOLDED_FILE) or {})
+        for name in stale:
+            folded.update(counts.pop(name) or {})
+        _atomic_write(
+            os.path.join(self.directory, FOLDED_FILE), json.dumps(folded).encode()
+        )
+        counts[FOLDED_FILE] = dict(folded)
+        for name in stale:
+            _remove(os.path.join(self.directory, name))
+
+    def totals(self):
+        self.flush()
+        try:
+            lock = open(os.path.join(self.directory, ".lock"), "w")
+        except FileNotFoundError:
+            return {}
+        with lock:
+            # Readers fold too, one at a time so nothing is counted twice
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            counts = {}
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        counts[name] = json.load(f)
+                except (OSError, ValueError):
+                    continue
+            try:
+                self._fold(counts)
+            except OSError:
+                pass
+        totals = Counter()
+        for file_counts in counts.values():
+            totals.update(file_counts)
+        return dict(totals)
+
+    def reset(self):
+        with self._lock:
+            self._ensure_process()
+            self._counts.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class MemoryLRUCache:
+    # In-process cache bounded by the total size of the stored values
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def set(self, key, data):
+        # Returns the number of entries evicted to make room
+        if len(data) > self.max_bytes:
+            return 0
+        evicted = 0
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, oldest = self._entries.popitem(last=False)
+                self._size -= len(oldest)
+                evicted += 1
+        return evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class DiskLRUCache:
+    # Size-capped on-disk cache shared by every process pointing at `directory`.
+    # Entries are written atomically and their mtime is bumped on every read, so
+    # eviction removes the least recently used files first.
+    def __init__(self, directory, max_bytes, low_watermark=0.9):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.low_watermark = low_watermark
+        self._written = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def open(self, key):
+        # The entry as an open file, to be streamed out rather than read into
+        # memory. It stays readable even if it's evicted in the meantime.
+        path = self._path(key)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return f
+
+    def set(self, key, data):
+        # Returns the number of entries evicted to get back under the size cap
+        _atomic_write(self._path(key), data)
+
+        # Only rescan the directory once a tenth of the cap has been written
+        self._written += len(data)
+        if self._written < self.max_bytes // 10:
+            return 0
+        self._written = 0
+        return self.evict()
+
+    def _scan(self):
+        entries = []
+        stale_before = time.time() - 3600
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.startswith(".tmp-"):
+                    # Leftovers from a worker that died mid-write
+                    if stat.st_mtime < stale_before:
+                        _remove(path)
+                    continue
+                if name == ".lock":
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def usage(self):
+        entries = self._scan()
+        return len(entries), sum(size for _, size, _ in entries)
+
+    def evict(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker is already evicting
+                return 0
+
+            entries = self._scan()
+            total = sum(size for _, size, _ in entries)
+            if total <= self.max_bytes:
+                return 0
+
+            evicted = 0
+            target = self.max_bytes * self.low_watermark
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                _remove(path)
+                total -= size
+                evicted += 1
+            return evicted
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class TieredCache:
+    # In-process LRU in front of a shared on-disk LRU, with hit/miss/eviction counters
+    def __init__(self, memory, disk, counters):
+        self.memory = memory
+        self.disk = disk
+        self.counters = counters
+
+    def get(self, key):
+        data = self.memory.get(key)
+        if data is not None:
+            self.counters.incr("hits_memory")
+            return data
+
+        data = self.disk.get(key)
+        if data is not None:
+            self.counters.incr("hits_disk")
+            self.counters.incr("evictions_memory", self.memory.set(key, data))
+            return data
+
+        self.counters.incr("misses")
+        return None
+
+    def set(self, key, data):
+        self.counters.incr("evictions_memory", self.memory.set(key, data))
+        self.counters.incr("evictions_disk", self.disk.set(key, data))
+
+    def stats(self):
+        stats = dict.fromkeys(
+            (
+                "hits_memory",
+                "hits_disk",
+                "misses",
+                "evictions_memory",
+                "evictions_disk",
+            ),
+            0,
+        )
+        stats.update(self.counters.totals())
+        stats["memory_entries"] = len(self.memory)
+        stats["disk_entries"], stats["disk_bytes"] = self.disk.usage()
+        return stats
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+        self.counters.reset()
+
+
+def _atomic_write(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        _remove(tmp_path)
+        raise
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,100 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+
+from .metrics import observe, profile_current_thread
+from .threads import available_cores
+
+# Under ASGI the views are async: the event loop only reads uploads, writes
+# responses and waits, while the work itself runs on a bounded thread pool per
+# workload class (VIEW_EXECUTORS), so slow conversions can't starve inference and
+# any number of slow clients can stay connected without holding a thread.
+_executors = {}
+_lock = threading.Lock()
+
+
+def get_executor(name):
+    # Created on first use, so every gunicorn worker gets its own threads
+    with _lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = _executors[name] = ThreadPoolExecutor(
+                max_workers=settings.VIEW_EXECUTORS[name] or available_cores(),
+                thread_name_prefix=f"{name}-executor",
+            )
+        return executor
+
+
+async def run_in(name, func, *args, **kwargs):
+    # Run `func` on the named executor with the caller's context variables (the
+    # request's Server-Timing stages), recording how long it waited for a thread
+    context = contextvars.copy_context()
+    submitted = time.perf_counter()
+
+    def call():
+        observe(
+            "queue_wait_seconds",
+            time.perf_counter() - submitted,
+            queue=f"{name}-executor",
+        )
+        try:
+            context.run(profile_current_thread)
+            return context.run(func, *args, **kwargs)
+        finally:
+            # The request's own thread closes its connections, not these
+            close_old_connections()
+
+    return await asyncio.get_running_loop().run_in_executor(get_executor(name), call)
+
+
+async def iterate_in(name, iterator):
+    # Pull the chunks of a synchronous iterator (a ZIP being built, OCR'd pages, a
+    # file) on the executor. Django would otherwise read it all into memory on its
+    # single sync thread before sending the first byte.
+    iterator = iter(iterator)
+    loop = asyncio.get_running_loop()
+    done = object()
+    while True:
+        chunk = await loop.run_in_executor(get_executor(name), next, iterator, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+def offload(name):
+    # Turn a synchronous view, a DRF function view or APIView.as_view(), into an
+    # async view running on the named executor. Under WSGI it still works, Django
+    # runs the async view on its own loop.
+    def decorator(view):
+        @functools.wraps(view)
+        async def async_view(request, *args, **kwargs):
+            response = await run_in(name, view, request, *args, **kwargs)
+            if (
+                response.streaming
+                and not response.is_async
+                and isinstance(request, ASGIRequest)
+            ):
+                response.streaming_content = iterate_in(
+                    name, response.streaming_content
+                )
+            return response
+
+        return async_view
+
+    return decorator
+
+
+class OffloadViewMixin:
+    # offload() for class-based views, on the executor named by `executor`
+    executor = "default"
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return offload(cls.executor)(super().as_view(**initkwargs))
@@ -0,0 +1,365 @@
+import contextvars
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .cache import SharedCounters
+
+# Histograms recorded by both apps, exposed in the Prometheus text format. Every
+# series is a SharedCounters entry, so what /metrics shows is the sum over all
+# gunicorn workers and job pool processes.
+DURATION_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    math.inf,
+)
+SIZE_BUCKETS = tuple(1024**2 * mb for mb in (0.01, 0.1, 0.5, 1, 5, 10, 50)) + (
+    math.inf,
+)
+
+HISTOGRAMS = {
+    "stage_duration_seconds": (
+        "Time spent in one processing stage of a request or job",
+        DURATION_BUCKETS,
+    ),
+    "request_duration_seconds": ("Time to produce the response", DURATION_BUCKETS),
+    # queue="request" behind the proxy, "office" for a LibreOffice instance, or
+    # the kind of job in the job queue
+    "queue_wait_seconds": ("Time spent waiting before work started", DURATION_BUCKETS),
+    "request_size_bytes": ("Size of the request body", SIZE_BUCKETS),
+    "response_size_bytes": ("Size of the response body", SIZE_BUCKETS),
+}
+
+COUNTERS = {
+    # reason="queue_full" or "timeout", see RemoveImageBG.admission
+    "admission_rejected_total": "Requests refused by admission control",
+    "removebg_cascade_total": "Masks produced by each model of the cascade",
+    # inference="run" or "reused", see removebg.animation
+    "removebg_animation_frames_total": "Frames of animated uploads processed",
+}
+
+METRIC_PREFIX = "removeimagebg_"
+
+_counters = None
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+_request_sampler = contextvars.ContextVar("request_sampler", default=None)
+
+
+def counters():
+    global _counters
+    if _counters is None:
+        _counters = SharedCounters(str(settings.METRICS_DIR))
+    return _counters
+
+
+def _labels(labels):
+    return ",".join(f'{name}="{value}"' for name, value in sorted(labels.items()))
+
+
+def _le(bound):
+    return "+Inf" if bound == math.inf else repr(float(bound))
+
+
+def observe(name, value, **labels):
+    # Add a value to one of the HISTOGRAMS, buckets are stored cumulatively
+    if not settings.METRICS_DIR:
+        return
+    _, buckets = HISTOGRAMS[name]
+    metric = METRIC_PREFIX + name
+    label_text = _labels(labels)
+    separator = "," if label_text else ""
+    amounts = {
+        f'{metric}_bucket{{{label_text}{separator}le="{_le(bound)}"}}': 1
+        for bound in buckets
+        if value <= bound
+    }
+    amounts[f"{metric}_sum{{{label_text}}}"] = value
+    amounts[f"{metric}_count{{{label_text}}}"] = 1
+    counters().incr_many(amounts)
+
+
+def count(name, amount=1, **labels):
+    # Add to one of the COUNTERS
+    if settings.METRICS_DIR:
+        counters().incr(f"{METRIC_PREFIX}{name}{{{_labels(labels)}}}", amount)
+
+
+def record(stage_name, seconds):
+    # A stage timed elsewhere, e.g. in a pool process that has no request
+    observe("stage_duration_seconds", seconds, stage=stage_name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage_name, seconds))
+
+
+@contextmanager
+def stage(stage_name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage_name, time.perf_counter() - start)
+
+
+def render(gauges=None):
+    # Prometheus text exposition format 0.0.4. `gauges` are current values known
+    # to the caller, {name: (description, [(labels, value), ...])}.
+    totals = counters().totals() if settings.METRICS_DIR else {}
+    lines = []
+    for name, (description, buckets) in HISTOGRAMS.items():
+        metric = METRIC_PREFIX + name
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} histogram")
+
+        count_prefix = f"{metric}_count{{"
+        for key in sorted(key for key in totals if key.startswith(count_prefix)):
+            label_text = key[len(count_prefix) : -1]
+            separator = "," if label_text else ""
+            for bound in buckets:
+                bucket = f'{metric}_bucket{{{label_text}{separator}le="{_le(bound)}"}}'
+                lines.append(f"{bucket} {totals.get(bucket, 0)}")
+            lines.append(
+                f"{metric}_sum{{{label_text}}} {totals[f'{metric}_sum{{{label_text}}}']}"
+            )
+            lines.append(f"{key} {totals[key]}")
+
+    for name, description in COUNTERS.items():
+        metric = METRIC_PREFIX + name
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} counter")
+        lines.extend(
+            f"{key} {totals[key]}"
+            for key in sorted(totals)
+            if key.startswith(f"{metric}{{")
+        )
+
+    for name, (description, samples) in (gauges or {}).items():
+        metric = METRIC_PREFIX + name
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} gauge")
+        for labels, value in samples:
+            label_text = _labels(labels)
+            lines.append(
+                f"{metric}{{{label_text}}} {value}"
+                if label_text
+                else f"{metric} {value}"
+            )
+    return "\n".join(lines) + "\n"
+
+
+def _queue_wait(request):
+    # How long the request waited between the proxy and a worker, from the
+    # X-Request-Start header nginx sets with `proxy_set_header X-Request-Start
+    # "t=${msec}"`. Seconds, milliseconds and microseconds are all in use.
+    header = request.headers.get("X-Request-Start")
+    if not header:
+        return None
+    try:
+        started = float(header.removeprefix("t="))
+    except ValueError:
+        return None
+    for scale in (1e6, 1e3):
+        if started > time.time() * scale / 10:
+            started /= scale
+            break
+    return max(time.time() - started, 0.0)
+
+
+def server_timing(timings):
+    # One entry per stage, stages that ran several times (e.g. OCR of each
+    # page) are summed
+    durations = defaultdict(float)
+    counts = Counter()
+    for stage_name, seconds in timings:
+        durations[stage_name] += seconds
+        counts[stage_name] += 1
+    return ", ".join(
+        f"{stage_name};dur={seconds * 1000:.1f}"
+        + (f';desc="{counts[stage_name]}x"' if counts[stage_name] > 1 else "")
+        for stage_name, seconds in durations.items()
+    )
+
+
+class StackSampler:
+    # Sampling profiler for one thread: a background thread records the thread's
+    # stack every `interval` seconds, from when `thread_id` is set. The result is in the collapsed format that
+    # flamegraph.pl and speedscope read, one "outer;...;inner count" line per stack.
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.thread_id is None:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _response_size(response):
+    if not response.streaming:
+        return len(response.content)
+    if response.has_header("Content-Length"):
+        return int(response["Content-Length"])
+    return None
+
+
+def _count_streamed(response, view):
+    # Streamed responses of unknown length (ZIPs, NDJSON) are measured as they go
+    chunks = response.streaming_content
+
+    def counted():
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+        observe("response_size_bytes", size, view=view)
+
+    async def acounted():
+        size = 0
+        async for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+        observe("response_size_bytes", size, view=view)
+
+    response.streaming_content = acounted() if response.is_async else counted()
+
+
+def profile_current_thread():
+    # Under ASGI the view runs on an executor thread that isn't known when the
+    # request starts, RemoveImageBG.executors points a request's sampler at it
+    sampler = _request_sampler.get()
+    if sampler is not None and sampler.thread_id is None:
+        sampler.thread_id = threading.get_ident()
+
+
+class MetricsMiddleware:
+    # Times every request, collects the stages recorded while it ran into a
+    # Server-Timing header, and records sizes, queue wait and duration per view.
+    # PROFILE_SAMPLE_RATE of the requests are also run under the StackSampler.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        state = self._start(request, threading.get_ident())
+        try:
+            response = self.get_response(request)
+        finally:
+            self._stop(state)
+        return self._finish(request, response, state)
+
+    async def __acall__(self, request):
+        state = self._start(request, None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self._stop(state)
+        return self._finish(request, response, state)
+
+    def _start(self, request, thread_id):
+        timings = []
+        sampler = None
+        if random.random() < settings.PROFILE_SAMPLE_RATE:
+            sampler = StackSampler(thread_id, settings.PROFILE_INTERVAL)
+            sampler.start()
+        return {
+            "timings": timings,
+            "tokens": (_request_timings.set(timings), _request_sampler.set(sampler)),
+            "sampler": sampler,
+            "queue_wait": _queue_wait(request),
+            "start": time.perf_counter(),
+        }
+
+    def _stop(self, state):
+        state["elapsed"] = time.perf_counter() - state["start"]
+        timings_token, sampler_token = state["tokens"]
+        _request_timings.reset(timings_token)
+        _request_sampler.reset(sampler_token)
+        if state["sampler"] is not None:
+            state["sampler"].stop()
+
+    def _finish(self, request, response, state):
+        timings = state["timings"]
+        elapsed = state["elapsed"]
+        queue_wait = state["queue_wait"]
+        match = request.resolver_match
+        view = match.url_name or match.view_name if match else "unmatched"
+
+        if queue_wait is not None:
+            observe("queue_wait_seconds", queue_wait, queue="request")
+            timings.insert(0, ("queue", queue_wait))
+        observe("request_duration_seconds", elapsed, view=view)
+        observe(
+            "request_size_bytes",
+            int(request.META.get("CONTENT_LENGTH") or 0),
+            view=view,
+        )
+        size = _response_size(response)
+        if size is not None:
+            observe("response_size_bytes", size, view=view)
+        elif settings.METRICS_DIR:
+            _count_streamed(response, view)
+
+        if settings.SERVER_TIMING:
+            timings.append(("total", elapsed))
+            response["Server-Timing"] = server_timing(timings)
+
+        if state["sampler"] is not None:
+            state["sampler"].save(
+                os.path.join(
+                    settings.PROFILE_DIR,
+                    f"{time.time_ns()}-{os.getpid()}-{view}.folded",
+                )
+            )
+        return response
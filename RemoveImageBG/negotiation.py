@@ -0,0 +1,15 @@
+from django.http import Http404
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class FileContentNegotiation(DefaultContentNegotiation):
+    # The views return files (images, PDFs) themselves, and clients ask for them
+    # with Accept headers such as image/webp or application/pdf, or ?format=webp,
+    # that no DRF renderer produces. Use the default renderer for the view's JSON
+    # responses instead of refusing the request with a 406 or 404.
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except (NotAcceptable, Http404):
+            return renderers[0], renderers[0].media_type
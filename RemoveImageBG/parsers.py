@@ -0,0 +1,19 @@
+from rest_framework import parsers
+
+from .metrics import stage
+
+# The request body is read (and uploads spooled to memory or disk) when a view
+# first touches request.data or request.FILES, in the parser. These time it as
+# the "upload_read" stage.
+
+
+class FormParser(parsers.FormParser):
+    def parse(self, stream, media_type=None, parser_context=None):
+        with stage("upload_read"):
+            return super().parse(stream, media_type, parser_context)
+
+
+class MultiPartParser(parsers.MultiPartParser):
+    def parse(self, stream, media_type=None, parser_context=None):
+        with stage("upload_read"):
+            return super().parse(stream, media_type, parser_context)
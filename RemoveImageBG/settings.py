@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,9 +49,11 @@ INSTALLED_APPS = [
     "corsheaders",
     "rest_framework.authtoken",
     "convertor",
+    "jobs",
 ]
 
 MIDDLEWARE = [
+    "RemoveImageBG.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -135,6 +138,206 @@ STATIC_URL = "static/"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 104857600  # 100 MB
+DATA_UPLOAD_MAX_NUMBER_FILES = 200  # OFFICE_BATCH_MAX_FILES
+
+# Maximum number of images accepted in one request to the batch background removal endpoint
+REMOVEBG_MAX_BATCH_SIZE = 32
+
+# Models a request can pick with ?model=..., loaded lazily by each worker. The least
+# recently used ones are unloaded when either limit below is exceeded.
+REMOVEBG_MODELS = [
+    "u2net",
+    "u2netp",
+    "u2net_human_seg",
+    "silueta",
+    "isnet-general-use",
+    "cascade",  # see below
+]
+REMOVEBG_DEFAULT_MODEL = "u2net"
+
+# ?model=cascade runs the fast model of REMOVEBG_CASCADE_MODELS first, and the full
+# one only when more than REMOVEBG_CASCADE_THRESHOLD of the fast model's mask is
+# neither clearly subject nor clearly background (removebg.cascade.uncertainty).
+# Tune the threshold on your own photos with benchmarks/removebg_cascade.py.
+REMOVEBG_CASCADE_MODELS = ("u2netp", "u2net")  # fast, full
+REMOVEBG_CASCADE_THRESHOLD = 0.03
+
+# Uploads over this many pixels are refused from their header, before decoding
+REMOVEBG_MAX_PIXELS = 50_000_000  # 50 MP, the largest phone cameras are 48 MP
+
+# Animated GIF/WebP/APNG uploads and short video clips (needs PyAV) come back as an
+# APNG or animated WebP. Frames go through the model REMOVEBG_ANIMATION_BATCH_SIZE
+# at a time; a frame whose 64x64 grayscale thumbnail differs from the last inferred
+# frame's by at most REMOVEBG_ANIMATION_REUSE_THRESHOLD (mean absolute difference,
+# 0-255) reuses its mask, for at most REMOVEBG_ANIMATION_MAX_REUSE frames in a row.
+# Measure the trade-off on your clips with benchmarks/removebg_animation.py.
+REMOVEBG_ANIMATION_MAX_FRAMES = 300
+REMOVEBG_ANIMATION_BATCH_SIZE = 8
+REMOVEBG_ANIMATION_REUSE_THRESHOLD = 2.0
+REMOVEBG_ANIMATION_MAX_REUSE = 10
+
+# Post-processing preset used when a request doesn't pass ?enhance=, one of
+# removebg.pipeline.ENHANCE_PRESETS ("default", "subtle" or "none")
+REMOVEBG_DEFAULT_ENHANCE = "default"
+
+# Output used when a request doesn't pass ?output=, one of
+# removebg.pipeline.OUTPUT_MODES ("cutout", "mask" or "fullres")
+REMOVEBG_DEFAULT_OUTPUT = "cutout"
+
+# Encoding used when a request passes neither ?format= nor an Accept header naming
+# image/png, image/webp or image/avif, one of removebg.formats.OUTPUT_FORMATS
+REMOVEBG_DEFAULT_FORMAT = "png"
+REMOVEBG_MAX_RESIDENT_SESSIONS = 2
+REMOVEBG_SESSIONS_MEMORY_BYTES = 1536 * 1024 * 1024  # 1.5 GB per worker
+
+# Background removal result cache: a per-worker in-memory LRU in front of an
+# on-disk LRU shared by all gunicorn workers
+REMOVEBG_CACHE_DIR = BASE_DIR / "cache" / "removebg"
+REMOVEBG_CACHE_MEMORY_BYTES = 64 * 1024 * 1024  # 64 MB per worker
+REMOVEBG_CACHE_DISK_BYTES = 2 * 1024 * 1024 * 1024  # 2 GB
+
+# CPU threads. The cores this container may use (CPU affinity and cgroup quota) are
+# split evenly between the WEB_WORKERS gunicorn workers (keep it in line with
+# --workers); each worker sizes ONNX Runtime, OpenMP/BLAS and its OCR pool to its
+# share, see RemoveImageBG.threads.
+WEB_WORKERS = int(os.environ.get("WEB_CONCURRENCY", 3))
+
+# ONNX Runtime session options for the background removal models.
+# ORT_INTRA_OP_THREADS None uses the worker's share of the cores. Spinning threads
+# keep a core busy after every run waiting for more work, which only pays off when
+# nothing else wants the core.
+ORT_INTRA_OP_THREADS = None
+ORT_INTER_OP_THREADS = 1
+ORT_EXECUTION_MODE = "sequential"  # or "parallel"
+ORT_GRAPH_OPTIMIZATION = "all"  # "disabled", "basic", "extended" or "all"
+ORT_ALLOW_SPINNING = False
+
+# Under ASGI (see gunicorn.txt) the views are async and run on a thread pool
+# per workload class, sized per gunicorn worker (None: one thread per available
+# core). ONNX Runtime and Pillow release the GIL, conversions and OCR mostly wait on
+# LibreOffice, wkhtmltopdf and the OCR process pool.
+VIEW_EXECUTORS = {
+    "removebg": 2,  # background removal: decode, inference, post-processing
+    "convert": 4,  # Office and HTML to PDF
+    "ocr": 2,  # PDF OCR requests, the pages themselves run on the OCR pool
+    "default": 8,  # job submission and results, stats, metrics
+}
+
+# Admission control, over all gunicorn workers on the host: each pool runs at most
+# ADMISSION_LIMITS requests at once, up to ADMISSION_QUEUE more wait their turn for
+# at most ADMISSION_MAX_WAIT seconds, and the estimated memory of the running
+# requests (from their upload sizes) stays under ADMISSION_MEMORY_BYTES. Anything
+# else gets a 503 with a Retry-After. Requests wait on the event loop, before they
+# reach VIEW_EXECUTORS, so a limit above the pool's executor threads over all
+# workers only moves the queue into the executors. Queue depth and refusals are on
+# /metrics/. Set ADMISSION_DIR to None to turn it off.
+ADMISSION_DIR = BASE_DIR / "cache" / "admission"
+ADMISSION_LIMITS = {
+    "removebg": 6,  # /removebg/ and /removebg/batch/
+    "office": 4,  # Word, Excel and PowerPoint to PDF
+}
+ADMISSION_QUEUE = {"removebg": 24, "office": 16}
+ADMISSION_MAX_WAIT = 10  # seconds
+ADMISSION_MEMORY_BYTES = 4 * 1024 * 1024 * 1024  # 4 GB
+
+# Asynchronous jobs (the */jobs/ endpoints). Every gunicorn worker runs its jobs on
+# its own pool of JOBS_MAX_WORKERS processes and refuses new ones with a 503 once
+# JOBS_MAX_PENDING are queued or running. Results are deleted JOBS_RESULT_TTL after
+# the job finished, jobs that never finish (their worker went away) after
+# JOBS_MAX_AGE.
+JOBS_DIR = BASE_DIR / "jobs_data"
+JOBS_MAX_WORKERS = 2
+JOBS_MAX_PENDING = 16
+JOBS_RESULT_TTL = 60 * 60  # 1 hour
+JOBS_MAX_AGE = 24 * 60 * 60  # 1 day
+
+# Office -> PDF conversions run on long-lived headless LibreOffice instances, each
+# with its own profile, driven over UNO. This needs LibreOffice's `uno` module
+# (python3-uno) to be importable; without it, or with OFFICE_POOL_SIZE = 0, every
+# conversion starts a fresh soffice with a throwaway profile instead.
+OFFICE_POOL_SIZE = 2  # instances per gunicorn worker
+OFFICE_POOL_MAX_CONVERSIONS = 200  # recycle an instance after this many documents
+OFFICE_POOL_TIMEOUT = 120  # seconds allowed per conversion
+OFFICE_POOL_START_TIMEOUT = 30  # seconds allowed for an instance to start
+OFFICE_POOL_PREWARM = True
+
+# /convert/office-to-pdf/batch/ takes up to OFFICE_BATCH_MAX_FILES documents and
+# converts them in OFFICE_BATCH_PARALLELISM groups at once (None: one per pooled
+# instance, or one soffice per core without the pool), each group by one soffice
+OFFICE_BATCH_MAX_FILES = 200
+OFFICE_BATCH_PARALLELISM = None
+
+# HTML -> PDF rendering with wkhtmltopdf, in memory. Every worker keeps up to
+# HTML_PDF_POOL_SIZE wkhtmltopdf processes started and waiting for a document, for
+# the rendering options most recently used (0 starts one per request); job pool
+# processes keep at most one, they render one document at a time. Requests can
+# pick the page size, orientation, margins (mm) and JavaScript delay (ms, up to
+# HTML_PDF_MAX_JAVASCRIPT_DELAY). Remote images, stylesheets and scripts are only
+# fetched with remote_assets=true, so a slow external host can't stall a worker;
+# HTML_PDF_TIMEOUT bounds a whole rendering.
+HTML_PDF_POOL_SIZE = 2
+HTML_PDF_TIMEOUT = 60  # seconds
+HTML_PDF_PAGE_SIZE = "A4"
+HTML_PDF_MARGIN_MM = 10
+HTML_PDF_JAVASCRIPT_DELAY = 200  # ms, wkhtmltopdf's own default
+HTML_PDF_MAX_JAVASCRIPT_DELAY = 5000  # ms
+HTML_PDF_REMOTE_ASSETS = False
+
+# Office and HTML -> PDF results keyed by a hash of the input, the converter and its
+# options, on disk and shared by all gunicorn workers. Identical conversions in
+# flight at the same time run once. Set CONVERT_CACHE_DIR to None to disable.
+CONVERT_CACHE_DIR = BASE_DIR / "cache" / "convert"
+CONVERT_CACHE_BYTES = 1024 * 1024 * 1024  # 1 GB
+
+# Every convertor request works in its own temporary directory under this one,
+# removed once the response has been sent
+CONVERTOR_WORKSPACE_DIR = BASE_DIR / "temp"
+
+# Processes used to OCR PDF pages in parallel, None uses the worker's share of the
+# cores (see WEB_WORKERS)
+OCR_MAX_WORKERS = None
+
+# In "hybrid" OCR mode a page with at least OCR_NATIVE_TEXT_MIN_CHARS characters of
+# embedded text uses that text, and only its images covering at least
+# OCR_MIN_IMAGE_AREA of the page are OCR'd. "ocr" mode always runs Tesseract.
+OCR_DEFAULT_MODE = "hybrid"
+OCR_NATIVE_TEXT_MIN_CHARS = 20
+OCR_MIN_IMAGE_AREA = 0.05
+
+# Tesseract language(s) and extra command line options
+OCR_LANGUAGE = "eng"
+OCR_TESSERACT_CONFIG = ""
+
+# Default page rendering, each can be overridden per request (dpi, colorspace, crop).
+# 72 DPI RGB is what pages were always rendered at; Tesseract is usually more
+# accurate at 200-300 DPI, and "gray"/"mono" renders are 3x/24x smaller than RGB.
+# OCR_CROP_TO_CONTENT renders only the bounding box of what's drawn on the page.
+OCR_DPI = 72
+OCR_COLORSPACE = "rgb"
+OCR_CROP_TO_CONTENT = False
+
+# With tesserocr installed, pages are passed to an in-process Tesseract instead of
+# a temp file and a tesseract subprocess (OCR_TESSERACT_CONFIG may then only use
+# --psm, --oem and -c, anything else falls back to the subprocess)
+OCR_USE_TESSERACT_API = True
+
+# OCR'd text keyed by the rendered page (or image region) and the Tesseract settings,
+# on disk and shared by all gunicorn workers. Set OCR_CACHE_DIR to None to disable.
+OCR_CACHE_DIR = BASE_DIR / "cache" / "ocr"
+OCR_CACHE_BYTES = 256 * 1024 * 1024  # 256 MB
+
+# Per-stage timings (upload read, decode, inference, soffice, OCR, ...) are sent back
+# in a Server-Timing header and aggregated over all gunicorn workers and job pool
+# processes into histograms served at /metrics/ in the Prometheus text format. Set
+# METRICS_DIR to None to only send the header.
+SERVER_TIMING = True
+METRICS_DIR = BASE_DIR / "cache" / "metrics"
+
+# Run this fraction of requests (e.g. 0.01) under a sampling profiler, writing a
+# collapsed stack file per request to PROFILE_DIR for flamegraph.pl or speedscope
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_INTERVAL = 0.005  # seconds between samples
+PROFILE_DIR = BASE_DIR / "cache" / "profiles"
 
 
 # CORS_ORIGIN_ALLOW_ALL = True
@@ -152,6 +355,12 @@ DATA_UPLOAD_MAX_MEMORY_SIZE = 104857600  # 100 MB
 
 
 REST_FRAMEWORK = {
+    "DEFAULT_CONTENT_NEGOTIATION_CLASS": "RemoveImageBG.negotiation.FileContentNegotiation",
+    "DEFAULT_PARSER_CLASSES": (
+        "rest_framework.parsers.JSONParser",
+        "RemoveImageBG.parsers.FormParser",
+        "RemoveImageBG.parsers.MultiPartParser",
+    ),
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 10,
     "DEFAULT_SCHEMA_CLASS": "rest_framework.schemas.coreapi.AutoSchema",
@@ -0,0 +1,32 @@
+import zipfile
+
+
+class _ChunkSink:
+    # Write-only, non-seekable target for ZipFile. zipfile falls back to data
+    # descriptors when it can't seek, so each entry can be flushed as soon as it
+    # has been written.
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries, compression=zipfile.ZIP_STORED):
+    # Yield a ZIP archive chunk by chunk from an iterable of (name, bytes) pairs,
+    # without holding the whole archive in memory
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=compression) as archive:
+        for name, data in entries:
+            archive.writestr(name, data)
+            yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,68 @@
+import math
+import os
+
+from django.conf import settings
+
+# Native thread pools size themselves to every core of the machine by default, in
+# each of the gunicorn workers and in each of their pool processes. Instead every
+# worker gets an equal share of the cores this container may use (CPU affinity and
+# cgroup quota) and sizes ONNX Runtime, OpenMP/BLAS (NumPy) and Tesseract to it.
+
+# Read by the OpenMP, OpenBLAS and MKL runtimes when they start, and by Tesseract
+# (OMP_THREAD_LIMIT), in this process and the processes it starts
+NATIVE_THREAD_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OMP_THREAD_LIMIT",
+)
+
+_process_threads = None
+
+
+def cgroup_cpu_limit():
+    # The container's CPU quota in cores, None when it has none. cgroup v2 has
+    # "<quota> <period>" in cpu.max, v1 the two in separate files.
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = f.read().strip()
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = f.read().strip()
+        except OSError:
+            return None
+    if quota in ("max", "-1"):
+        return None
+    return int(quota) / int(period)
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        cores = min(cores, max(1, math.ceil(limit)))
+    return cores
+
+
+def thread_budget(processes=1):
+    # Threads for each of `processes` processes sharing one web worker's cores
+    return max(1, available_cores() // (settings.WEB_WORKERS * processes))
+
+
+def limit_threads(threads):
+    # Called when a process starts, before the native libraries start their pools
+    global _process_threads
+    _process_threads = threads
+    for name in NATIVE_THREAD_VARS:
+        os.environ[name] = str(threads)
+
+
+def process_threads():
+    # What limit_threads() set, otherwise a web worker's share
+    return _process_threads or thread_budget()
@@ -18,8 +18,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 
+from . import views
+
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics/", views.metrics, name="metrics"),
     path("", include("removebg.urls")),
     path("", include("convertor.urls")),
+    path("", include("jobs.urls")),
 ]
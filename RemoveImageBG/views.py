@@ -0,0 +1,19 @@
+from django.http import HttpResponse
+from rest_framework.decorators import api_view
+
+from removebg.secret import require_client_secret
+
+from .admission import admission_gauges
+from .executors import offload
+from .metrics import render
+
+
+@offload("default")
+@api_view(["GET"])
+@require_client_secret
+def metrics(request):
+    # Prometheus scrape target, summed over all workers. Scrape it with the
+    # CLIENT-KEY and CLIENT-SECRET headers (http_headers in the scrape config).
+    return HttpResponse(
+        render(admission_gauges()), content_type="text/plain; version=0.0.4"
+    )
@@ -13,4 +13,16 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "RemoveImageBG.settings")
 
+# Size this worker's OpenMP, BLAS and Tesseract threads before anything starts them
+from RemoveImageBG.threads import limit_threads, thread_budget  # noqa: E402
+
+limit_threads(thread_budget())
+
 application = get_wsgi_application()
+
+# Start this worker's pooled LibreOffice instances and wkhtmltopdf processes now
+# rather than on the first conversion
+from convertor import html, office  # noqa: E402
+
+office.prewarm()
+html.prewarm()
@@ -0,0 +1,219 @@
+# Throughput and latency of /removebg/ under concurrent load while slow clients
+# hold connections open, served by gunicorn's sync WSGI workers compared with
+# uvicorn workers on the ASGI application. The slow clients send their upload a
+# byte at a time, like phones on a bad connection.
+#
+# Needs gunicorn and uvicorn-worker, and the u2netp model (downloaded by rembg on
+# first use). Every request uploads a different photo so none is answered from the
+# result cache.
+#
+#   python -m benchmarks.asgi_load --workers 3 --slow-clients 50 --requests 60
+
+import argparse
+import asyncio
+import io
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+from PIL import Image
+
+from benchmarks.fixtures import photo
+
+PHOTO_SIZE = (640, 480)
+
+SERVERS = {
+    "wsgi sync": ["--worker-class", "sync", "RemoveImageBG.wsgi:application"],
+    "asgi uvicorn": [
+        "--worker-class",
+        "uvicorn_worker.UvicornWorker",
+        "RemoveImageBG.asgi:application",
+    ],
+}
+
+
+def unique_photo():
+    # The photo's noise repeats from one run to the next, a random JPEG comment
+    # keeps it out of the result cache of earlier runs
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(photo(PHOTO_SIZE))).save(
+        buffer, "JPEG", quality=90, comment=uuid.uuid4().hex
+    )
+    return buffer.getvalue()
+
+
+def _headers():
+    from RemoveImageBG.settings import WW_PLATFORM_SECRET_VAR_KEY
+
+    return {
+        "CLIENT-KEY": "WWS_WW_PLATFORM_SECRET",
+        "CLIENT-SECRET": WW_PLATFORM_SECRET_VAR_KEY["WWS_WW_PLATFORM_SECRET"],
+    }
+
+
+def multipart_request(port, image):
+    boundary = uuid.uuid4().hex
+    body = (
+        (
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="image"; filename="photo.jpg"\r\n'
+            "Content-Type: image/jpeg\r\n\r\n"
+        ).encode()
+        + image
+        + f"\r\n--{boundary}--\r\n".encode()
+    )
+    headers = {
+        "Host": f"127.0.0.1:{port}",
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(len(body)),
+        "Connection": "close",
+        **_headers(),
+    }
+    head = "POST /removebg/?model=u2netp HTTP/1.1\r\n" + "".join(
+        f"{name}: {value}\r\n" for name, value in headers.items()
+    )
+    return (head + "\r\n").encode(), body
+
+
+async def fetch(port, head, body, timeout):
+    # One request on its own connection, returns the status code (0 on timeout)
+    async def exchange():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(head + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+        writer.close()
+        return int(status_line.split()[1]) if status_line else 0
+
+    try:
+        return await asyncio.wait_for(exchange(), timeout)
+    except (asyncio.TimeoutError, ConnectionError):
+        return 0
+
+
+async def slow_client(port, head, body, stop):
+    # Send the headers, then dribble the body until the test is over
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(head)
+        for byte in body:
+            if stop.is_set():
+                break
+            writer.write(bytes([byte]))
+            await writer.drain()
+            await asyncio.sleep(0.5)
+        writer.close()
+    except ConnectionError:
+        pass
+
+
+async def load(port, images, args):
+    head, body = multipart_request(port, images[0])
+    stop = asyncio.Event()
+    slow = [
+        asyncio.create_task(slow_client(port, head, body, stop))
+        for _ in range(args.slow_clients)
+    ]
+    await asyncio.sleep(1)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, errors = [], 0
+
+    async def one(image):
+        nonlocal errors
+        head, body = multipart_request(port, image)
+        async with semaphore:
+            start = time.perf_counter()
+            status = await fetch(port, head, body, args.timeout)
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(image) for image in images[1:]))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await asyncio.gather(*slow)
+    return elapsed, latencies, errors
+
+
+def wait_for_port(port, deadline=60):
+    end = time.monotonic() + deadline
+    while time.monotonic() < end:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.2)
+    raise RuntimeError(f"Server did not start on port {port}")
+
+
+def run_server(name, args, images):
+    port = args.port
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--workers",
+            str(args.workers),
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--timeout",
+            str(args.timeout),
+            *SERVERS[name],
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env={**os.environ, "DJANGO_SETTINGS_MODULE": "RemoveImageBG.settings"},
+        start_new_session=True,
+    )
+    try:
+        wait_for_port(port)
+        # Load the model in every worker before measuring
+        for _ in range(args.workers * 2):
+            head, body = multipart_request(port, unique_photo())
+            asyncio.run(fetch(port, head, body, args.timeout))
+        return asyncio.run(load(port, images, args))
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WSGI vs ASGI under concurrent load")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--slow-clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--timeout", type=int, default=60)
+    parser.add_argument("--port", type=int, default=8790)
+    args = parser.parse_args()
+
+    print(
+        f"{args.workers} workers, {args.slow_clients} slow clients, "
+        f"{args.requests} requests {args.concurrency} at a time"
+    )
+    print(f"{'server':<13} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'failed':>7}")
+    for name in SERVERS:
+        images = [unique_photo() for _ in range(args.requests + 1)]
+        elapsed, latencies, errors = run_server(name, args, images)
+        if latencies:
+            p50 = statistics.median(latencies) * 1000
+            p95 = statistics.quantiles(latencies, n=20)[-1] * 1000
+        else:
+            p50 = p95 = float("nan")
+        print(
+            f"{name:<13} {len(latencies) / elapsed:7.1f} {p50:8.0f} {p95:8.0f} {errors:7d}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+# Offline inputs for the benchmark suite: synthetic photos, generated PDFs with and
+# without a text layer, Office and HTML documents, a tiny ONNX stand-in for the
+# U2Net models and stub executables for whatever of LibreOffice, wkhtmltopdf and
+# Tesseract isn't installed. Nothing is downloaded.
+
+import io
+import os
+import shutil
+import stat
+import textwrap
+import zipfile
+
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+# The model input the rembg U2Net sessions feed: 1x3x320x320, normalized RGB
+MODEL_INPUT_SIZE = (320, 320)
+
+CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+</Types>"""
+
+RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+DOCUMENT = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">
+<w:body>{paragraphs}</w:body>
+</w:document>"""
+
+TEXT = (
+    "The quick brown fox jumps over the lazy dog. Pack my box with five dozen "
+    "liquor jugs. Sphinx of black quartz, judge my vow. "
+)
+
+# Stand-ins for the external tools, used only when the real one isn't on PATH.
+# They take the same arguments the convertor passes and copy a blank PDF (or
+# write fixed text) to where the caller expects the output.
+STUBS = {
+    # convertor.office runs soffice as "libreoffice" on Linux
+    # Like soffice, it skips inputs it can't convert (here: empty files)
+    "libreoffice": """#!/bin/sh
+# libreoffice --headless --convert-to pdf INPUT... --outdir DIR
+outdir=.
+inputs=""
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --outdir) outdir="$2"; shift ;;
+        --convert-to) shift ;;
+        -*) ;;
+        *) inputs="$inputs
+$1" ;;
+    esac
+    shift
+done
+echo "$inputs" | while IFS= read -r input; do
+    [ -s "$input" ] || continue
+    name=$(basename "$input")
+    cp "{blank_pdf}" "$outdir/${{name%.*}}.pdf"
+done
+""",
+    "wkhtmltopdf": """#!/bin/sh
+# wkhtmltopdf [OPTIONS] - OUTPUT, with the HTML on stdin, OUTPUT - for stdout
+[ "$1" = "--version" ] && {{ echo "wkhtmltopdf 0.12.6 (stub)"; exit 0; }}
+for output; do :; done
+cat > /dev/null
+if [ "$output" = "-" ]; then cat "{blank_pdf}"; else cp "{blank_pdf}" "$output"; fi
+""",
+    "tesseract": """#!/bin/sh
+# tesseract INPUT OUTPUTBASE [OPTIONS] txt
+[ "$1" = "--version" ] && {{ echo "tesseract 5.3.0 (stub)"; exit 0; }}
+echo "{text}" > "$2.txt"
+""",
+}
+
+
+def photo(size, quality=90):
+    # A JPEG "product shot": a soft-edged subject on a textured background, so
+    # the model, the cut-out and the encoders all have realistic work to do
+    width, height = size
+    gradient = Image.linear_gradient("L")
+    background = Image.merge(
+        "RGB",
+        [
+            gradient.resize(size),
+            gradient.rotate(90).resize(size),
+            Image.effect_noise(size, 30),
+        ],
+    )
+
+    subject = Image.new("L", size)
+    ImageDraw.Draw(subject).ellipse(
+        (width // 4, height // 6, width * 3 // 4, height * 5 // 6), fill=255
+    )
+    subject = subject.filter(ImageFilter.GaussianBlur(max(size) / 200))
+    background.paste((200, 60, 40), mask=subject)
+
+    buffer = io.BytesIO()
+    background.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def animated_gif(size, frames=60, still=4, duration=40):
+    # A GIF "clip": the subject of photo() holds still for `still` frames (only
+    # the background noise changes), then jumps, like a product on a turntable
+    width, height = size
+    gradient = Image.linear_gradient("L")
+    subject = Image.new("L", size)
+    ImageDraw.Draw(subject).ellipse(
+        (width // 4, height // 6, width * 3 // 4, height * 5 // 6), fill=255
+    )
+    subject = subject.filter(ImageFilter.GaussianBlur(max(size) / 200))
+
+    images = []
+    for index in range(frames):
+        background = Image.merge(
+            "RGB",
+            [
+                gradient.resize(size),
+                gradient.rotate(90).resize(size),
+                Image.effect_noise(size, 4).point(lambda value: value // 8),
+            ],
+        )
+        offset = (index // still) * width // 40
+        background.paste((200, 60, 40), (offset, 0), subject)
+        images.append(background)
+
+    buffer = io.BytesIO()
+    images[0].save(
+        buffer,
+        format="GIF",
+        save_all=True,
+        append_images=images[1:],
+        duration=duration,
+        loop=0,
+    )
+    return buffer.getvalue()
+
+
+def _text_page(pdf_document, page_number):
+    # A page filled with text a line at a time. insert_textbox() writes nothing
+    # at all when the text overflows its box.
+    page = pdf_document.new_page()  # A4-ish default, 595x842 pt
+    lines = [f"Page {page_number + 1}", ""] + textwrap.wrap(TEXT * 40, 85)
+    y = 50 + 11
+    for line in lines:
+        if y > page.rect.height - 50:
+            break
+        page.insert_text((50, y), line, fontsize=11)
+        y += 14
+    return page
+
+
+def text_pdf(path, pages=3):
+    # Born-digital pages with a text layer, hybrid OCR reads them natively
+    with fitz.open() as pdf_document:
+        for page_number in range(pages):
+            _text_page(pdf_document, page_number)
+        if TEXT.split(".")[0] not in pdf_document[0].get_text():
+            raise RuntimeError("The generated PDF has no text layer")
+        pdf_document.save(path)
+
+
+def scanned_pdf(path, pages=3, dpi=150):
+    # The same pages rasterized to grayscale images with no text layer, like
+    # the output of a document scanner, every page has to go through Tesseract
+    with fitz.open() as source, fitz.open() as pdf_document:
+        for page_number in range(pages):
+            pix = _text_page(source, page_number).get_pixmap(
+                dpi=dpi, colorspace=fitz.csGRAY
+            )
+            page = pdf_document.new_page(
+                width=source[page_number].rect.width,
+                height=source[page_number].rect.height,
+            )
+            page.insert_image(page.rect, pixmap=pix)
+        pdf_document.save(path)
+
+
+def write_docx(path, paragraphs=20):
+    body = "".join(
+        f"<w:p><w:r><w:t>Benchmark paragraph {index}</w:t></w:r></w:p>"
+        for index in range(paragraphs)
+    )
+    with zipfile.ZipFile(path, "w") as docx:
+        docx.writestr("[Content_Types].xml", CONTENT_TYPES)
+        docx.writestr("_rels/.rels", RELS)
+        docx.writestr("word/document.xml", DOCUMENT.format(paragraphs=body))
+
+
+def html_document(paragraphs=50):
+    body = "".join(f"<p>{index}. {TEXT}</p>" for index in range(paragraphs))
+    return f"<!DOCTYPE html><html><body><h1>Benchmark</h1>{body}</body></html>"
+
+
+def tiny_model(path):
+    # A U2Net-shaped ONNX graph, a 3x3 convolution and a sigmoid: same input and
+    # output layout as the real models, so rembg's u2net_custom session runs it
+    # like u2net at a fraction of the inference cost. Timings with it measure
+    # everything around the model, not the model itself.
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.default_rng(0)
+    weights = numpy_helper.from_array(
+        rng.normal(0, 0.5, (1, 3, 3, 3)).astype(np.float32), "weights"
+    )
+    bias = numpy_helper.from_array(np.zeros(1, dtype=np.float32), "bias")
+
+    width, height = MODEL_INPUT_SIZE
+    graph = helper.make_graph(
+        [
+            helper.make_node(
+                "Conv", ["input.1", "weights", "bias"], ["logits"], pads=[1, 1, 1, 1]
+            ),
+            helper.make_node("Sigmoid", ["logits"], ["mask"]),
+        ],
+        "tiny_u2net",
+        [
+            helper.make_tensor_value_info(
+                "input.1", TensorProto.FLOAT, ["batch", 3, height, width]
+            )
+        ],
+        [
+            helper.make_tensor_value_info(
+                "mask", TensorProto.FLOAT, ["batch", 1, height, width]
+            )
+        ],
+        initializer=[weights, bias],
+    )
+    model = helper.make_model(
+        graph, opset_imports=[helper.make_opsetid("", 17)], ir_version=8
+    )
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+
+
+def blank_pdf(path):
+    with fitz.open() as pdf_document:
+        pdf_document.new_page().insert_text((72, 72), "Converted by a stub")
+        pdf_document.save(path)
+
+
+def stub_executables(directory):
+    # Write a stub for each tool that isn't installed into `directory`, to be put
+    # first on PATH. Returns the names of the stubbed tools.
+    os.makedirs(directory, exist_ok=True)
+    blank_path = os.path.join(directory, "blank.pdf")
+    blank_pdf(blank_path)
+
+    stubbed = []
+    for name, script in STUBS.items():
+        if shutil.which(name):
+            continue
+        path = os.path.join(directory, name)
+        with open(path, "w") as f:
+            f.write(script.format(blank_pdf=blank_path, text=TEXT.strip()))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP)
+        stubbed.append(name)
+    return stubbed
+
+
+if __name__ == "__main__":
+    # Regenerate the stand-in model the suite uses, needs the onnx package
+    tiny_model(os.path.join(os.path.dirname(__file__), "data", "tiny_u2net.onnx"))
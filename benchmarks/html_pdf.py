@@ -0,0 +1,99 @@
+# Requests per second of HTML -> PDF rendering for a small and a large document:
+# wkhtmltopdf writing to a file that is read back (how ConvertToPdf used to work),
+# a new wkhtmltopdf per request returning the PDF on stdout, and the pool of
+# wkhtmltopdf processes started ahead of time (convertor.html). Without
+# wkhtmltopdf installed a stub is used, which only measures process handling.
+#
+#   python -m benchmarks.html_pdf --concurrency 4 --requests 40
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "RemoveImageBG.settings")
+django.setup()
+
+import pdfkit  # noqa: E402
+
+from benchmarks.fixtures import html_document, stub_executables  # noqa: E402
+from convertor.html import RendererPool, html_options  # noqa: E402
+
+
+def to_file(html, options, workdir):
+    path = os.path.join(workdir, f"{threading.get_ident()}.pdf")
+    pdfkit.from_string(html, path, options=options)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def measure(render, html, concurrency, requests):
+    latencies = []
+    lock = threading.Lock()
+
+    def run(count):
+        for _ in range(count):
+            start = time.perf_counter()
+            render(html)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [
+        threading.Thread(target=run, args=(requests // concurrency,))
+        for _ in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, statistics.median(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTML to PDF requests per second")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument(
+        "--paragraphs",
+        type=int,
+        nargs=2,
+        default=[20, 2000],
+        metavar=("SMALL", "LARGE"),
+    )
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="html-bench-")
+    stubbed = stub_executables(os.path.join(workdir, "bin"))
+    os.environ["PATH"] = os.path.join(workdir, "bin") + os.pathsep + os.environ["PATH"]
+    if stubbed:
+        print(f"Stubbed, not installed: {', '.join(stubbed)}")
+
+    options = html_options()
+    pool = RendererPool(args.concurrency, timeout=120)
+    pool.warm(options)
+    methods = {
+        "file": lambda html: to_file(html, options, workdir),
+        "stdout": lambda html: pdfkit.from_string(html, False, options=options),
+        "pooled": lambda html: pool.render(html, options),
+    }
+
+    print(f"{args.concurrency} at a time, {args.requests} requests each")
+    print(f"{'document':<18} {'method':<8} {'req/s':>7} {'p50 ms':>8}")
+    for name, paragraphs in zip(("small", "large"), args.paragraphs):
+        html = html_document(paragraphs)
+        label = f"{name} ({len(html) // 1024} KB)"
+        for method, render in methods.items():
+            render(html)  # warm-up
+            throughput, p50 = measure(render, html, args.concurrency, args.requests)
+            print(f"{label:<18} {method:<8} {throughput:7.1f} {p50:8.1f}")
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
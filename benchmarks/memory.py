@@ -0,0 +1,27 @@
+# Resident memory of the current process, from /proc (Linux only).
+#
+# getrusage's ru_maxrss is no good for the benchmarks' child processes: Linux
+# carries the parent's high-water mark over across fork and exec. VmHWM is the
+# process's own, and writing 5 to clear_refs resets it to the current RSS so the
+# peak of a single phase can be measured.
+
+import re
+
+
+def _status_mb(field):
+    with open("/proc/self/status") as f:
+        match = re.search(rf"^{field}:\s+(\d+) kB", f.read(), re.MULTILINE)
+    return int(match.group(1)) / 1024
+
+
+def rss_mb():
+    return _status_mb("VmRSS")
+
+
+def peak_mb():
+    return _status_mb("VmHWM")
+
+
+def reset_peak():
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
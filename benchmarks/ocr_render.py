@@ -0,0 +1,142 @@
+# Pages/sec and peak memory of PDF OCR at 72, 150 and 300 DPI, per colorspace and
+# Tesseract backend (pytesseract subprocess vs in-process tesserocr when installed).
+# Every configuration runs in a fresh process so its peak RSS is its own.
+#
+#   python -m benchmarks.ocr_render --pages 10
+#   python -m benchmarks.ocr_render --pdf scan.pdf --crop
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import django
+import fitz  # PyMuPDF
+
+from benchmarks.memory import peak_mb
+
+LOREM = (
+    "The quick brown fox jumps over the lazy dog. Pack my box with five dozen "
+    "liquor jugs. How vexingly quick daft zebras jump! Sphinx of black quartz, "
+    "judge my vow. "
+)
+
+
+def generated_pdf(path, pages):
+    # A4 pages of wrapped body text with a margin, like a typical letter
+    with fitz.open() as pdf_document:
+        for number in range(pages):
+            page = pdf_document.new_page()
+            page.insert_textbox(
+                fitz.Rect(72, 72, page.rect.width - 72, page.rect.height - 72),
+                f"Page {number + 1}\n\n" + LOREM * 12,
+                fontsize=11,
+            )
+        pdf_document.save(path)
+
+
+def run_child(pdf_path, dpi, colorspace, crop, backend, repeat):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "RemoveImageBG.settings")
+    django.setup()
+
+    from convertor import ocr
+
+    if backend == "pytesseract":
+        ocr.tesserocr = None
+
+    options = ocr.ocr_options(ocr.render_options(dpi, colorspace, crop))
+    options["cache_dir"] = None
+
+    page_numbers = ocr.select_pages(pdf_path, None)
+    render_seconds = 0.0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page_number in page_numbers:
+            # Same work as ocr_page, with the render timed on its own
+            with fitz.open(pdf_path) as pdf_document:
+                page = pdf_document[page_number]
+                render_start = time.perf_counter()
+                clip = ocr._content_bbox(page) if options["crop"] else None
+                pix = page.get_pixmap(
+                    dpi=options["dpi"],
+                    colorspace=fitz.csRGB if colorspace == "rgb" else fitz.csGRAY,
+                    clip=clip,
+                    alpha=False,
+                )
+                render_seconds += time.perf_counter() - render_start
+                ocr.recognize(pix, options)
+    seconds = time.perf_counter() - start
+
+    pages = len(page_numbers) * repeat
+    print(
+        json.dumps(
+            {
+                "pages_per_second": pages / seconds,
+                "render_ms": render_seconds / pages * 1000,
+                "peak_rss_mb": peak_mb(),
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF OCR throughput per DPI")
+    parser.add_argument("--pdf", help="PDF to OCR, a text PDF is generated if omitted")
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--crop", action="store_true")
+    parser.add_argument("--child", nargs=3, metavar=("DPI", "COLORSPACE", "BACKEND"))
+    args = parser.parse_args()
+
+    if args.child:
+        dpi, colorspace, backend = args.child
+        run_child(args.pdf, int(dpi), colorspace, args.crop, backend, args.repeat)
+        return
+
+    from convertor.ocr import tesserocr
+
+    backends = ["pytesseract"] + (["tesserocr"] if tesserocr is not None else [])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = args.pdf
+        if pdf_path is None:
+            pdf_path = os.path.join(tmp, "benchmark.pdf")
+            generated_pdf(pdf_path, args.pages)
+
+        print(
+            f"{'dpi':>4} {'colorspace':<10} {'backend':<12} pages/s  render ms  peak MB"
+        )
+        for dpi in (72, 150, 300):
+            for colorspace in ("rgb", "gray", "mono"):
+                for backend in backends:
+                    command = [
+                        sys.executable,
+                        "-m",
+                        "benchmarks.ocr_render",
+                        "--pdf",
+                        pdf_path,
+                        "--repeat",
+                        str(args.repeat),
+                        "--child",
+                        str(dpi),
+                        colorspace,
+                        backend,
+                    ]
+                    if args.crop:
+                        command.append("--crop")
+                    output = subprocess.run(
+                        command, check=True, capture_output=True, text=True
+                    ).stdout
+                    result = json.loads(output.strip().splitlines()[-1])
+                    print(
+                        f"{dpi:>4} {colorspace:<10} {backend:<12} "
+                        f"{result['pages_per_second']:7.2f}  "
+                        f"{result['render_ms']:9.1f}  {result['peak_rss_mb']:7.1f}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Latency of converting a small DOCX with a freshly spawned soffice compared with
+# a pooled, pre-warmed instance. Needs LibreOffice, and its `uno` module for the
+# pooled numbers.
+#
+#   python -m benchmarks.office_pool --repeat 10
+
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "RemoveImageBG.settings")
+django.setup()
+
+from benchmarks.fixtures import write_docx  # noqa: E402
+from convertor.office import convert_with_new_process, get_pool  # noqa: E402
+
+
+def measure(convert, input_path, outdir, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        convert(input_path, outdir)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    print(
+        f"{name:<8} median {statistics.median(timings) * 1000:8.1f} ms"
+        f"  min {min(timings) * 1000:8.1f} ms  max {max(timings) * 1000:8.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Cold-spawn vs pooled LibreOffice conversion latency"
+    )
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="office-bench-")
+    try:
+        input_path = os.path.join(workdir, "small.docx")
+        write_docx(input_path)
+
+        report(
+            "cold", measure(convert_with_new_process, input_path, workdir, args.repeat)
+        )
+
+        pool = get_pool()
+        if pool is None:
+            print("pooled   skipped, the uno module is not available")
+            return
+
+        # The first conversion starts the instance, leave it out like a pre-warmed pool
+        pool.convert(input_path, workdir)
+        report("pooled", measure(pool.convert, input_path, workdir, args.repeat))
+        pool.shutdown()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# Inference throughput and latency with several gunicorn workers running the model
+# at once, for ONNX Runtime's default thread settings (a spinning thread per core
+# in every worker) against the thread budget (RemoveImageBG.threads) and a sweep of
+# fixed intra-op thread counts.
+#
+# Every worker is a separate process running --concurrency inferences at a time,
+# like the removebg executor of a web worker.
+#
+#   python -m benchmarks.ort_threads --workers 3 --model u2netp --requests 20
+
+import argparse
+import io
+import multiprocessing
+import os
+import statistics
+import threading
+import time
+
+CONFIGS = {
+    "ort defaults": None,
+    "budget": {},
+}
+
+
+def _session(model_name, config):
+    from rembg import new_session
+
+    from removebg.sessions import session_options
+
+    if config is None:
+        return new_session(model_name)
+    return new_session(model_name, sess_opts=session_options(**config))
+
+
+def worker(model_name, config, requests, concurrency, barrier, results):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "RemoveImageBG.settings")
+    if config is not None:
+        from RemoveImageBG.threads import limit_threads, thread_budget
+
+        limit_threads(config.get("intra_op_threads") or thread_budget())
+
+    import django
+
+    django.setup()
+
+    from benchmarks.fixtures import photo
+    from removebg.pipeline import downscale, open_image, predict_mask
+
+    session = _session(model_name, config)
+    img = downscale(open_image(io.BytesIO(photo((1920, 1080)))))
+    predict_mask(session, img)  # warm-up
+
+    latencies = []
+    lock = threading.Lock()
+
+    def run(count):
+        for _ in range(count):
+            start = time.perf_counter()
+            predict_mask(session, img)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    barrier.wait()
+    threads = [
+        threading.Thread(target=run, args=(requests // concurrency,))
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((time.perf_counter(), latencies))
+
+
+def measure(model_name, config, args):
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(args.workers + 1)
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=worker,
+            args=(
+                model_name,
+                config,
+                args.requests,
+                args.concurrency,
+                barrier,
+                results,
+            ),
+        )
+        for _ in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    barrier.wait()
+    start = time.perf_counter()
+
+    finished, latencies = [], []
+    for _ in processes:
+        end, worker_latencies = results.get()
+        finished.append(end)
+        latencies.extend(worker_latencies)
+    for process in processes:
+        process.join()
+
+    elapsed = max(finished) - start
+    latencies.sort()
+    return (
+        len(latencies) / elapsed,
+        statistics.median(latencies) * 1000,
+        latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="ONNX Runtime thread settings under several workers"
+    )
+    parser.add_argument("--model", default="u2netp")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument(
+        "--requests", type=int, default=20, help="Inferences per worker"
+    )
+    parser.add_argument(
+        "--intra-op-threads",
+        type=int,
+        nargs="*",
+        default=[1, 2, 4],
+        help="Fixed intra-op thread counts to sweep (spinning off)",
+    )
+    args = parser.parse_args()
+
+    # The budget splits the cores between this many workers
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    from RemoveImageBG.threads import available_cores
+
+    configs = dict(CONFIGS)
+    for threads in args.intra_op_threads:
+        configs[f"intra {threads}"] = {"intra_op_threads": threads}
+
+    print(
+        f"{available_cores()} cores, {args.workers} workers, "
+        f"{args.concurrency} inferences at a time each, {args.model}"
+    )
+    print(f"{'threads':<14} {'inf/s':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, config in configs.items():
+        throughput, p50, p99 = measure(args.model, config, args)
+        print(f"{name:<14} {throughput:7.1f} {p50:8.0f} {p99:8.0f}")
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "RemoveImageBG.settings")
+    main()
@@ -0,0 +1,110 @@
+# Frames per second and share of frames that skip the model when removing the
+# background of an animation, for a sweep of reuse thresholds (see
+# REMOVEBG_ANIMATION_REUSE_THRESHOLD) against running the model on every frame.
+#
+# Every run goes all the way to an APNG, as /removebg/ streams it. The alpha error
+# is the mean absolute difference of each frame's alpha against the every-frame
+# run. Without --input, a generated GIF (benchmarks.fixtures.animated_gif) is used.
+#
+#   python -m benchmarks.removebg_animation --input clip.gif --thresholds 1 2 4
+
+import argparse
+import io
+import os
+import time
+
+import numpy as np
+
+
+def run(session, upload, options, batch_size, threshold, max_reuse):
+    from removebg.animation import AnimationCutout, open_animation
+    from removebg.formats import stream_apng
+
+    upload.seek(0)
+    animation = open_animation(upload)
+    cutout = AnimationCutout(session, options, batch_size, threshold, max_reuse)
+    alphas = []
+
+    def frames():
+        for img, duration in cutout.frames(animation):
+            alphas.append(np.asarray(img.getchannel("A"), dtype=np.int16))
+            yield img, duration
+
+    start = time.perf_counter()
+    size = sum(
+        len(chunk)
+        for chunk in stream_apng(frames(), animation.frame_count, options["format"])
+    )
+    elapsed = time.perf_counter() - start
+    return {
+        "fps": animation.frame_count / elapsed,
+        "skipped": cutout.reused / animation.frame_count,
+        "bytes": size,
+        "alphas": alphas,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Animated background removal")
+    parser.add_argument("--input", help="An animated GIF/WebP/APNG or a video clip")
+    parser.add_argument("--frames", type=int, default=60, help="Generated frames")
+    parser.add_argument("--model", default="u2netp")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-reuse", type=int, default=10)
+    parser.add_argument(
+        "--thresholds", type=float, nargs="+", default=[1.0, 2.0, 4.0, 8.0]
+    )
+    args = parser.parse_args()
+
+    import django
+
+    django.setup()
+
+    from rembg import new_session
+
+    from benchmarks.fixtures import animated_gif
+    from removebg.pipeline import cutout_options
+
+    if args.input:
+        upload = open(args.input, "rb")
+    else:
+        upload = io.BytesIO(animated_gif((640, 480), args.frames))
+        upload.name = "generated.gif"
+    session = new_session(args.model)
+    options = cutout_options(fmt="png-fast")
+
+    baseline = run(session, upload, options, args.batch_size, -1, 0)
+    print(f"{len(baseline['alphas'])} frames, {args.model}")
+    print(
+        f"{'':<16} {'frames/s':>9} {'skipped':>8} {'alpha err':>10} {'max err':>8} "
+        f"{'KB':>8}"
+    )
+
+    def report(name, result):
+        errors = [
+            float(np.abs(alpha - reference).mean())
+            for alpha, reference in zip(result["alphas"], baseline["alphas"])
+        ]
+        print(
+            f"{name:<16} {result['fps']:9.1f} {result['skipped']:8.0%} "
+            f"{np.mean(errors):10.2f} {max(errors):8.2f} {result['bytes'] / 1024:8.0f}"
+        )
+
+    report("every frame", baseline)
+    for threshold in args.thresholds:
+        report(
+            f"reuse <= {threshold:g}",
+            run(
+                session,
+                upload,
+                options,
+                args.batch_size,
+                threshold,
+                args.max_reuse,
+            ),
+        )
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "RemoveImageBG.settings")
+    main()
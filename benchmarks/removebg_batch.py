@@ -0,0 +1,60 @@
+# Throughput of the batched forward pass used by /removebg/batch/ compared with
+# one forward pass per image.
+#
+#   python -m benchmarks.removebg_batch --model u2net --sizes 1 4 16 32
+
+import argparse
+import time
+
+import numpy as np
+from PIL import Image
+from rembg import new_session
+
+from removebg.batch import predict_masks
+
+
+def synthetic_images(count, size=(1500, 1000)):
+    rng = np.random.default_rng(0)
+    return [
+        Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+        for _ in range(count)
+    ]
+
+
+def run(session, images, batched, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        if batched:
+            predict_masks(session, images)
+        else:
+            for img in images:
+                predict_masks(session, [img])
+    return len(images) * repeat / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Batched vs per-image removebg inference throughput"
+    )
+    parser.add_argument("--model", default="u2net")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    session = new_session(args.model)
+
+    # Warm up the session so the first measurement doesn't include graph setup
+    predict_masks(session, synthetic_images(1))
+
+    print(f"{'batch':>6} {'sequential img/s':>18} {'batched img/s':>15} {'speedup':>8}")
+    for size in args.sizes:
+        images = synthetic_images(size)
+        sequential = run(session, images, False, args.repeat)
+        batched = run(session, images, True, args.repeat)
+        print(
+            f"{size:>6} {sequential:>18.2f} {batched:>15.2f} {batched / sequential:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
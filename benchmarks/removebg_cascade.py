@@ -0,0 +1,133 @@
+# Average latency and mask agreement of ?model=cascade against always running the
+# full model, over a local test set, for a sweep of uncertainty thresholds.
+#
+# Agreement is the IoU of the subject (alpha >= 128) and the mean absolute alpha
+# difference against the full model's mask. Without --images, generated product
+# shots (benchmarks.fixtures.photo) are used.
+#
+#   python -m benchmarks.removebg_cascade --images ~/photos --thresholds 0.01 0.02 0.05
+
+import argparse
+import io
+import os
+import statistics
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+from rembg import new_session
+
+from benchmarks.fixtures import photo
+from removebg.cascade import uncertainty
+from removebg.pipeline import downscale, predict_mask
+
+
+def load_images(paths, count):
+    if not paths:
+        sizes = [(640, 480), (1200, 900), (1920, 1080), (1080, 1350)]
+        return [
+            Image.open(io.BytesIO(photo(sizes[index % len(sizes)]))).convert("RGB")
+            for index in range(count)
+        ]
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)))
+        else:
+            files.append(path)
+    images = []
+    for path in files:
+        try:
+            images.append(ImageOps.exif_transpose(Image.open(path)).convert("RGB"))
+        except OSError:
+            continue
+    return images
+
+
+def timed_mask(session, img):
+    start = time.perf_counter()
+    mask = predict_mask(session, img)
+    return mask, time.perf_counter() - start
+
+
+def agreement(mask, reference):
+    a = np.asarray(mask, dtype=np.int16)
+    b = np.asarray(reference, dtype=np.int16)
+    union = np.count_nonzero((a >= 128) | (b >= 128))
+    iou = np.count_nonzero((a >= 128) & (b >= 128)) / union if union else 1.0
+    return iou, float(np.abs(a - b).mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model cascade vs the full model")
+    parser.add_argument("--images", nargs="*", help="Image files or directories")
+    parser.add_argument("--count", type=int, default=12, help="Generated images")
+    parser.add_argument("--fast", default="u2netp")
+    parser.add_argument("--full", default="u2net")
+    parser.add_argument(
+        "--thresholds", type=float, nargs="+", default=[0.01, 0.02, 0.03, 0.05]
+    )
+    args = parser.parse_args()
+
+    images = [downscale(img) for img in load_images(args.images, args.count)]
+    fast, full = new_session(args.fast), new_session(args.full)
+    predict_mask(fast, images[0])  # warm-up
+    predict_mask(full, images[0])
+
+    rows = []
+    for img in images:
+        reference, full_seconds = timed_mask(full, img)
+        mask, fast_seconds = timed_mask(fast, img)
+        start = time.perf_counter()
+        score = uncertainty(mask)
+        score_seconds = time.perf_counter() - start
+        rows.append(
+            {
+                "full": full_seconds,
+                "fast": fast_seconds + score_seconds,
+                "score": score,
+                "agreement": agreement(mask, reference),
+            }
+        )
+
+    print(f"{len(images)} images, uncertainty per image:")
+    print("  " + " ".join(f"{row['score']:.3f}" for row in rows))
+    print(
+        f"\n{'':<22} {'avg ms':>8} {'escalated':>10} {'mean IoU':>9} {'min IoU':>8} "
+        f"{'alpha err':>9}"
+    )
+
+    def report(name, latencies, escalated, agreements):
+        ious = [iou for iou, _ in agreements]
+        print(
+            f"{name:<22} {statistics.mean(latencies) * 1000:8.1f} "
+            f"{escalated:10.0%} {statistics.mean(ious):9.4f} {min(ious):8.4f} "
+            f"{statistics.mean(error for _, error in agreements):9.2f}"
+        )
+
+    report(f"always {args.full}", [row["full"] for row in rows], 1.0, [(1.0, 0.0)])
+    report(
+        f"always {args.fast}",
+        [row["fast"] for row in rows],
+        0.0,
+        [row["agreement"] for row in rows],
+    )
+    for threshold in args.thresholds:
+        escalate = [row["score"] > threshold for row in rows]
+        report(
+            f"cascade > {threshold:g}",
+            [
+                row["fast"] + (row["full"] if escalated else 0)
+                for row, escalated in zip(rows, escalate)
+            ],
+            sum(escalate) / len(rows),
+            [
+                (1.0, 0.0) if escalated else row["agreement"]
+                for row, escalated in zip(rows, escalate)
+            ],
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# Post-processing of a cut-out before and after fusing it into one stage: the old
+# four full-image passes (UnsharpMask, Contrast, Brightness, Color on RGBA) against
+# removebg.pipeline.enhance, on synthetic 1500px and 4000px cut-outs. Each run is a
+# fresh process, and the memory column is how far its peak RSS rose above the RSS
+# it had with the input image in memory.
+#
+#   python -m benchmarks.removebg_enhance --repeat 5
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+
+from benchmarks.memory import peak_mb, reset_peak, rss_mb
+from removebg.pipeline import enhance
+
+SIZES = {"1500px": (1500, 1000), "4000px": (4000, 3000)}
+
+
+def four_pass(img_result, preset="default"):
+    # The enhancement remove_background used to apply
+    img_result = img_result.filter(
+        ImageFilter.UnsharpMask(radius=1, percent=125, threshold=3)
+    )
+    img_result = ImageEnhance.Contrast(img_result).enhance(1.2)
+    img_result = ImageEnhance.Brightness(img_result).enhance(1.05)
+    img_result = ImageEnhance.Color(img_result).enhance(1.1)
+    return img_result
+
+
+def synthetic_cutout(size):
+    # Noise with a soft-edged elliptical subject, transparent (and black) around it
+    # like naive_cutout leaves it
+    img = Image.merge(
+        "RGB",
+        [
+            Image.effect_noise(size, sigma).point(lambda v: v + 64)
+            for sigma in (40, 60, 80)
+        ],
+    )
+    mask = Image.new("L", size, 0)
+    ImageDraw.Draw(mask).ellipse(
+        (size[0] // 5, size[1] // 8, size[0] * 4 // 5, size[1] * 7 // 8), fill=255
+    )
+    mask = mask.filter(ImageFilter.GaussianBlur(4))
+    cutout = Image.new("RGBA", size, 0)
+    cutout.paste(img, mask=mask)
+    return cutout
+
+
+def run_child(variant, size_name, repeat):
+    func = four_pass if variant == "four-pass" else enhance
+    img = synthetic_cutout(SIZES[size_name])
+    reset_peak()
+    rss_before = rss_mb()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(img)
+    seconds = (time.perf_counter() - start) / repeat
+
+    alpha_changed = int(
+        np.count_nonzero(
+            np.asarray(result.getchannel("A")) != np.asarray(img.getchannel("A"))
+        )
+    )
+    print(
+        json.dumps(
+            {
+                "ms": seconds * 1000,
+                "peak_mb": peak_mb() - rss_before,
+                "alpha_changed": alpha_changed,
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cut-out post-processing timings")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--child", nargs=2, metavar=("VARIANT", "SIZE"))
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child, args.repeat)
+        return
+
+    print(
+        f"{'size':<7} {'variant':<10} {'ms':>8} {'+peak MB':>8} {'alpha px changed':>17}"
+    )
+    for size_name in SIZES:
+        for variant in ("four-pass", "fused"):
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.removebg_enhance",
+                    "--repeat",
+                    str(args.repeat),
+                    "--child",
+                    variant,
+                    size_name,
+                ],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{size_name:<7} {variant:<10} {result['ms']:8.1f} "
+                f"{result['peak_mb']:8.1f} {result['alpha_changed']:17d}"
+            )
+
+
+if __name__ == "__main__":
+    main()
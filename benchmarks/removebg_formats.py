@@ -0,0 +1,41 @@
+# Encode time and payload size of a 1500px cut-out and its mask in every output
+# format removebg.formats offers.
+#
+#   python -m benchmarks.removebg_formats --repeat 5
+
+import argparse
+import io
+import time
+
+from benchmarks.removebg_enhance import synthetic_cutout
+from removebg.formats import OUTPUT_FORMATS, available_formats
+
+
+def encode(img, spec):
+    img_io = io.BytesIO()
+    img.save(img_io, format=spec["format"], **spec["options"])
+    return img_io.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Output format encode timings")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--size", type=int, nargs=2, default=(1500, 1000))
+    args = parser.parse_args()
+
+    cutout = synthetic_cutout(tuple(args.size))
+    mask = cutout.getchannel("A")
+
+    for label, img in (("cutout", cutout), ("mask", mask)):
+        print(f"\n{label} {img.width}x{img.height} {img.mode}")
+        for name in available_formats():
+            spec = OUTPUT_FORMATS[name]
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                data = encode(img, spec)
+            milliseconds = (time.perf_counter() - start) / args.repeat * 1000
+            print(f"  {name:<14} {milliseconds:8.1f} ms  {len(data) / 1024:9.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
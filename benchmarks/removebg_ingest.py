@@ -0,0 +1,112 @@
+# Decode time and peak memory of bringing a phone-sized JPEG upload to the model's
+# working size: the full decode followed by a LANCZOS resize that remove_background
+# used to do, against removebg.pipeline.open_image decoding with DCT scaling. Each
+# run is a fresh process; memory is how far its peak RSS rose during the decode.
+#
+#   python -m benchmarks.removebg_ingest --repeat 3
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+from benchmarks.memory import peak_mb, reset_peak, rss_mb
+from removebg.pipeline import downscale, open_image
+
+# 12 MP and 48 MP, the common phone camera resolutions
+SIZES = {"12MP": (4000, 3000), "48MP": (8000, 6000)}
+
+
+def synthetic_jpeg(path, size):
+    # Smooth gradients with some noise, stored sideways with an EXIF orientation
+    # tag like a phone held upright
+    gradient = Image.linear_gradient("L")
+    img = Image.merge(
+        "RGB",
+        [
+            gradient.resize(size),
+            gradient.rotate(90).resize(size),
+            Image.effect_noise(size, 40),
+        ],
+    )
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotate 90 CW
+    img.save(path, "JPEG", quality=90, exif=exif)
+
+
+def before(path):
+    img = Image.open(path)
+    img.load()
+    return downscale(img)
+
+
+def after(path):
+    return downscale(open_image(path, draft=True))
+
+
+def run_child(variant, path, repeat):
+    func = before if variant == "before" else after
+    reset_peak()
+    rss_before = rss_mb()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        img = func(path)
+    seconds = (time.perf_counter() - start) / repeat
+
+    print(
+        json.dumps(
+            {
+                "ms": seconds * 1000,
+                "peak_mb": peak_mb() - rss_before,
+                "size": img.size,
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JPEG ingestion timings")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", nargs=2, metavar=("VARIANT", "PATH"))
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child, args.repeat)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'upload':<7} {'variant':<7} {'ms':>8} {'+peak MB':>9}  result")
+        for name, size in SIZES.items():
+            path = os.path.join(tmp, f"{name}.jpg")
+            synthetic_jpeg(path, size)
+            for variant in ("before", "after"):
+                output = subprocess.run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "benchmarks.removebg_ingest",
+                        "--repeat",
+                        str(args.repeat),
+                        "--child",
+                        variant,
+                        path,
+                    ],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(
+                    f"{name:<7} {variant:<7} {result['ms']:8.1f} "
+                    f"{result['peak_mb']:9.1f}  {result['size'][0]}x{result['size'][1]}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# Per-stage timings of the single image /removebg/ pipeline, comparing the old
+# encode -> rembg.remove -> decode round trip with the direct pipeline that
+# decodes once and encodes once.
+#
+#   python -m benchmarks.removebg_stages --model u2net --repeat 5
+
+import argparse
+import io
+import time
+from collections import defaultdict
+
+import numpy as np
+from PIL import Image
+from rembg import new_session, remove
+
+from removebg.pipeline import (
+    cutout,
+    downscale,
+    encode_png,
+    enhance,
+    open_image,
+    predict_mask,
+)
+
+
+class StageTimer:
+    def __init__(self):
+        self.totals = defaultdict(float)
+
+    def __call__(self, name, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.totals[name] += time.perf_counter() - start
+        return result
+
+
+def synthetic_upload(size, fmt):
+    rng = np.random.default_rng(0)
+    img = Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def round_trip(timer, session, data):
+    img = timer("decode", open_image, io.BytesIO(data))
+    img_format = img.format
+    img = timer("resize", downscale, img)
+
+    def encode_input():
+        buffer = io.BytesIO()
+        img.save(buffer, format=img_format)
+        return buffer.getvalue()
+
+    # rembg.remove decodes the bytes again, infers, cuts out and encodes a PNG
+    encoded = timer("encode input", encode_input)
+    result = timer("rembg.remove", remove, encoded, session=session)
+    img_result = timer("decode result", lambda: open_image(io.BytesIO(result)))
+    img_result = timer("enhance", enhance, img_result)
+    timer("encode", encode_png, img_result)
+
+
+def direct(timer, session, data):
+    img = timer("decode", open_image, io.BytesIO(data))
+    img = timer("resize", downscale, img)
+    mask = timer("inference", predict_mask, session, img)
+    img_result = timer("cutout", cutout, img, mask)
+    img_result = timer("enhance", enhance, img_result)
+    timer("encode", encode_png, img_result)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Per-stage timings of the removebg pipeline"
+    )
+    parser.add_argument("--model", default="u2net")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    session = new_session(args.model)
+
+    for fmt in ("JPEG", "PNG"):
+        for size in ((1500, 1000), (4000, 3000)):
+            data = synthetic_upload(size, fmt)
+            print(f"\n{fmt} {size[0]}x{size[1]} ({len(data) / 1e6:.1f} MB)")
+
+            for name, pipeline in (("round trip", round_trip), ("direct", direct)):
+                timer = StageTimer()
+                for _ in range(args.repeat):
+                    pipeline(timer, session, data)
+
+                total = sum(timer.totals.values()) / args.repeat * 1000
+                stages = ", ".join(
+                    f"{stage} {seconds / args.repeat * 1000:.1f}"
+                    for stage, seconds in timer.totals.items()
+                )
+                print(f"  {name:<10} {total:8.1f} ms  ({stages})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+# Offline benchmark suite: per-stage timings and peak memory of the removebg and
+# convertor pipelines, compared with a stored baseline.
+#
+# Everything runs on generated inputs (benchmarks.fixtures): JPEG photos at a few
+# resolutions, PDFs with and without a text layer, a tiny ONNX stand-in for the
+# U2Net models, and stubs for LibreOffice, wkhtmltopdf and Tesseract when they
+# aren't installed. Stubbed tools and the stand-in model make those stages measure
+# our side of the handoff only, the report says which tools were stubbed.
+#
+# Each case runs in a fresh process, so peak memory is its own. Stage times are
+# the median over --repeat runs after one warm-up run.
+#
+#   python -m benchmarks.suite                      # run, compare with the baseline
+#   python -m benchmarks.suite --save-baseline      # run and store as the baseline
+#   python -m benchmarks.suite --case removebg --threshold 0.1
+#
+# The exit status is 1 when a stage got slower, or the peak memory grew, by more
+# than --threshold (default 20%) over the baseline.
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from functools import partial
+
+from benchmarks import fixtures
+from benchmarks.memory import peak_mb, reset_peak, rss_mb
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+MODEL_PATH = os.path.join(os.path.dirname(__file__), "data", "tiny_u2net.onnx")
+
+PHOTO_SIZES = {"vga": (640, 480), "1080p": (1920, 1080), "12mp": (4000, 3000)}
+
+# Differences below these are noise whatever the percentage
+MIN_DELTA_MS = 1.0
+MIN_DELTA_MB = 2.0
+
+
+class StageTimer:
+    # Milliseconds per stage, summed over a pass (e.g. every page of a PDF) and
+    # collected per pass
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.totals = defaultdict(float)
+
+    def __call__(self, name, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.totals[name] += (time.perf_counter() - start) * 1000
+        return result
+
+    def end_pass(self):
+        for name, milliseconds in self.totals.items():
+            self.samples[name].append(milliseconds)
+        self.totals.clear()
+
+    def medians(self):
+        return {
+            name: statistics.median(samples) for name, samples in self.samples.items()
+        }
+
+
+def _setup_django():
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "RemoveImageBG.settings")
+    django.setup()
+
+
+# Cases: setup(fixture_dir) prepares what a request would find ready (model
+# sessions, uploads), run(state, timer) does one timed pass.
+
+
+def removebg_setup(size_name, fixture_dir):
+    from rembg import new_session
+
+    with open(os.path.join(fixture_dir, f"photo-{size_name}.jpg"), "rb") as f:
+        data = f.read()
+    model_path = os.path.join(os.environ["U2NET_HOME"], os.path.basename(MODEL_PATH))
+    return new_session("u2net_custom", model_path=model_path), data
+
+
+def removebg_run(state, timer):
+    from removebg.pipeline import (
+        cutout,
+        cutout_options,
+        downscale,
+        encode_png,
+        enhance,
+        open_upload,
+        predict_mask,
+    )
+
+    session, data = state
+    options = cutout_options()
+    img = timer("decode", open_upload, io.BytesIO(data), options)
+    img = timer("resize", downscale, img)
+    mask = timer("inference", predict_mask, session, img)
+    img_result = timer(
+        "post-process", lambda: enhance(cutout(img, mask), options["enhance"])
+    )
+    timer("encode", encode_png, img_result)
+
+
+def pdf_setup(name, fixture_dir):
+    _setup_django()
+    from convertor.ocr import ocr_options
+
+    # Measure rendering and recognition, not the page cache
+    return os.path.join(fixture_dir, name), {**ocr_options(), "cache_dir": None}
+
+
+def pdf_text_run(state, timer):
+    import fitz  # PyMuPDF
+
+    path, options = state
+    with fitz.open(path) as pdf_document:
+        for page in pdf_document:
+            timer("text", page.get_text)
+            timer("render", page.get_pixmap, dpi=options["dpi"], alpha=False)
+
+
+def pdf_scanned_run(state, timer):
+    import fitz  # PyMuPDF
+
+    from convertor.ocr import recognize
+
+    path, options = state
+    colorspace = fitz.csRGB if options["colorspace"] == "rgb" else fitz.csGRAY
+    with fitz.open(path) as pdf_document:
+        for page in pdf_document:
+            pix = timer(
+                "render",
+                page.get_pixmap,
+                dpi=options["dpi"],
+                colorspace=colorspace,
+                alpha=False,
+            )
+            timer("ocr", recognize, pix, options)
+
+
+def office_setup(fixture_dir):
+    _setup_django()
+    return os.path.join(fixture_dir, "document.docx"), tempfile.mkdtemp(dir=fixture_dir)
+
+
+def office_run(state, timer):
+    from convertor.office import convert_with_new_process
+
+    input_path, outdir = state
+    timer("convert", convert_with_new_process, input_path, outdir)
+
+
+def html_setup(fixture_dir):
+    _setup_django()
+    return fixtures.html_document()
+
+
+def html_run(html_content, timer):
+    from convertor.html import html_to_pdf
+
+    timer("convert", html_to_pdf, html_content)
+
+
+CASES = {
+    **{
+        f"removebg.{size_name}": (partial(removebg_setup, size_name), removebg_run)
+        for size_name in PHOTO_SIZES
+    },
+    "convertor.pdf-text": (partial(pdf_setup, "text.pdf"), pdf_text_run),
+    "convertor.pdf-scanned": (partial(pdf_setup, "scanned.pdf"), pdf_scanned_run),
+    "convertor.office": (office_setup, office_run),
+    "convertor.html": (html_setup, html_run),
+}
+
+
+def write_fixtures(directory):
+    for size_name, size in PHOTO_SIZES.items():
+        with open(os.path.join(directory, f"photo-{size_name}.jpg"), "wb") as f:
+            f.write(fixtures.photo(size))
+    fixtures.text_pdf(os.path.join(directory, "text.pdf"))
+    fixtures.scanned_pdf(os.path.join(directory, "scanned.pdf"))
+    fixtures.write_docx(os.path.join(directory, "document.docx"))
+
+    # rembg only loads custom models from its model directory
+    os.makedirs(os.path.join(directory, "models"))
+    shutil.copy(MODEL_PATH, os.path.join(directory, "models"))
+    return fixtures.stub_executables(os.path.join(directory, "bin"))
+
+
+def run_child(name, fixture_dir, repeat):
+    setup, run = CASES[name]
+    state = setup(fixture_dir)
+
+    reset_peak()
+    rss_before = rss_mb()
+
+    run(state, StageTimer())  # warm-up, not counted
+    timer = StageTimer()
+    for _ in range(repeat):
+        run(state, timer)
+        timer.end_pass()
+
+    stages = timer.medians()
+    print(
+        json.dumps(
+            {
+                "stages": stages,
+                "total_ms": sum(stages.values()),
+                "peak_mb": peak_mb() - rss_before,
+            }
+        )
+    )
+
+
+def run_case(name, fixture_dir, repeat):
+    env = dict(os.environ)
+    env["PATH"] = os.path.join(fixture_dir, "bin") + os.pathsep + env["PATH"]
+    env["U2NET_HOME"] = os.path.join(fixture_dir, "models")
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.suite",
+            "--repeat",
+            str(repeat),
+            "--child",
+            name,
+            fixture_dir,
+        ],
+        check=True,
+        stdout=subprocess.PIPE,  # errors from the case go straight to stderr
+        text=True,
+        env=env,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _regressed(current, baseline, threshold, min_delta):
+    return current > baseline * (1 + threshold) and current - baseline > min_delta
+
+
+def compare(results, baseline, threshold):
+    # Print every measurement next to its baseline, return the regressed ones
+    regressions = []
+    print(
+        f"\n{'case':<24} {'stage':<14} {'baseline':>10} {'current':>10} {'change':>8}"
+    )
+    for name, result in results["cases"].items():
+        base = baseline["cases"].get(name)
+        rows = [
+            (stage, ms, "ms", MIN_DELTA_MS) for stage, ms in result["stages"].items()
+        ]
+        rows.append(("total", result["total_ms"], "ms", MIN_DELTA_MS))
+        rows.append(("peak memory", result["peak_mb"], "MB", MIN_DELTA_MB))
+        for stage, current, unit, min_delta in rows:
+            if base is None:
+                before = None
+            elif stage == "total":
+                before = base["total_ms"]
+            elif stage == "peak memory":
+                before = base["peak_mb"]
+            else:
+                before = base["stages"].get(stage)
+
+            if before is None:
+                print(f"{name:<24} {stage:<14} {'-':>10} {current:8.1f}{unit}")
+                continue
+            change = (current - before) / before if before else 0.0
+            flag = ""
+            if _regressed(current, before, threshold, min_delta):
+                flag = "  REGRESSION"
+                regressions.append((name, stage))
+            print(
+                f"{name:<24} {stage:<14} {before:8.1f}{unit} {current:8.1f}{unit}"
+                f" {change:+8.0%}{flag}"
+            )
+
+    if baseline.get("stubbed") != results["stubbed"]:
+        print(
+            "\nThe baseline was taken with different tools stubbed "
+            f"({', '.join(baseline.get('stubbed', [])) or 'none'}), "
+            "convertor numbers aren't comparable"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--case",
+        action="append",
+        help="Run only the cases starting with this, e.g. removebg or "
+        "convertor.pdf (repeatable)",
+    )
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative slowdown that counts as a regression (default 0.2)",
+    )
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--child", nargs=2, metavar=("CASE", "FIXTURES"))
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child, args.repeat)
+        return
+
+    names = [
+        name
+        for name in CASES
+        if not args.case or any(name.startswith(prefix) for prefix in args.case)
+    ]
+    if not names:
+        parser.error(f"No case matches, choose from: {', '.join(CASES)}")
+
+    with tempfile.TemporaryDirectory(prefix="benchmarks-") as fixture_dir:
+        stubbed = write_fixtures(fixture_dir)
+        if stubbed:
+            print(f"Stubbed, not installed: {', '.join(stubbed)}")
+
+        results = {
+            "machine": platform.node(),
+            "python": platform.python_version(),
+            "repeat": args.repeat,
+            "stubbed": stubbed,
+            "cases": {},
+        }
+        for name in names:
+            result = run_case(name, fixture_dir, args.repeat)
+            results["cases"][name] = result
+            print(
+                f"{name:<24} {result['total_ms']:8.1f} ms  "
+                f"{result['peak_mb']:7.1f} MB peak"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        baseline = {"cases": {}}
+        if os.path.exists(args.baseline):
+            # Keep the cases this run skipped
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(
+            {key: value for key, value in results.items() if key != "cases"}
+        )
+        baseline["cases"].update(results["cases"])
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, store one with --save-baseline")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(
+            f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: "
+            + ", ".join(f"{name} {stage}" for name, stage in regressions)
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import fcntl
+import hashlib
+import io
+import json
+import os
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from RemoveImageBG.cache import DiskLRUCache, SharedCounters, _remove
+
+# Converted PDFs keyed by a hash of the input, the converter and its options, on
+# disk and shared by all gunicorn workers. Identical requests arriving together
+# are converted once: the first one holds a lock on the key while it converts,
+# the others wait for it and are then served from the cache.
+
+CONVERTERS = ("office", "html")
+
+_cache = None
+_counters = None
+
+
+def conversion_cache():
+    global _cache
+    if _cache is None:
+        _cache = DiskLRUCache(
+            os.path.join(settings.CONVERT_CACHE_DIR, "pdfs"),
+            settings.CONVERT_CACHE_BYTES,
+        )
+    return _cache
+
+
+def cache_counters():
+    global _counters
+    if _counters is None:
+        _counters = SharedCounters(os.path.join(settings.CONVERT_CACHE_DIR, "stats"))
+    return _counters
+
+
+def conversion_key(converter, content, options=None):
+    # `content` is the input as bytes or the path of the uploaded file, which is
+    # hashed in chunks
+    digest = hashlib.sha256(
+        json.dumps([converter, options or {}], sort_keys=True).encode()
+    )
+    if isinstance(content, bytes):
+        digest.update(content)
+    else:
+        with open(content, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def _key_lock(key):
+    # An exclusive flock on a file per key, removed by its holder once done. A
+    # waiter that gets the lock of a file that has been removed in the meantime
+    # tries again on the current one.
+    directory = os.path.join(settings.CONVERT_CACHE_DIR, "locks")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, key)
+    while True:
+        lock = open(path, "a")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.stat(path).st_ino == os.fstat(lock.fileno()).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        lock.close()
+    try:
+        yield
+    finally:
+        _remove(path)
+        lock.close()
+
+
+def _open_result(result):
+    # convert() returns either the PDF itself or the path of the PDF it wrote
+    if isinstance(result, bytes):
+        return io.BytesIO(result)
+    return open(result, "rb")
+
+
+def cached_pdf(converter, key, convert):
+    # The PDF for `key` as a file object, from the cache or else from convert(),
+    # which returns the PDF as bytes or the path of the PDF it wrote
+    if not settings.CONVERT_CACHE_DIR:
+        return _open_result(convert())
+
+    cache = conversion_cache()
+    counters = cache_counters()
+    pdf_file = cache.open(key)
+    if pdf_file is not None:
+        counters.incr(f"{converter}.hits")
+        return pdf_file
+
+    with _key_lock(key):
+        # An identical request may have converted it while this one waited
+        pdf_file = cache.open(key)
+        if pdf_file is not None:
+            counters.incr(f"{converter}.collapsed")
+            return pdf_file
+
+        counters.incr(f"{converter}.misses")
+        result = convert()
+        if isinstance(result, bytes):
+            counters.incr(f"{converter}.evictions", cache.set(key, result))
+            return io.BytesIO(result)
+        with open(result, "rb") as f:
+            counters.incr(f"{converter}.evictions", cache.set(key, f.read()))
+        return cache.open(key) or open(result, "rb")
+
+
+def conversion_cache_stats():
+    # hits: served from the cache, collapsed: served from the cache after waiting
+    # for an identical conversion in flight, misses: converted
+    names = ("hits", "collapsed", "misses", "evictions")
+    stats = dict.fromkeys(names, 0)
+    if not settings.CONVERT_CACHE_DIR:
+        return stats
+    totals = cache_counters().totals()
+    stats["converters"] = {}
+    for converter in CONVERTERS:
+        counts = {name: totals.get(f"{converter}.{name}", 0) for name in names}
+        stats["converters"][converter] = counts
+        for name in names:
+            stats[name] += counts[name]
+    lookups = stats["hits"] + stats["collapsed"] + stats["misses"]
+    served = stats["hits"] + stats["collapsed"]
+    stats["hit_rate"] = round(served / lookups, 4) if lookups else 0.0
+    stats["disk_entries"], stats["disk_bytes"] = conversion_cache().usage()
+    return stats
@@ -0,0 +1,244 @@
+import atexit
+import subprocess
+import threading
+from collections import OrderedDict
+
+import pdfkit
+from django.conf import settings
+
+from jobs.pool import in_job_process
+from RemoveImageBG.metrics import stage
+
+from .office import ConversionError
+
+# HTML -> PDF with wkhtmltopdf, entirely in memory: the HTML goes in on stdin and
+# the PDF comes back on stdout. wkhtmltopdf has no server mode, but it only reads
+# its input once it has started up, so processes for the options in use are
+# started ahead of time and each one waits for the next document.
+
+PAGE_SIZES = ("A3", "A4", "A5", "B5", "Letter", "Legal", "Tabloid")
+ORIENTATIONS = ("portrait", "landscape")
+MARGINS = ("top", "right", "bottom", "left")  # in mm
+
+# Remote assets are blocked by sending every request through a proxy that refuses
+# connections straight away, wkhtmltopdf then renders the page without them
+UNREACHABLE_PROXY = "http://127.0.0.1:9"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _flag(value):
+    if value in (None, ""):
+        return None
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ("1", "true", "yes", "on"):
+        return True
+    if str(value).lower() in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(f"Invalid boolean '{value}'")
+
+
+def _number(name, value, low, high):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name} '{value}'")
+    if not low <= number <= high:
+        raise ValueError(f"{name} must be between {low:g} and {high:g}")
+    return number
+
+
+def html_options(
+    page_size=None,
+    orientation=None,
+    margin=None,
+    javascript_delay=None,
+    remote_assets=None,
+    margin_top=None,
+    margin_right=None,
+    margin_bottom=None,
+    margin_left=None,
+):
+    # Validated per-request rendering options, as wkhtmltopdf options. `margin` in
+    # millimetres applies to every side, margin_top= and so on to one.
+    page_size = page_size or settings.HTML_PDF_PAGE_SIZE
+    matches = [size for size in PAGE_SIZES if size.lower() == page_size.lower()]
+    if not matches:
+        raise ValueError(f"page_size must be one of: {', '.join(PAGE_SIZES)}")
+    orientation = (orientation or "portrait").lower()
+    if orientation not in ORIENTATIONS:
+        raise ValueError(f"orientation must be one of: {', '.join(ORIENTATIONS)}")
+
+    options = {
+        "page-size": matches[0],
+        "orientation": orientation.capitalize(),
+        "encoding": "UTF-8",
+        # A missing image or stylesheet shouldn't fail the whole document
+        "load-error-handling": "ignore",
+        "load-media-error-handling": "ignore",
+    }
+
+    if margin in (None, ""):
+        margin = settings.HTML_PDF_MARGIN_MM
+    for side, value in zip(
+        MARGINS, (margin_top, margin_right, margin_bottom, margin_left)
+    ):
+        value = margin if value in (None, "") else value
+        options[f"margin-{side}"] = f"{_number('margin', value, 0, 100):g}mm"
+
+    if javascript_delay in (None, ""):
+        javascript_delay = settings.HTML_PDF_JAVASCRIPT_DELAY
+    options["javascript-delay"] = str(
+        int(
+            _number(
+                "javascript_delay",
+                javascript_delay,
+                0,
+                settings.HTML_PDF_MAX_JAVASCRIPT_DELAY,
+            )
+        )
+    )
+
+    remote_assets = _flag(remote_assets)
+    if remote_assets is None:
+        remote_assets = settings.HTML_PDF_REMOTE_ASSETS
+    if not remote_assets:
+        options["proxy"] = UNREACHABLE_PROXY
+    return options
+
+
+class RendererPool:
+    # Idle wkhtmltopdf processes, each started for one set of options and used for
+    # a single document. A process is started to replace every one that is taken,
+    # and the oldest idle ones are stopped once there are more than `size`.
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._idle = OrderedDict()  # command -> [process, ...], oldest use first
+        self._lock = threading.Lock()
+        self._configuration = None
+        atexit.register(self.shutdown)
+
+    def _command(self, options):
+        # wkhtmltopdf [OPTIONS] - -: the HTML on stdin, the PDF on stdout. Options
+        # in <meta name="pdfkit-..."> tags of the document are not applied.
+        if self._configuration is None:
+            # Finds the wkhtmltopdf binary, raises OSError when there is none
+            self._configuration = pdfkit.configuration()
+        kit = pdfkit.PDFKit(
+            "", "string", options=options, configuration=self._configuration
+        )
+        return tuple(kit.command())
+
+    def _start(self, command):
+        return subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+    def _take(self, command):
+        # An idle process for `command` that is still waiting, started now if
+        # there is none
+        with self._lock:
+            processes = self._idle.get(command, [])
+            while processes:
+                process = processes.pop(0)
+                if process.poll() is None:
+                    return process
+        return self._start(command)
+
+    def _replenish(self, command):
+        if self.size <= 0:
+            return
+        process = self._start(command)
+        stopped = []
+        with self._lock:
+            self._idle.setdefault(command, []).append(process)
+            self._idle.move_to_end(command)
+            while sum(len(processes) for processes in self._idle.values()) > self.size:
+                oldest, processes = next(iter(self._idle.items()))
+                stopped.append(processes.pop(0))
+                if not processes:
+                    del self._idle[oldest]
+        for process in stopped:
+            _stop(process)
+
+    def warm(self, options):
+        # Start the processes for `options` the first requests will need
+        command = self._command(options)
+        with self._lock:
+            missing = self.size - len(self._idle.get(command, []))
+        for _ in range(missing):
+            self._replenish(command)
+
+    def render(self, html, options):
+        command = self._command(options)
+        process = self._take(command)
+        self._replenish(command)
+        try:
+            pdf, stderr = process.communicate(html.encode(), timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            _stop(process)
+            raise ConversionError(
+                f"HTML rendering timed out after {self.timeout} seconds"
+            )
+        try:
+            pdfkit.PDFKit.handle_error(
+                process.returncode, stderr.decode(errors="replace")
+            )
+        except IOError as e:
+            raise ConversionError(str(e))
+        if not pdf:
+            raise ConversionError("wkhtmltopdf did not produce a PDF")
+        return pdf
+
+    def shutdown(self):
+        with self._lock:
+            processes = [
+                process for waiting in self._idle.values() for process in waiting
+            ]
+            self._idle.clear()
+        for process in processes:
+            _stop(process)
+
+
+def _stop(process):
+    process.kill()
+    process.communicate()
+
+
+def pool_size():
+    # A job pool process renders one document at a time, a single waiting
+    # wkhtmltopdf is all it can use
+    if in_job_process():
+        return min(settings.HTML_PDF_POOL_SIZE, 1)
+    return settings.HTML_PDF_POOL_SIZE
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RendererPool(pool_size(), settings.HTML_PDF_TIMEOUT)
+        return _pool
+
+
+def prewarm():
+    # Called from the WSGI/ASGI entry points, so the first requests with the
+    # default options find a wkhtmltopdf already started
+    if settings.HTML_PDF_POOL_SIZE > 0:
+        try:
+            get_pool().warm(html_options())
+        except OSError:
+            # wkhtmltopdf isn't installed, requests report it
+            pass
+
+
+def html_to_pdf(html, options=None):
+    # The PDF of an HTML document as bytes
+    with stage("wkhtmltopdf"):
+        return get_pool().render(html, options or html_options())
@@ -0,0 +1,420 @@
+import hashlib
+import multiprocessing
+import os
+import shlex
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz  # PyMuPDF
+import numpy as np
+import pytesseract
+from django.conf import settings
+from PIL import Image
+
+from RemoveImageBG.cache import DiskLRUCache, SharedCounters
+from RemoveImageBG.metrics import record
+from RemoveImageBG.threads import limit_threads, thread_budget
+
+# Optional: tesserocr links libtesseract into the process, so pages are handed to
+# Tesseract as raw pixels instead of a PNG temp file and a tesseract subprocess
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+OCR_MODES = ("hybrid", "ocr")
+OCR_COLORSPACES = ("rgb", "gray", "mono")
+OCR_DPI_RANGE = (36, 600)
+
+# Gray values at or above this are white in "mono" renders
+MONO_THRESHOLD = 128
+
+_executor = None
+_executor_lock = threading.Lock()
+_cache_counters = None
+_page_caches = {}
+_tesseract_apis = {}
+
+
+def _get_executor():
+    # Pages are OCR'd on a process pool sized to this worker's share of the cores,
+    # one Tesseract thread each. The processes are spawned so they don't inherit
+    # the web worker's threads.
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.OCR_MAX_WORKERS or thread_budget(),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=limit_threads,
+                initargs=(1,),
+            )
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        _executor = None
+
+
+def parse_page_range(spec, page_count):
+    # "1-3,7,10-" -> zero-based page numbers, in order and without duplicates.
+    # An empty spec selects every page.
+    if not spec:
+        return list(range(page_count))
+
+    page_numbers = []
+    for part in str(spec).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, dash, end = part.partition("-")
+        try:
+            first = int(start) if start.strip() else 1
+            last = (int(end) if end.strip() else page_count) if dash else first
+        except ValueError:
+            raise ValueError(f"Invalid page range '{part}'")
+        if first < 1 or last > page_count or first > last:
+            raise ValueError(
+                f"Page range '{part}' is outside the document's {page_count} pages"
+            )
+        page_numbers.extend(range(first - 1, last))
+
+    return list(dict.fromkeys(page_numbers))
+
+
+def select_pages(pdf_path, spec):
+    # Also where a malformed upload is first opened, so it's refused as invalid input
+    try:
+        pdf_document = fitz.open(pdf_path, filetype="pdf")
+    except fitz.FileDataError:
+        raise ValueError("The file is not a valid PDF")
+    with pdf_document:
+        return parse_page_range(spec, pdf_document.page_count)
+
+
+def _image_regions(page, min_area):
+    # Bounding boxes of the images on a page that cover at least `min_area` of it,
+    # small logos and icons aren't worth a Tesseract run
+    page_rect = page.rect
+    page_area = page_rect.width * page_rect.height
+    regions = []
+    for info in page.get_image_info():
+        rect = fitz.Rect(info["bbox"]) & page_rect
+        if not rect.is_empty and rect.width * rect.height >= min_area * page_area:
+            regions.append(tuple(rect))
+    return regions
+
+
+def render_options(dpi=None, colorspace=None, crop=None):
+    # Validated rendering options, each falling back to its setting when not given
+    try:
+        dpi = int(dpi) if dpi not in (None, "") else settings.OCR_DPI
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid dpi '{dpi}'")
+    if not OCR_DPI_RANGE[0] <= dpi <= OCR_DPI_RANGE[1]:
+        raise ValueError(
+            f"dpi must be between {OCR_DPI_RANGE[0]} and {OCR_DPI_RANGE[1]}"
+        )
+
+    colorspace = colorspace or settings.OCR_COLORSPACE
+    if colorspace not in OCR_COLORSPACES:
+        raise ValueError(f"colorspace must be one of: {', '.join(OCR_COLORSPACES)}")
+
+    if crop in (None, ""):
+        crop = settings.OCR_CROP_TO_CONTENT
+    elif isinstance(crop, str):
+        crop = crop.lower() in ("1", "true", "yes", "content")
+    return {"dpi": dpi, "colorspace": colorspace, "crop": bool(crop)}
+
+
+def ocr_options(render=None):
+    # Everything the pool processes need, they don't load the Django settings
+    return {
+        "lang": settings.OCR_LANGUAGE,
+        "config": settings.OCR_TESSERACT_CONFIG,
+        "tesseract_api": settings.OCR_USE_TESSERACT_API,
+        "cache_dir": str(settings.OCR_CACHE_DIR) if settings.OCR_CACHE_DIR else None,
+        "cache_bytes": settings.OCR_CACHE_BYTES,
+        **(render or render_options()),
+    }
+
+
+def cache_counters():
+    global _cache_counters
+    if _cache_counters is None:
+        _cache_counters = SharedCounters(os.path.join(settings.OCR_CACHE_DIR, "stats"))
+    return _cache_counters
+
+
+def page_cache(directory, max_bytes):
+    # One per process, so the cache's write accounting carries over between pages
+    if directory not in _page_caches:
+        _page_caches[directory] = DiskLRUCache(
+            os.path.join(directory, "pages"), max_bytes
+        )
+    return _page_caches[directory]
+
+
+def _page_key(pix, options):
+    # Identical rendered pixels with the same Tesseract settings give the same text.
+    # The pixels already differ per DPI and colorspace, but "mono" is thresholded
+    # after rendering and the resolution is passed on to Tesseract.
+    digest = hashlib.sha256(pix.samples_mv)
+    digest.update(f"{pix.width}x{pix.height}x{pix.n}".encode())
+    digest.update(f"{options['dpi']}:{options['colorspace']}".encode())
+    digest.update(options["lang"].encode())
+    digest.update(options["config"].encode())
+    return digest.hexdigest()
+
+
+def _content_bbox(page, margin=4):
+    # Union of everything drawn on the page, ignoring fills that cover (nearly)
+    # the whole page such as a white background, padded by `margin` points
+    page_rect = page.rect
+    page_area = page_rect.width * page_rect.height
+    bbox = fitz.Rect()
+    for kind, rect in page.get_bboxlog():
+        rect = fitz.Rect(rect) & page_rect
+        if rect.is_empty:
+            continue
+        if kind.startswith("fill") and rect.width * rect.height >= 0.99 * page_area:
+            continue
+        bbox |= rect
+    if bbox.is_empty:
+        return None
+    return (bbox + (-margin, -margin, margin, margin)) & page_rect
+
+
+def _parse_tesseract_config(config):
+    # The subset of tesseract command line options that maps onto the API:
+    # --psm N, --oem N and -c name=value. Anything else raises ValueError.
+    psm = oem = None
+    variables = []
+    tokens = iter(shlex.split(config))
+    for token in tokens:
+        if token in ("--psm", "--oem"):
+            value = int(next(tokens, ""))
+            if token == "--psm":
+                psm = value
+            else:
+                oem = value
+        elif token == "-c":
+            name, _, value = next(tokens, "").partition("=")
+            if not name or not value:
+                raise ValueError(f"Invalid Tesseract variable in '{config}'")
+            variables.append((name, value))
+        else:
+            raise ValueError(f"Unsupported Tesseract option '{token}'")
+    return psm, oem, variables
+
+
+def _tesseract_api(options):
+    # A persistent Tesseract instance per process and language/config, or None to
+    # fall back to pytesseract (tesserocr not installed, disabled, or a config
+    # the API can't express)
+    if tesserocr is None or not options["tesseract_api"]:
+        return None
+    key = (options["lang"], options["config"])
+    if key not in _tesseract_apis:
+        try:
+            psm, oem, variables = _parse_tesseract_config(options["config"])
+        except ValueError:
+            _tesseract_apis[key] = None
+            return None
+        kwargs = {"lang": options["lang"]}
+        if psm is not None:
+            kwargs["psm"] = psm
+        if oem is not None:
+            kwargs["oem"] = oem
+        api = tesserocr.PyTessBaseAPI(**kwargs)
+        for name, value in variables:
+            api.SetVariable(name, value)
+        _tesseract_apis[key] = api
+    return _tesseract_apis[key]
+
+
+def _mono_bits(pix):
+    # 1 bit per pixel, most significant bit first, 1 for white as Tesseract expects
+    gray = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(
+        pix.height, pix.stride
+    )[:, : pix.width]
+    return np.packbits(gray >= MONO_THRESHOLD, axis=1)
+
+
+def recognize(pix, options):
+    # OCR a rendered pixmap. tesserocr's SetImageBytes only takes bytes, so the
+    # Tesseract API gets one copy of MuPDF's buffer; pytesseract gets a PIL view
+    # of the buffer itself.
+    mono = options["colorspace"] == "mono"
+    api = _tesseract_api(options)
+    if api is not None:
+        if mono:
+            bits = _mono_bits(pix)
+            api.SetImageBytes(bits.tobytes(), pix.width, pix.height, 0, bits.shape[1])
+        else:
+            api.SetImageBytes(pix.samples, pix.width, pix.height, pix.n, pix.stride)
+        api.SetSourceResolution(options["dpi"])
+        return api.GetUTF8Text()
+
+    mode = "RGB" if pix.n == 3 else "L"
+    img = Image.frombuffer(
+        mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, pix.stride, 1
+    )
+    if mono:
+        img = img.point(lambda value: 255 if value >= MONO_THRESHOLD else 0, mode="1")
+    img.info["dpi"] = (options["dpi"], options["dpi"])
+    return pytesseract.image_to_string(
+        img, lang=options["lang"], config=options["config"]
+    )
+
+
+def ocr_page(pdf_path, page_number, clips, options):
+    # Runs in a pool process: render one page, or only the given regions of it,
+    # and OCR whatever isn't in the page cache yet. Also returns how long the
+    # rendering and OCR took, the pool processes don't record metrics themselves.
+    texts = []
+    stats = Counter()
+    timings = Counter()
+    cache = (
+        page_cache(options["cache_dir"], options["cache_bytes"])
+        if options["cache_dir"]
+        else None
+    )
+
+    colorspace = fitz.csRGB if options["colorspace"] == "rgb" else fitz.csGRAY
+
+    with fitz.open(pdf_path) as pdf_document:
+        page = pdf_document[page_number]
+        if not clips and options["crop"]:
+            # Skip the empty margins, a blank page has nothing to OCR
+            bbox = _content_bbox(page)
+            if bbox is None:
+                return page_number, "", dict(stats), dict(timings)
+            clips = [tuple(bbox)]
+
+        for clip in clips or [None]:
+            # Render page to image
+            start = time.perf_counter()
+            pix = page.get_pixmap(
+                dpi=options["dpi"],
+                colorspace=colorspace,
+                clip=fitz.Rect(clip) if clip else None,
+                alpha=False,
+            )
+            timings["page_render"] += time.perf_counter() - start
+
+            if cache is not None:
+                cache_key = _page_key(pix, options)
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    stats["hits"] += 1
+                    texts.append(cached.decode())
+                    continue
+                stats["misses"] += 1
+
+            # Perform OCR on the image
+            start = time.perf_counter()
+            text = recognize(pix, options)
+            timings["ocr_page"] += time.perf_counter() - start
+            texts.append(text)
+
+            if cache is not None:
+                stats["evictions"] += cache.set(cache_key, text.encode())
+
+    return page_number, "\n".join(texts), dict(stats), dict(timings)
+
+
+def ocr_cache_stats():
+    stats = dict.fromkeys(("hits", "misses", "evictions"), 0)
+    if not settings.OCR_CACHE_DIR:
+        return stats
+    stats.update(cache_counters().totals())
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+    stats["disk_entries"], stats["disk_bytes"] = page_cache(
+        str(settings.OCR_CACHE_DIR), settings.OCR_CACHE_BYTES
+    ).usage()
+    return stats
+
+
+def ocr_pages(pdf_path, page_numbers, mode="ocr", render=None):
+    # Yield (page number, text, method) for each page as soon as it's done, which
+    # is not necessarily in page order. In "hybrid" mode pages that already have a
+    # text layer use it ("native") and only their larger images are OCR'd
+    # ("mixed"); everything else is rasterized and OCR'd ("ocr").
+    native_texts = {}
+    pending = []
+    with fitz.open(pdf_path) as pdf_document:
+        for page_number in page_numbers:
+            if mode == "hybrid":
+                page = pdf_document[page_number]
+                text = page.get_text()
+                if len(text.strip()) >= settings.OCR_NATIVE_TEXT_MIN_CHARS:
+                    regions = _image_regions(page, settings.OCR_MIN_IMAGE_AREA)
+                    if not regions:
+                        yield page_number, text, "native"
+                        continue
+                    native_texts[page_number] = text
+                    pending.append((page_number, regions))
+                    continue
+            pending.append((page_number, None))
+
+    if not pending:
+        return
+
+    options = ocr_options(render)
+    try:
+        futures = [
+            _get_executor().submit(ocr_page, pdf_path, page_number, clips, options)
+            for page_number, clips in pending
+        ]
+    except BrokenProcessPool:
+        _reset_executor()
+        raise
+
+    try:
+        for future in as_completed(futures):
+            page_number, text, stats, timings = future.result()
+            for name, value in stats.items():
+                cache_counters().incr(name, value)
+            for stage_name, seconds in timings.items():
+                record(stage_name, seconds)
+            if page_number in native_texts:
+                yield page_number, "\n".join((native_texts[page_number], text)), "mixed"
+            else:
+                yield page_number, text, "ocr"
+    except BrokenProcessPool:
+        # A pool process died, e.g. killed for memory, start a new pool next time
+        _reset_executor()
+        raise
+    finally:
+        # Drop the pages nobody is waiting for anymore (error or client went away)
+        for future in futures:
+            future.cancel()
+
+
+def ocr_pdf(pdf_path, page_numbers=None, mode="ocr", render=None):
+    if page_numbers is None:
+        page_numbers = select_pages(pdf_path, None)
+
+    results = {
+        page_number: (text, method)
+        for page_number, text, method in ocr_pages(pdf_path, page_numbers, mode, render)
+    }
+
+    # Same layout as before, in page order whatever order the pages finished in
+    return {
+        "ocr_text": "".join(
+            f"\n\nPage {page_number + 1}:\n{results[page_number][0]}"
+            for page_number in page_numbers
+        ),
+        "pages": [
+            {"page": page_number + 1, "method": results[page_number][1]}
+            for page_number in page_numbers
+        ],
+    }
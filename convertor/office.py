@@ -0,0 +1,458 @@
+import atexit
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+from RemoveImageBG.metrics import observe, stage
+from RemoveImageBG.threads import available_cores
+
+logger = logging.getLogger(__name__)
+
+LIBREOFFICE_MACOS_PATH = "/Applications/LibreOffice.app/Contents/MacOS/soffice"
+
+# PDF export filter for each kind of document LibreOffice can load
+PDF_FILTERS = (
+    ("com.sun.star.text.TextDocument", "writer_pdf_Export"),
+    ("com.sun.star.sheet.SpreadsheetDocument", "calc_pdf_Export"),
+    ("com.sun.star.presentation.PresentationDocument", "impress_pdf_Export"),
+    ("com.sun.star.drawing.DrawingDocument", "draw_pdf_Export"),
+)
+
+
+# What a batch conversion accepts, LibreOffice picks the import filter from the
+# extension
+OFFICE_EXTENSIONS = (
+    ".doc",
+    ".docx",
+    ".odt",
+    ".rtf",
+    ".txt",
+    ".xls",
+    ".xlsx",
+    ".ods",
+    ".csv",
+    ".ppt",
+    ".pptx",
+    ".odp",
+)
+
+CONVERSION_MEMORY_BASE = 64 * 1024 * 1024
+CONVERSION_MEMORY_PER_BYTE = 8
+
+
+class ConversionError(Exception):
+    pass
+
+
+def libreoffice_path():
+    # Use the full path for libreoffice (soffice) on macOS or Linux
+    return (
+        LIBREOFFICE_MACOS_PATH
+        if os.path.exists(LIBREOFFICE_MACOS_PATH)
+        else "libreoffice"
+    )
+
+
+def _profile_arg(profile_dir):
+    # A separate user profile per soffice process, concurrent instances sharing the
+    # default profile block each other or fail
+    return "-env:UserInstallation=" + Path(profile_dir).as_uri()
+
+
+def _pdf_path(input_path, outdir):
+    return os.path.join(
+        outdir, os.path.splitext(os.path.basename(input_path))[0] + ".pdf"
+    )
+
+
+def _import_uno():
+    # The UNO bindings ship with LibreOffice (python3-uno on Debian/Ubuntu), not on PyPI
+    try:
+        import uno
+    except ImportError:
+        return None
+    return uno
+
+
+def _run_soffice(input_paths, outdir, timeout):
+    # Start a throwaway soffice that converts every one of `input_paths` in turn
+    profile_dir = tempfile.mkdtemp(prefix="soffice-profile-")
+    try:
+        subprocess.run(
+            [
+                libreoffice_path(),
+                _profile_arg(profile_dir),
+                "--headless",
+                "--convert-to",
+                "pdf",
+                *input_paths,
+                "--outdir",
+                outdir,
+            ],
+            check=True,
+            timeout=timeout,
+        )
+    finally:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+
+
+def convert_with_new_process(input_path, outdir):
+    # Cold path: start a throwaway soffice for this one document
+    _run_soffice([input_path], outdir, settings.OFFICE_POOL_TIMEOUT)
+    return _pdf_path(input_path, outdir)
+
+
+def convert_many_with_new_process(input_paths, outdir):
+    # One soffice for a whole group of documents, so startup is paid once. It
+    # skips documents it can't convert, those are the ones without a PDF after.
+    timeout = settings.OFFICE_POOL_TIMEOUT * len(input_paths)
+    error = "LibreOffice could not convert the document"
+    try:
+        with stage("soffice"):
+            _run_soffice(input_paths, outdir, timeout)
+    except subprocess.TimeoutExpired:
+        error = f"Conversion timed out after {timeout} seconds"
+    except subprocess.CalledProcessError as e:
+        error = f"LibreOffice exited with status {e.returncode}"
+
+    for input_path in input_paths:
+        pdf_path = _pdf_path(input_path, outdir)
+        if os.path.exists(pdf_path):
+            yield input_path, pdf_path, None
+        else:
+            yield input_path, None, error
+
+
+class OfficeInstance:
+    # One long-lived headless soffice with its own profile, accepting UNO
+    # connections on a named pipe unique to this process and slot
+    def __init__(self, uno, index):
+        self.uno = uno
+        self.index = index
+        self.process = None
+        self.profile_dir = None
+        self.desktop = None
+        self.conversions = 0
+        self._generation = 0
+
+    def start(self):
+        self._generation += 1
+        self.conversions = 0
+        self.profile_dir = tempfile.mkdtemp(prefix="soffice-profile-")
+        pipe_name = f"removeimagebg-{os.getpid()}-{self.index}-{self._generation}"
+
+        self.process = subprocess.Popen(
+            [
+                libreoffice_path(),
+                _profile_arg(self.profile_dir),
+                "--headless",
+                "--invisible",
+                "--nologo",
+                "--nodefault",
+                "--norestore",
+                "--nolockcheck",
+                f"--accept=pipe,name={pipe_name};urp;StarOffice.ComponentContext",
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+        local_context = self.uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_context
+        )
+
+        # soffice takes a few seconds before it accepts connections
+        deadline = time.monotonic() + settings.OFFICE_POOL_START_TIMEOUT
+        while True:
+            try:
+                context = resolver.resolve(
+                    f"uno:pipe,name={pipe_name};urp;StarOffice.ComponentContext"
+                )
+                break
+            except Exception:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise ConversionError("LibreOffice instance failed to start")
+                time.sleep(0.25)
+
+        self.desktop = context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.frame.Desktop", context
+        )
+
+    def healthy(self):
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            self.desktop.getComponents()
+        except Exception:
+            return False
+        return True
+
+    def stop(self):
+        # Ask soffice to quit over UNO, and kill it if that isn't possible
+        terminated = False
+        if self.desktop is not None:
+            try:
+                terminated = self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=5 if terminated else 0)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+        if self.profile_dir is not None:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.profile_dir = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def _properties(self, **values):
+        properties = []
+        for name, value in values.items():
+            prop = self.uno.createUnoStruct("com.sun.star.beans.PropertyValue")
+            prop.Name = name
+            prop.Value = value
+            properties.append(prop)
+        return tuple(properties)
+
+    def _convert(self, input_path, pdf_path):
+        document = self.desktop.loadComponentFromURL(
+            self.uno.systemPathToFileUrl(input_path),
+            "_blank",
+            0,
+            self._properties(Hidden=True, ReadOnly=True),
+        )
+        if document is None:
+            raise ConversionError("LibreOffice could not open the document")
+
+        try:
+            for service, pdf_filter in PDF_FILTERS:
+                if document.supportsService(service):
+                    break
+            else:
+                raise ConversionError("Unsupported document type")
+
+            document.storeToURL(
+                self.uno.systemPathToFileUrl(pdf_path),
+                self._properties(FilterName=pdf_filter),
+            )
+        finally:
+            document.close(True)
+
+    def convert(self, input_path, pdf_path, timeout):
+        # UNO calls block, so run the conversion on a helper thread and kill the
+        # instance if it doesn't finish in time (which also unblocks the call)
+        outcome = {}
+
+        def run():
+            try:
+                self._convert(input_path, pdf_path)
+            except Exception as e:
+                outcome["error"] = e
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(timeout)
+
+        if thread.is_alive():
+            self.process.kill()
+            self.process.wait()
+            raise ConversionError(f"Conversion timed out after {timeout} seconds")
+        if "error" in outcome:
+            raise ConversionError(str(outcome["error"]))
+
+        self.conversions += 1
+
+
+class OfficePool:
+    # Fixed set of pre-warmed OfficeInstances, each used by one conversion at a
+    # time, recycled after `max_conversions` documents or whenever it crashes
+    def __init__(self, uno, size, max_conversions, timeout):
+        self.max_conversions = max_conversions
+        self.timeout = timeout
+        self._instances = [OfficeInstance(uno, index) for index in range(size)]
+        self._idle = queue.Queue()
+        for instance in self._instances:
+            self._idle.put(instance)
+        atexit.register(self.shutdown)
+
+    def _restart_in_background(self, instance):
+        def start():
+            try:
+                instance.restart()
+            except ConversionError:
+                logger.exception("Could not start LibreOffice instance")
+            finally:
+                self._idle.put(instance)
+
+        threading.Thread(target=start, daemon=True).start()
+
+    def warm(self):
+        # Start every idle instance in the background so the first requests don't
+        # pay for soffice startup
+        idle = []
+        while True:
+            try:
+                idle.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for instance in idle:
+            if instance.healthy():
+                self._idle.put(instance)
+            else:
+                self._restart_in_background(instance)
+
+    def _acquire(self):
+        waiting_since = time.perf_counter()
+        try:
+            instance = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise ConversionError("No LibreOffice instance became available")
+        observe(
+            "queue_wait_seconds", time.perf_counter() - waiting_since, queue="office"
+        )
+        return instance
+
+    def _release(self, instance):
+        # Recycle instances that crashed, timed out or reached their conversion
+        # limit, without making the next job wait for the new soffice
+        if instance.conversions >= self.max_conversions or not instance.healthy():
+            self._restart_in_background(instance)
+        else:
+            self._idle.put(instance)
+
+    def _convert_on(self, instance, input_path, outdir):
+        pdf_path = _pdf_path(input_path, outdir)
+        if instance.conversions >= self.max_conversions or not instance.healthy():
+            instance.restart()
+        instance.convert(input_path, pdf_path, self.timeout)
+        return pdf_path
+
+    def convert(self, input_path, outdir):
+        instance = self._acquire()
+        try:
+            return self._convert_on(instance, input_path, outdir)
+        finally:
+            self._release(instance)
+
+    def convert_many(self, input_paths, outdir):
+        # A group of documents one after the other on a single instance, yielding
+        # (input path, PDF path or None, error or None) as each one is done. A
+        # document that fails doesn't stop the others.
+        instance = self._acquire()
+        try:
+            for input_path in input_paths:
+                try:
+                    with stage("soffice"):
+                        pdf_path = self._convert_on(instance, input_path, outdir)
+                except ConversionError as e:
+                    yield input_path, None, str(e)
+                else:
+                    yield input_path, pdf_path, None
+        finally:
+            self._release(instance)
+
+    def shutdown(self):
+        for instance in self._instances:
+            instance.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_uno_missing = False
+
+
+def get_pool():
+    # The pool for this process, or None when it's disabled or UNO isn't installed
+    global _pool, _uno_missing
+    if settings.OFFICE_POOL_SIZE <= 0 or _uno_missing:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            uno = _import_uno()
+            if uno is None:
+                logger.warning(
+                    "The uno module is not available, LibreOffice will be started for every conversion"
+                )
+                _uno_missing = True
+                return None
+            _pool = OfficePool(
+                uno,
+                settings.OFFICE_POOL_SIZE,
+                settings.OFFICE_POOL_MAX_CONVERSIONS,
+                settings.OFFICE_POOL_TIMEOUT,
+            )
+        return _pool
+
+
+def prewarm():
+    # Called from the WSGI/ASGI entry points so each web worker starts its
+    # LibreOffice instances at boot rather than on its first conversion
+    if settings.OFFICE_POOL_PREWARM:
+        pool = get_pool()
+        if pool is not None:
+            pool.warm()
+
+
+def memory_estimate(size, processes=1):
+    # Memory a conversion is expected to need, for admission control: LibreOffice
+    # holds a document at several times its file size, on top of a fixed overhead
+    # for each soffice involved
+    return CONVERSION_MEMORY_BASE * processes + size * CONVERSION_MEMORY_PER_BYTE
+
+
+def batch_parallelism():
+    # How many groups of a batch are converted at once: one per pooled instance,
+    # otherwise one soffice per core
+    parallelism = settings.OFFICE_BATCH_PARALLELISM or available_cores()
+    if get_pool() is not None:
+        parallelism = min(parallelism, settings.OFFICE_POOL_SIZE)
+    return parallelism
+
+
+def batch_groups(input_paths, count):
+    # Split a batch into at most `count` groups of about the same total size,
+    # biggest documents first, each group to be converted by one soffice
+    groups = [[] for _ in range(min(count, len(input_paths)))]
+    sizes = [0] * len(groups)
+    for input_path in sorted(input_paths, key=os.path.getsize, reverse=True):
+        smallest = sizes.index(min(sizes))
+        groups[smallest].append(input_path)
+        sizes[smallest] += os.path.getsize(input_path)
+    return groups
+
+
+def convert_many_to_pdf(input_paths, outdir):
+    # Convert a group of documents with a single LibreOffice, a pooled instance
+    # when the pool is available, yielding (input path, PDF path or None, error or
+    # None) for each of them
+    pool = get_pool()
+    if pool is None:
+        return convert_many_with_new_process(input_paths, outdir)
+    return pool.convert_many(input_paths, outdir)
+
+
+def convert_to_pdf(input_path, outdir):
+    # Convert an Office document with LibreOffice and return the path of the PDF,
+    # using a pooled instance when the pool is available
+    pool = get_pool()
+    with stage("soffice"):
+        if pool is None:
+            return convert_with_new_process(input_path, outdir)
+        return pool.convert(input_path, outdir)
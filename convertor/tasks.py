@@ -0,0 +1,42 @@
+import json
+import os
+
+from django.conf import settings
+
+from .html import html_to_pdf as render_html
+from .ocr import ocr_pdf
+from .office import convert_to_pdf
+
+# Job pool entry points, see jobs.pool.run_job
+
+
+def office_to_pdf(job_dir, input_name):
+    pdf_file_path = convert_to_pdf(os.path.join(job_dir, input_name), job_dir)
+
+    if not os.path.exists(pdf_file_path):
+        raise RuntimeError("PDF file was not created")
+
+    return os.path.basename(pdf_file_path), "application/pdf"
+
+
+def html_to_pdf(job_dir, input_name, options=None):
+    with open(os.path.join(job_dir, input_name)) as f:
+        html_content = f.read()
+
+    with open(os.path.join(job_dir, "result.pdf"), "wb") as f:
+        f.write(render_html(html_content, options))
+    return "result.pdf", "application/pdf"
+
+
+def pdf_ocr(job_dir, input_name, render=None, page_numbers=None, mode=None):
+    result = ocr_pdf(
+        os.path.join(job_dir, input_name),
+        page_numbers,
+        mode or settings.OCR_DEFAULT_MODE,
+        render,
+    )
+
+    with open(os.path.join(job_dir, "result.json"), "w") as f:
+        json.dump(result, f)
+
+    return "result.json", "application/json"
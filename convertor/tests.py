@@ -1,3 +1,551 @@
-from django.test import TestCase
+import io
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+import fitz
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+
+from benchmarks.fixtures import photo
+
+from . import cache, html
+from .cache import cached_pdf, conversion_cache_stats, conversion_key
+from .html import UNREACHABLE_PROXY, RendererPool, html_options
+from .ocr import ocr_pdf, parse_page_range
+from .office import ConversionError, OfficeInstance, OfficePool, batch_groups
+from .views import _OfficeBatchStream
+from .workspace import Workspace
+
+
+class FakeInstance:
+    # Stands in for a soffice process: converts by writing the PDF, and counts how
+    # often it was (re)started
+    def __init__(self, uno, index):
+        self.conversions = 0
+        self.starts = 0
+        self.alive = True
+        self.crash = False
+
+    def healthy(self):
+        return self.alive
+
+    def restart(self):
+        self.starts += 1
+        self.conversions = 0
+        self.alive = True
+
+    def stop(self):
+        self.alive = False
+
+    def convert(self, input_path, pdf_path, timeout):
+        if self.crash:
+            self.alive = False
+            raise ConversionError("LibreOffice crashed")
+        with open(pdf_path, "w") as f:
+            f.write("%PDF")
+        self.conversions += 1
+
+
+@override_settings(METRICS_DIR=None)
+@mock.patch("convertor.office.OfficeInstance", FakeInstance)
+class OfficePoolTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def document(self, name):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write("text")
+        return path
+
+    def test_recycled_after_max_conversions(self):
+        pool = OfficePool(None, 1, 2, 5)
+        (instance,) = pool._instances
+
+        for index in range(3):
+            pdf_path = pool.convert(self.document(f"{index}.txt"), self.directory)
+            self.assertTrue(os.path.exists(pdf_path))
+
+        # Restarted once, in the background after the second document
+        self.assertEqual(instance.starts, 1)
+        self.assertEqual(instance.conversions, 1)
+
+    def test_crashed_instance_is_restarted(self):
+        pool = OfficePool(None, 1, 100, 5)
+        (instance,) = pool._instances
+        instance.crash = True
+
+        with self.assertRaises(ConversionError):
+            pool.convert(self.document("a.txt"), self.directory)
+
+        instance.crash = False
+        pool.convert(self.document("b.txt"), self.directory)
+        self.assertEqual(instance.starts, 1)
+
+    def test_failed_document_does_not_stop_the_group(self):
+        pool = OfficePool(None, 1, 100, 5)
+        (instance,) = pool._instances
+        paths = [self.document(f"{index}.txt") for index in range(3)]
+
+        results = []
+        for input_path, pdf_path, error in pool.convert_many(paths, self.directory):
+            results.append(error)
+            # The next document finds a crashed instance and restarts it
+            instance.crash = input_path == paths[0]
+
+        self.assertEqual(results, [None, "LibreOffice crashed", None])
+        self.assertEqual(instance.starts, 1)
+
+
+class OfficeInstanceTests(SimpleTestCase):
+    def test_conversion_timing_out_kills_soffice(self):
+        instance = OfficeInstance(None, 0)
+        instance.process = subprocess.Popen(["sleep", "30"])
+        self.addCleanup(instance.stop)
+        # A UNO call only returns once soffice has gone away
+        instance._convert = lambda input_path, pdf_path: instance.process.wait()
+
+        started = time.monotonic()
+        with self.assertRaisesMessage(ConversionError, "timed out after 0.2 seconds"):
+            instance.convert("a.docx", "a.pdf", 0.2)
+
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertIsNotNone(instance.process.poll())
+        self.assertFalse(instance.healthy())
+        self.assertEqual(instance.conversions, 0)
+
+
+class ParsePageRangeTests(SimpleTestCase):
+    def test_every_page_without_a_spec(self):
+        self.assertEqual(parse_page_range(None, 3), [0, 1, 2])
+        self.assertEqual(parse_page_range("", 3), [0, 1, 2])
+
+    def test_pages_and_ranges(self):
+        self.assertEqual(parse_page_range("1-3,7,10-", 11), [0, 1, 2, 6, 9, 10])
+        self.assertEqual(parse_page_range("-2", 5), [0, 1])
+
+    def test_in_order_given_without_duplicates(self):
+        self.assertEqual(parse_page_range("3, 1-3 ,,2", 5), [2, 0, 1])
+
+    def test_invalid_ranges(self):
+        for spec in ("a", "1-b", "0", "4", "3-2", "2-9"):
+            with self.subTest(spec=spec), self.assertRaises(ValueError):
+                parse_page_range(spec, 3)
+
+
+@override_settings(METRICS_DIR=None)
+class PdfOcrViewTests(SimpleTestCase):
+    def test_malformed_pdf_is_refused(self):
+        for data in (b"", b"not a pdf", b"%PDF-1.4 truncated"):
+            with self.subTest(data=data):
+                upload = SimpleUploadedFile("scan.pdf", data)
+                response = self.client.post("/convert/pdf-ocr/", {"file": upload})
+
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(
+                    response.json(), {"error": "The file is not a valid PDF"}
+                )
+
+    @mock.patch("jobs.views.submit")
+    def test_malformed_pdf_job_is_refused(self, submit):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        with override_settings(JOBS_DIR=directory.name):
+            for data in (b"", b"not a pdf"):
+                with self.subTest(data=data):
+                    upload = SimpleUploadedFile("scan.pdf", data)
+                    response = self.client.post(
+                        "/convert/pdf-ocr/jobs/", {"file": upload}
+                    )
+
+                    self.assertEqual(response.status_code, 400)
+                    self.assertEqual(
+                        response.json(), {"error": "The file is not a valid PDF"}
+                    )
+
+        submit.assert_not_called()
+        self.assertEqual(os.listdir(directory.name), [])
+
+
+@override_settings(
+    OCR_CACHE_DIR=None,
+    OCR_NATIVE_TEXT_MIN_CHARS=20,
+    OCR_MIN_IMAGE_AREA=0.05,
+    METRICS_DIR=None,
+)
+class HybridOcrTests(SimpleTestCase):
+    # Pages run on a thread instead of the process pool, "Tesseract" names the
+    # region it was given
+    def setUp(self):
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+        for target, value in (
+            ("convertor.ocr._get_executor", mock.Mock(return_value=executor)),
+            (
+                "convertor.ocr.recognize",
+                lambda pix, options: f"OCR {pix.width}x{pix.height}",
+            ),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.pdf_path = os.path.join(directory.name, "document.pdf")
+
+        with fitz.open() as pdf_document:
+            text = "A page with a text layer of its own."
+            # Text only, text with a photo, a photo only and a small logo
+            for page_number, image_rect in enumerate(
+                (None, (50, 100, 250, 300), (0, 0, 595, 842), (500, 20, 520, 40))
+            ):
+                page = pdf_document.new_page()
+                if page_number != 2:
+                    page.insert_text((50, 60), text, fontsize=11)
+                if image_rect:
+                    page.insert_image(image_rect, stream=photo((200, 200)))
+            pdf_document.save(self.pdf_path)
+
+    def test_pages_are_classified(self):
+        result = ocr_pdf(self.pdf_path, mode="hybrid")
+
+        self.assertEqual(
+            [page["method"] for page in result["pages"]],
+            ["native", "mixed", "ocr", "native"],
+        )
+
+    def test_mixed_pages_keep_the_text_layer_apart_from_the_ocr_text(self):
+        result = ocr_pdf(self.pdf_path, [1], mode="hybrid")
+
+        # Only the photo's region is rendered, at 72 dpi
+        self.assertEqual(
+            result["ocr_text"],
+            "\n\nPage 2:\nA page with a text layer of its own.\n\nOCR 200x200",
+        )
+
+    def test_ocr_mode_ignores_the_text_layer(self):
+        result = ocr_pdf(self.pdf_path, mode="ocr")
+
+        self.assertEqual([page["method"] for page in result["pages"]], ["ocr"] * 4)
+
+
+class WorkspaceTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(CONVERTOR_WORKSPACE_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_removed_on_exit(self):
+        with self.assertRaises(ValueError):
+            with Workspace() as workspace:
+                upload = SimpleUploadedFile("report.docx", b"data")
+                path = workspace.save_upload(upload)
+                self.assertEqual(os.path.dirname(path), workspace.path)
+                raise ValueError
+
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_concurrent_uploads_with_the_same_name_are_apart(self):
+        with Workspace() as first, Workspace() as second:
+            self.assertNotEqual(
+                first.save_upload(SimpleUploadedFile("a.docx", b"1")),
+                second.save_upload(SimpleUploadedFile("a.docx", b"2")),
+            )
+
+    def test_file_names_stay_inside(self):
+        with Workspace() as workspace:
+            path = workspace.file_path("../../etc/passwd")
+            self.assertEqual(os.path.dirname(path), workspace.path)
+
+    def test_kept_until_the_response_is_closed(self):
+        with Workspace() as workspace:
+            path = workspace.file_path("out.pdf")
+            with open(path, "wb") as f:
+                f.write(b"%PDF")
+            response = workspace.file_response(path, "out.pdf", "application/pdf")
+
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF")
+        response.close()
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class BatchGroupsTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def document(self, name, size):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        return path
+
+    def test_balanced_by_size_biggest_first(self):
+        big = self.document("big.docx", 90)
+        medium = self.document("medium.docx", 50)
+        small = [self.document(f"small{i}.docx", 20) for i in range(2)]
+
+        groups = batch_groups([small[0], big, small[1], medium], 2)
+
+        self.assertEqual(groups, [[big], [medium, small[0], small[1]]])
+
+    def test_no_more_groups_than_documents(self):
+        paths = [self.document(f"{i}.docx", 10) for i in range(2)]
+        self.assertEqual(len(batch_groups(paths, 8)), 2)
+        self.assertEqual(batch_groups([], 4), [])
+
+
+@mock.patch("convertor.views.batch_parallelism", mock.Mock(return_value=2))
+class OfficeBatchStreamTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.events = []
+        self.documents = []
+        for index in range(6):
+            path = os.path.join(self.directory, f"{index}.docx")
+            with open(path, "w") as f:
+                f.write("text")
+            self.documents.append((index, f"{index}.docx", path))
+
+    def convert_many(self, input_paths, outdir):
+        for input_path in input_paths:
+            time.sleep(0.02)
+            pdf_path = os.path.splitext(input_path)[0] + ".pdf"
+            with open(pdf_path, "w") as f:
+                f.write("%PDF")
+            self.events.append("converted")
+            yield input_path, pdf_path, None
+
+    def stream(self):
+        return _OfficeBatchStream(
+            self.documents, self.directory, lambda: self.events.append("cleanup")
+        )
+
+    def test_every_document_and_a_manifest(self):
+        with mock.patch("convertor.views.convert_many_to_pdf", self.convert_many):
+            stream = self.stream()
+            data = b"".join(stream)
+            stream.close()
+
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            names = archive.namelist()
+            manifest = json.loads(archive.read("manifest.json"))
+        self.assertEqual(len(names), 7)
+        self.assertEqual(manifest["converted"], 6)
+
+    def test_closed_early_waits_for_the_conversions(self):
+        with mock.patch("convertor.views.convert_many_to_pdf", self.convert_many):
+            stream = self.stream()
+            # The client goes away after the first document, the response still
+            # holds the iterator when it closes the stream
+            chunks = iter(stream)
+            next(chunks)
+            stream.close()
+
+        time.sleep(0.1)
+        self.assertEqual(self.events[-1], "cleanup")
+
+
+class ConversionCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(
+            CONVERT_CACHE_DIR=directory.name,
+            CONVERT_CACHE_BYTES=10**9,
+            METRICS_DIR=None,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for name in ("_cache", "_counters"):
+            setattr(cache, name, None)
+            self.addCleanup(setattr, cache, name, None)
+        self.conversions = 0
+
+    def convert(self):
+        self.conversions += 1
+        time.sleep(0.2)
+        return b"%PDF converted"
+
+    def test_identical_requests_together_are_converted_once(self):
+        key = conversion_key("html", b"<p>Hi</p>")
+        start = threading.Barrier(4)
+        results = []
+
+        def request():
+            start.wait()
+            with cached_pdf("html", key, self.convert) as pdf_file:
+                results.append(pdf_file.read())
+
+        threads = [threading.Thread(target=request) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.conversions, 1)
+        self.assertEqual(results, [b"%PDF converted"] * 4)
+        stats = conversion_cache_stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"] + stats["collapsed"], 3)
+        # The key's lock file goes with the conversion
+        self.assertEqual(os.listdir(os.path.join(self.directory, "locks")), [])
+
+    def test_different_inputs_and_options_are_converted_apart(self):
+        keys = {
+            conversion_key("html", b"<p>Hi</p>"),
+            conversion_key("html", b"<p>Bye</p>"),
+            conversion_key("html", b"<p>Hi</p>", {"orientation": "Landscape"}),
+            conversion_key("office", b"<p>Hi</p>"),
+        }
+        for key in keys:
+            cached_pdf("html", key, self.convert).close()
+
+        self.assertEqual(len(keys), 4)
+        self.assertEqual(self.conversions, 4)
+
+    def test_converter_writing_a_file(self):
+        pdf_path = os.path.join(self.directory, "out.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(b"%PDF written")
+        key = conversion_key("office", pdf_path)
+
+        for _ in range(2):
+            with cached_pdf("office", key, lambda: pdf_path) as pdf_file:
+                self.assertEqual(pdf_file.read(), b"%PDF written")
+
+        self.assertEqual(conversion_cache_stats()["hits"], 1)
+
+
+@override_settings(
+    HTML_PDF_PAGE_SIZE="A4",
+    HTML_PDF_MARGIN_MM=10,
+    HTML_PDF_JAVASCRIPT_DELAY=200,
+    HTML_PDF_MAX_JAVASCRIPT_DELAY=5000,
+    HTML_PDF_REMOTE_ASSETS=False,
+)
+class HtmlOptionsTests(SimpleTestCase):
+    def test_defaults(self):
+        options = html_options()
+        self.assertEqual(options["page-size"], "A4")
+        self.assertEqual(options["orientation"], "Portrait")
+        self.assertEqual(options["margin-top"], "10mm")
+        self.assertEqual(options["javascript-delay"], "200")
+        self.assertEqual(options["proxy"], UNREACHABLE_PROXY)
+
+    def test_per_request_options(self):
+        options = html_options(
+            page_size="letter",
+            orientation="LANDSCAPE",
+            margin="5",
+            margin_left="12.5",
+            remote_assets="true",
+        )
+        self.assertEqual(options["page-size"], "Letter")
+        self.assertEqual(options["orientation"], "Landscape")
+        self.assertEqual(options["margin-right"], "5mm")
+        self.assertEqual(options["margin-left"], "12.5mm")
+        self.assertNotIn("proxy", options)
+
+    def test_invalid_options(self):
+        for kwargs in (
+            {"page_size": "A9"},
+            {"orientation": "diagonal"},
+            {"margin": "wide"},
+            {"margin_top": "-1"},
+            {"margin": "101"},
+            {"javascript_delay": "5001"},
+            {"remote_assets": "maybe"},
+        ):
+            with self.subTest(**kwargs), self.assertRaises(ValueError):
+                html_options(**kwargs)
+
+
+class FakeRendererPool(RendererPool):
+    # wkhtmltopdf replaced by a shell that reads the HTML and prints a "PDF" naming
+    # the page size it was started for
+    def __init__(self, size, timeout=5, script='cat > /dev/null; printf "%%PDF $0"'):
+        super().__init__(size, timeout)
+        self.script = script
+        self.started = []
+
+    def _command(self, options):
+        return ("sh", "-c", self.script, options["page-size"])
+
+    def _start(self, command):
+        process = super()._start(command)
+        self.started.append(process)
+        return process
+
+    def idle(self):
+        return [process for waiting in self._idle.values() for process in waiting]
+
+
+class RendererPoolTests(SimpleTestCase):
+    def pool(self, *args, **kwargs):
+        pool = FakeRendererPool(*args, **kwargs)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def test_rendered_by_a_process_started_ahead(self):
+        pool = self.pool(1)
+        pool.warm({"page-size": "A4"})
+        (warm,) = pool.started
+
+        self.assertEqual(pool.render("<p>Hi</p>", {"page-size": "A4"}), b"%PDF A4")
+
+        self.assertIsNotNone(warm.poll())
+        # Another one is already waiting for the next document
+        (waiting,) = pool.idle()
+        self.assertIsNot(waiting, warm)
+        self.assertIsNone(waiting.poll())
+
+    def test_oldest_options_make_way(self):
+        pool = self.pool(2)
+        for page_size in ("A4", "A5", "Letter"):
+            pool.render("<p>Hi</p>", {"page-size": page_size})
+
+        self.assertEqual([command[-1] for command in pool._idle], ["A5", "Letter"])
+        self.assertEqual(len(pool.idle()), 2)
+
+    def test_nothing_started_ahead_without_a_pool(self):
+        pool = self.pool(0)
+        pool.warm({"page-size": "A4"})
+        self.assertEqual(pool.started, [])
+
+        self.assertEqual(pool.render("<p>Hi</p>", {"page-size": "A4"}), b"%PDF A4")
+        self.assertEqual(pool.idle(), [])
+
+    def test_timeout(self):
+        pool = self.pool(0, timeout=0.2, script="exec sleep 30")
+        with self.assertRaisesMessage(ConversionError, "timed out after 0.2 seconds"):
+            pool.render("<p>Hi</p>", {"page-size": "A4"})
+        self.assertIsNotNone(pool.started[0].poll())
+
+    @override_settings(HTML_PDF_POOL_SIZE=4, HTML_PDF_TIMEOUT=5)
+    def test_one_waiting_process_in_job_processes(self):
+        for job_process, size in ((False, 4), (True, 1)):
+            with self.subTest(job_process=job_process):
+                html._pool = None
+                self.addCleanup(setattr, html, "_pool", None)
+                with mock.patch("jobs.pool._job_process", job_process):
+                    self.assertEqual(html.get_pool().size, size)
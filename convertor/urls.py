@@ -1,11 +1,17 @@
 from django.urls import path
 
 from .views import (
+    ConversionCacheStatsView,
     ConvertDocxToPdf,
     ConvertPptToPdf,
     ConvertToPdf,
     ConvertXlsxToPdf,
+    OfficeBatchToPdfView,
+    PdfOcrCacheStatsView,
     PdfOcrView,
+    SubmitHtmlToPdfJob,
+    SubmitOfficeToPdfJob,
+    SubmitPdfOcrJob,
 )
 
 urlpatterns = [
@@ -14,6 +20,45 @@ urlpatterns = [
     ),
     path("convert/xlsx-to-pdf/", ConvertXlsxToPdf.as_view(), name="convert-xls-to-pdf"),
     path("convert/ppt-to-pdf/", ConvertPptToPdf.as_view(), name="convert-ppt-to-pdf"),
+    path(
+        "convert/office-to-pdf/batch/",
+        OfficeBatchToPdfView.as_view(),
+        name="convert-office-to-pdf-batch",
+    ),
     path("convert/html-to-pdf/", ConvertToPdf.as_view(), name="convert-html-to-pdf"),
+    path(
+        "convert/cache/stats/",
+        ConversionCacheStatsView.as_view(),
+        name="convert-cache-stats",
+    ),
     path("convert/pdf-ocr/", PdfOcrView.as_view(), name="convert-pdf-ocr"),
+    path(
+        "convert/pdf-ocr/cache/stats/",
+        PdfOcrCacheStatsView.as_view(),
+        name="convert-pdf-ocr-cache-stats",
+    ),
+    # Asynchronous variants, see the jobs app
+    path(
+        "convert/docx-to-pdf/jobs/",
+        SubmitOfficeToPdfJob.as_view(kind="docx-to-pdf"),
+        name="convert-docx-to-pdf-jobs",
+    ),
+    path(
+        "convert/xlsx-to-pdf/jobs/",
+        SubmitOfficeToPdfJob.as_view(kind="xlsx-to-pdf"),
+        name="convert-xls-to-pdf-jobs",
+    ),
+    path(
+        "convert/ppt-to-pdf/jobs/",
+        SubmitOfficeToPdfJob.as_view(kind="ppt-to-pdf"),
+        name="convert-ppt-to-pdf-jobs",
+    ),
+    path(
+        "convert/html-to-pdf/jobs/",
+        SubmitHtmlToPdfJob.as_view(),
+        name="convert-html-to-pdf-jobs",
+    ),
+    path(
+        "convert/pdf-ocr/jobs/", SubmitPdfOcrJob.as_view(), name="convert-pdf-ocr-jobs"
+    ),
 ]
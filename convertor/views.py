@@ -1,14 +1,12 @@
+import json
 import logging
 import os
+import queue
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
-import fitz  # PyMuPDF
-import pdfkit
-import pytesseract
-from django.core.files.storage import default_storage
-from django.http import FileResponse
-from PIL import Image
-from rest_framework.parsers import FormParser, MultiPartParser
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
 
 logger = logging.getLogger(__name__)
 
@@ -16,234 +14,466 @@ from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from jobs.views import enqueue_job
+from RemoveImageBG.admission import AdmissionViewMixin, upload_size
+from RemoveImageBG.executors import OffloadViewMixin
+from RemoveImageBG.parsers import FormParser, MultiPartParser
+from RemoveImageBG.streaming import stream_zip
+
+from .cache import cached_pdf, conversion_cache_stats, conversion_key
+from .html import html_options, html_to_pdf
+from .ocr import (
+    OCR_MODES,
+    ocr_cache_stats,
+    ocr_pages,
+    ocr_pdf,
+    render_options,
+    select_pages,
+)
+from .office import (
+    OFFICE_EXTENSIONS,
+    ConversionError,
+    batch_groups,
+    batch_parallelism,
+    convert_many_to_pdf,
+    convert_to_pdf,
+    memory_estimate,
+)
+from .workspace import Workspace, WorkspaceUploadMixin
+
+
+class PdfNotCreated(Exception):
+    pass
+
+
+def _requested_html_options(request):
+    return html_options(
+        **{
+            name: request.data.get(name)
+            for name in (
+                "page_size",
+                "orientation",
+                "margin",
+                "margin_top",
+                "margin_right",
+                "margin_bottom",
+                "margin_left",
+                "javascript_delay",
+                "remote_assets",
+            )
+        }
+    )
+
 
-class ConvertDocxToPdf(APIView):
+class OfficeToPdfView(
+    AdmissionViewMixin, OffloadViewMixin, WorkspaceUploadMixin, APIView
+):
+    executor = "convert"
+    admission_pool = "office"
+    # Shared by the Word, Excel and PowerPoint endpoints, LibreOffice picks the
+    # import filter from the uploaded file's extension
     parser_classes = (MultiPartParser, FormParser)
 
+    @classmethod
+    def memory_estimate(cls, request):
+        return memory_estimate(upload_size(request))
+
     def post(self, request, *args, **kwargs):
-        # Get the uploaded DOCX file from the request
-        docx_file = request.FILES.get("file", None)
+        # Get the uploaded file from the request
+        uploaded_file = request.FILES.get("file", None)
 
-        if not docx_file:
+        if not uploaded_file:
             return Response(
                 {"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Save the DOCX file temporarily
-        docx_file_path = default_storage.save(f"temp/{docx_file.name}", docx_file)
-
-        # Define paths for conversion
-        docx_file_full_path = default_storage.path(docx_file_path)
-        pdf_file_name = os.path.splitext(docx_file.name)[0] + ".pdf"
-        pdf_file_path = os.path.join(
-            os.path.dirname(docx_file_full_path), pdf_file_name
+        pdf_file_name = (
+            os.path.splitext(os.path.basename(uploaded_file.name))[0] + ".pdf"
         )
 
-        try:
-            # Use the full path for libreoffice (soffice) on macOS or Linux
-            libreoffice_path = (
-                "/Applications/LibreOffice.app/Contents/MacOS/soffice"
-                if os.path.exists(
-                    "/Applications/LibreOffice.app/Contents/MacOS/soffice"
+        with Workspace() as workspace:
+            # Save the file in this request's own directory
+            input_path = workspace.save_upload(uploaded_file)
+
+            def convert():
+                # Run LibreOffice to convert the document to PDF
+                pdf_file_path = convert_to_pdf(input_path, workspace.path)
+
+                # Check if the PDF file was created
+                if not os.path.exists(pdf_file_path):
+                    raise PdfNotCreated
+                return pdf_file_path
+
+            try:
+                # The same document converts to the same PDF, LibreOffice picks
+                # the import filter from the extension so that's part of the key
+                key = conversion_key(
+                    "office",
+                    input_path,
+                    {"extension": os.path.splitext(input_path)[1].lower()},
                 )
-                else "libreoffice"
-            )
+                pdf_file = cached_pdf("office", key, convert)
 
-            # Run the command to convert DOCX to PDF
-            subprocess.run(
-                [
-                    libreoffice_path,
-                    "--headless",
-                    "--convert-to",
-                    "pdf",
-                    docx_file_full_path,
-                    "--outdir",
-                    os.path.dirname(docx_file_full_path),
-                ],
-                check=True,
-            )
+                # Serve the PDF file, the workspace goes once it has been sent
+                return workspace.file_response(
+                    pdf_file, pdf_file_name, "application/pdf"
+                )
 
-            # Check if the PDF file was created
-            if not os.path.exists(pdf_file_path):
+            except PdfNotCreated:
                 return Response(
                     {"error": "PDF file was not created"},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 )
+            except (subprocess.CalledProcessError, ConversionError) as e:
+                return Response(
+                    {"error": "File conversion failed: " + str(e)},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                )
+            except Exception as e:
+                return Response(
+                    {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
 
-            # Serve the PDF file as a response
-            pdf_file = open(pdf_file_path, "rb")
-            response = FileResponse(pdf_file, content_type="application/pdf")
-            response["Content-Disposition"] = f'attachment; filename="{pdf_file_name}"'
-            return response
 
-        except subprocess.CalledProcessError as e:
-            return Response(
-                {"error": "File conversion failed: " + str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            )
-        except Exception as e:
-            return Response(
-                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-        finally:
-            # Clean up the files
-            if os.path.exists(docx_file_full_path):
-                os.remove(docx_file_full_path)
-            if os.path.exists(pdf_file_path):
-                os.remove(pdf_file_path)
+class ConvertDocxToPdf(OfficeToPdfView):
+    pass
+
+
+class ConvertXlsxToPdf(OfficeToPdfView):
+    pass
 
 
-class ConvertXlsxToPdf(APIView):
+class ConvertPptToPdf(OfficeToPdfView):
+    pass
+
+
+class OfficeBatchToPdfView(
+    AdmissionViewMixin, OffloadViewMixin, WorkspaceUploadMixin, APIView
+):
+    # Many Word, Excel and PowerPoint files in one request. They are split into a
+    # few groups each converted by a single LibreOffice, the groups in parallel,
+    # and the PDFs are streamed back in a ZIP as they are done, with a
+    # manifest.json of what became of every file at the end.
+    executor = "convert"
+    admission_pool = "office"
     parser_classes = (MultiPartParser, FormParser)
 
+    @classmethod
+    def memory_estimate(cls, request):
+        return memory_estimate(upload_size(request), batch_parallelism())
+
     def post(self, request, *args, **kwargs):
-        # Get the uploaded Excel file from the request
-        excel_file = request.FILES.get("file", None)
+        uploaded_files = request.FILES.getlist("files")
 
-        if not excel_file:
+        if not uploaded_files:
             return Response(
-                {"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST
+                {"error": "No files provided"}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Save the Excel file temporarily
-        excel_file_path = default_storage.save(f"temp/{excel_file.name}", excel_file)
-
-        # Define paths for conversion
-        excel_file_full_path = default_storage.path(excel_file_path)
-        pdf_file_name = os.path.splitext(excel_file.name)[0] + ".pdf"
-        pdf_file_path = os.path.join(
-            os.path.dirname(excel_file_full_path), pdf_file_name
-        )
+        if len(uploaded_files) > settings.OFFICE_BATCH_MAX_FILES:
+            return Response(
+                {
+                    "error": f"A batch can contain at most {settings.OFFICE_BATCH_MAX_FILES} files"
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-        try:
-            # Use the full path for LibreOffice (soffice) on macOS or Linux
-            libreoffice_path = (
-                "/Applications/LibreOffice.app/Contents/MacOS/soffice"
-                if os.path.exists(
-                    "/Applications/LibreOffice.app/Contents/MacOS/soffice"
+        with Workspace() as workspace:
+            # The index keeps the PDF names apart when uploads share a name
+            documents = []
+            for index, uploaded_file in enumerate(uploaded_files, start=1):
+                file_name = os.path.basename(uploaded_file.name)
+                extension = os.path.splitext(file_name)[1].lower()
+                if extension not in OFFICE_EXTENSIONS:
+                    documents.append((index, file_name, None))
+                    continue
+                input_path = workspace.save_upload(
+                    uploaded_file, f"{index:03d}_{file_name}"
                 )
-                else "libreoffice"
+                documents.append((index, file_name, input_path))
+
+            # The stream removes the workspace when the response is closed
+            return StreamingHttpResponse(
+                _OfficeBatchStream(documents, workspace.path, workspace.keep()),
+                content_type="application/zip",
+                headers={
+                    "Content-Disposition": 'attachment; filename="converted_pdfs.zip"'
+                },
             )
 
-            # Run the command to convert Excel to PDF
-            subprocess.run(
-                [
-                    libreoffice_path,
-                    "--headless",
-                    "--convert-to",
-                    "pdf",
-                    excel_file_full_path,
-                    "--outdir",
-                    os.path.dirname(excel_file_full_path),
-                ],
-                check=True,
-            )
 
-            # Check if the PDF file was created
-            if not os.path.exists(pdf_file_path):
-                return Response(
-                    {"error": "PDF file was not created"},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                )
+class ConvertToPdf(OffloadViewMixin, APIView):
+    executor = "convert"
+    parser_classes = (FormParser, MultiPartParser)
 
-            # Serve the PDF file as a response
-            pdf_file = open(pdf_file_path, "rb")
-            response = FileResponse(pdf_file, content_type="application/pdf")
-            response["Content-Disposition"] = f'attachment; filename="{pdf_file_name}"'
-            return response
+    def post(self, request, *args, **kwargs):
+        html_content = request.data.get("html_content", None)
 
-        except subprocess.CalledProcessError as e:
+        if not html_content:
             return Response(
-                {"error": "File conversion failed: " + str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                {"error": "No HTML content provided"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            # e.g. page_size=Letter, margin=15, javascript_delay=500
+            options = _requested_html_options(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # Rendered in memory by wkhtmltopdf, nothing is written to disk
+            # unless it's cached
+            pdf_file = cached_pdf(
+                "html",
+                conversion_key("html", html_content.encode(), options),
+                lambda: html_to_pdf(html_content, options),
+            )
+            return FileResponse(
+                pdf_file,
+                as_attachment=True,
+                filename="converted_html.pdf",
+                content_type="application/pdf",
             )
         except Exception as e:
             return Response(
                 {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
-        finally:
-            # Clean up the files
-            if os.path.exists(excel_file_full_path):
-                os.remove(excel_file_full_path)
-            if os.path.exists(pdf_file_path):
-                os.remove(pdf_file_path)
 
 
-class ConvertPptToPdf(APIView):
+class PdfOcrView(OffloadViewMixin, WorkspaceUploadMixin, APIView):
+    executor = "ocr"
     parser_classes = (MultiPartParser, FormParser)
 
     def post(self, request, *args, **kwargs):
-        # Get the uploaded PowerPoint file from the request
-        ppt_file = request.FILES.get("file", None)
+        pdf_file = request.FILES.get("file", None)
 
-        if not ppt_file:
+        if not pdf_file:
             return Response(
                 {"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Save the PowerPoint file temporarily
-        ppt_file_path = default_storage.save(f"temp/{ppt_file.name}", ppt_file)
+        # "hybrid" takes the text layer where a page has one, "ocr" always runs Tesseract
+        mode = request.data.get("mode", settings.OCR_DEFAULT_MODE)
 
-        # Define paths for conversion
-        ppt_file_full_path = default_storage.path(ppt_file_path)
-        pdf_file_name = os.path.splitext(ppt_file.name)[0] + ".pdf"
-        pdf_file_path = os.path.join(os.path.dirname(ppt_file_full_path), pdf_file_name)
+        with Workspace() as workspace:
+            pdf_file_full_path = workspace.save_upload(pdf_file, "input.pdf")
 
-        try:
-            # Use the full path for LibreOffice (soffice) on macOS or Linux
-            libreoffice_path = (
-                "/Applications/LibreOffice.app/Contents/MacOS/soffice"
-                if os.path.exists(
-                    "/Applications/LibreOffice.app/Contents/MacOS/soffice"
-                )
-                else "libreoffice"
-            )
+            try:
+                if mode not in OCR_MODES:
+                    raise ValueError(f"mode must be one of: {', '.join(OCR_MODES)}")
 
-            # Run the command to convert PowerPoint to PDF
-            subprocess.run(
-                [
-                    libreoffice_path,
-                    "--headless",
-                    "--convert-to",
-                    "pdf",
-                    ppt_file_full_path,
-                    "--outdir",
-                    os.path.dirname(ppt_file_full_path),
-                ],
-                check=True,
-            )
+                # Only OCR the requested pages, e.g. pages=1-3,7
+                page_numbers = select_pages(
+                    pdf_file_full_path, request.data.get("pages")
+                )
 
-            # Check if the PDF file was created
-            if not os.path.exists(pdf_file_path):
+                # e.g. dpi=300, colorspace=gray, crop=content
+                render = render_options(
+                    request.data.get("dpi"),
+                    request.data.get("colorspace"),
+                    request.data.get("crop"),
+                )
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                if request.data.get("stream") == "ndjson":
+                    # Emit each page as soon as it's done, the stream removes the
+                    # workspace when the response is closed
+                    return StreamingHttpResponse(
+                        _OcrPageStream(
+                            pdf_file_full_path,
+                            page_numbers,
+                            mode,
+                            render,
+                            workspace.keep(),
+                        ),
+                        content_type="application/x-ndjson",
+                    )
+
+                result = ocr_pdf(pdf_file_full_path, page_numbers, mode, render)
+
+                return Response(result, status=status.HTTP_200_OK)
+
+            except Exception as e:
                 return Response(
-                    {"error": "PDF file was not created"},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
 
-            # Serve the PDF file as a response
-            pdf_file = open(pdf_file_path, "rb")
-            response = FileResponse(pdf_file, content_type="application/pdf")
-            response["Content-Disposition"] = f'attachment; filename="{pdf_file_name}"'
-            return response
 
-        except subprocess.CalledProcessError as e:
-            return Response(
-                {"error": "File conversion failed: " + str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            )
+class ConversionCacheStatsView(OffloadViewMixin, APIView):
+    def get(self, request, *args, **kwargs):
+        # Office and HTML to PDF cache hit rate, summed over all gunicorn workers
+        return Response(conversion_cache_stats(), status=status.HTTP_200_OK)
+
+
+class PdfOcrCacheStatsView(OffloadViewMixin, APIView):
+    def get(self, request, *args, **kwargs):
+        # Page cache hit rate, summed over all gunicorn workers
+        return Response(ocr_cache_stats(), status=status.HTTP_200_OK)
+
+
+class _OcrPageStream:
+    # One JSON line per page, in completion order. Django calls close() once the
+    # response is finished (or abandoned), which removes the request's workspace.
+    def __init__(self, pdf_file_full_path, page_numbers, mode, render, cleanup):
+        self.pdf_file_full_path = pdf_file_full_path
+        self.page_numbers = page_numbers
+        self.mode = mode
+        self.render = render
+        self.cleanup = cleanup
+
+    def __iter__(self):
+        try:
+            for page_number, text, method in ocr_pages(
+                self.pdf_file_full_path, self.page_numbers, self.mode, self.render
+            ):
+                yield json.dumps(
+                    {"page": page_number + 1, "method": method, "text": text}
+                ) + "\n"
+        except Exception as e:
+            logger.exception("OCR failed")
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    def close(self):
+        # The conversion threads write into the workspace. Closing the entries
+        # leaves their ThreadPoolExecutor block, which waits for the threads, so
+        # the workspace is only removed once nothing writes to it anymore.
+        if self._stream is not None:
+            self._stream.close()
+            self._entries_iter.close()
+        self.cleanup()
+
+
+class _OfficeBatchStream:
+    # The ZIP of an OfficeBatchToPdfView response. Every group is converted on its
+    # own thread and each PDF goes into the archive as soon as it's done, in
+    # completion order.
+    def __init__(self, documents, outdir, cleanup):
+        self.documents = documents
+        self.outdir = outdir
+        self.cleanup = cleanup
+        self._entries_iter = None
+        self._stream = None
+
+    def __iter__(self):
+        self._entries_iter = self._entries()
+        self._stream = stream_zip(self._entries_iter)
+        return self._stream
+
+    def _convert_group(self, group, done):
+        converted = set()
+        try:
+            for input_path, pdf_path, error in convert_many_to_pdf(group, self.outdir):
+                converted.add(input_path)
+                done.put((input_path, pdf_path, error))
         except Exception as e:
+            # The rest of the group fails with it, the other groups carry on
+            logger.exception("Batch conversion failed")
+            for input_path in group:
+                if input_path not in converted:
+                    done.put((input_path, None, str(e)))
+        finally:
+            done.put(None)
+
+    def _entries(self):
+        manifest = {}
+        by_path = {}
+        for index, file_name, input_path in self.documents:
+            if input_path is None:
+                manifest[index] = {
+                    "file": file_name,
+                    "status": "failed",
+                    "error": "Unsupported file type, expected one of: "
+                    + ", ".join(OFFICE_EXTENSIONS),
+                }
+            else:
+                by_path[input_path] = (index, file_name)
+
+        groups = batch_groups(list(by_path), batch_parallelism())
+        done = queue.Queue()
+        with ThreadPoolExecutor(
+            max_workers=max(1, len(groups)), thread_name_prefix="office-batch"
+        ) as executor:
+            for group in groups:
+                executor.submit(self._convert_group, group, done)
+
+            remaining = len(groups)
+            while remaining:
+                result = done.get()
+                if result is None:
+                    remaining -= 1
+                    continue
+                input_path, pdf_path, error = result
+                index, file_name = by_path[input_path]
+                if error is not None:
+                    manifest[index] = {
+                        "file": file_name,
+                        "status": "failed",
+                        "error": error,
+                    }
+                    continue
+
+                pdf_name = f"{index:03d}_{os.path.splitext(file_name)[0]}.pdf"
+                with open(pdf_path, "rb") as f:
+                    data = f.read()
+                os.remove(pdf_path)
+                manifest[index] = {
+                    "file": file_name,
+                    "status": "converted",
+                    "pdf": pdf_name,
+                }
+                yield pdf_name, data
+
+        files = [manifest[index] for index in sorted(manifest)]
+        converted = sum(entry["status"] == "converted" for entry in files)
+        yield "manifest.json", json.dumps(
+            {"converted": converted, "failed": len(files) - converted, "files": files},
+            indent=2,
+        ).encode()
+
+    def close(self):
+        # The conversion threads write into the workspace. Closing the entries
+        # leaves their ThreadPoolExecutor block, which waits for the threads, so
+        # the workspace is only removed once nothing writes to it anymore.
+        if self._stream is not None:
+            self._stream.close()
+            self._entries_iter.close()
+        self.cleanup()
+
+
+# Job variants of the views above: they store the input, queue the work on the job
+# pool and return a job id straight away (see the jobs app for status and results)
+
+
+class SubmitOfficeToPdfJob(OffloadViewMixin, WorkspaceUploadMixin, APIView):
+    parser_classes = (MultiPartParser, FormParser)
+    kind = None
+
+    def post(self, request, *args, **kwargs):
+        uploaded_file = request.FILES.get("file", None)
+
+        if not uploaded_file:
             return Response(
-                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST
             )
-        finally:
-            # Clean up the files
-            if os.path.exists(ppt_file_full_path):
-                os.remove(ppt_file_full_path)
-            if os.path.exists(pdf_file_path):
-                os.remove(pdf_file_path)
+
+        # LibreOffice picks the import filter from the extension, keep it
+        file_name = os.path.basename(uploaded_file.name)
+        input_name = "input" + os.path.splitext(file_name)[1].lower()
+
+        return enqueue_job(
+            request,
+            self.kind,
+            "convertor.tasks.office_to_pdf",
+            [(input_name, uploaded_file)],
+            args=(input_name,),
+            download_name=os.path.splitext(file_name)[0] + ".pdf",
+        )
 
 
-class ConvertToPdf(APIView):
+class SubmitHtmlToPdfJob(OffloadViewMixin, APIView):
     parser_classes = (FormParser, MultiPartParser)
 
     def post(self, request, *args, **kwargs):
@@ -255,27 +485,22 @@ class ConvertToPdf(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        pdf_file_path = default_storage.path("temp/converted_html.pdf")
-
         try:
-            # Use pdfkit to convert HTML to PDF
-            pdfkit.from_string(html_content, pdf_file_path)
-            pdf_file = open(pdf_file_path, "rb")
-            response = FileResponse(pdf_file, content_type="application/pdf")
-            response["Content-Disposition"] = (
-                'attachment; filename="converted_html.pdf"'
-            )
-            return response
-        except Exception as e:
-            return Response(
-                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-        finally:
-            if pdf_file_path and default_storage.exists(pdf_file_path):
-                default_storage.delete(pdf_file_path)
+            options = _requested_html_options(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return enqueue_job(
+            request,
+            "html-to-pdf",
+            "convertor.tasks.html_to_pdf",
+            [("input.html", html_content)],
+            args=("input.html", options),
+            download_name="converted_html.pdf",
+        )
 
 
-class PdfOcrView(APIView):
+class SubmitPdfOcrJob(OffloadViewMixin, WorkspaceUploadMixin, APIView):
     parser_classes = (MultiPartParser, FormParser)
 
     def post(self, request, *args, **kwargs):
@@ -286,33 +511,32 @@ class PdfOcrView(APIView):
                 {"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Save the PDF file temporarily
-        pdf_file_path = default_storage.save(f"temp/{pdf_file.name}", pdf_file)
-        pdf_file_full_path = default_storage.path(pdf_file_path)
+        # Same options as PdfOcrView, checked before the job is queued
+        mode = request.data.get("mode", settings.OCR_DEFAULT_MODE)
 
         try:
-            # Initialize OCR text result
-            ocr_text = ""
-
-            # Open the PDF with PyMuPDF
-            with fitz.open(pdf_file_full_path) as pdf_document:
-                for page_number in range(pdf_document.page_count):
-                    page = pdf_document[page_number]
-                    pix = page.get_pixmap()  # Render page to image
-                    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-                    # Perform OCR on the image
-                    text = pytesseract.image_to_string(img)
-                    ocr_text += f"\n\nPage {page_number + 1}:\n{text}"
-
-            return Response({"ocr_text": ocr_text}, status=status.HTTP_200_OK)
+            if mode not in OCR_MODES:
+                raise ValueError(f"mode must be one of: {', '.join(OCR_MODES)}")
 
-        except Exception as e:
-            return Response(
-                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            # The upload is spooled to a temporary file, the page count is read
+            # from there
+            page_numbers = select_pages(
+                pdf_file.temporary_file_path(), request.data.get("pages")
             )
 
-        finally:
-            # Clean up the file
-            if os.path.exists(pdf_file_full_path):
-                os.remove(pdf_file_full_path)
+            render = render_options(
+                request.data.get("dpi"),
+                request.data.get("colorspace"),
+                request.data.get("crop"),
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return enqueue_job(
+            request,
+            "pdf-ocr",
+            "convertor.tasks.pdf_ocr",
+            [("input.pdf", pdf_file)],
+            args=("input.pdf", render, page_numbers, mode),
+            download_name="ocr_text.json",
+        )
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http import FileResponse
+from django.utils.text import get_valid_filename
+
+
+class Workspace:
+    # A private temporary directory for one request, so concurrent uploads with the
+    # same name never share input or output paths. Used as a context manager it is
+    # removed on exit, unless it was handed to a response that removes it once sent.
+    def __init__(self):
+        os.makedirs(settings.CONVERTOR_WORKSPACE_DIR, exist_ok=True)
+        self.path = tempfile.mkdtemp(dir=settings.CONVERTOR_WORKSPACE_DIR)
+        self._kept = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self._kept:
+            self.cleanup()
+
+    def file_path(self, name):
+        return os.path.join(self.path, get_valid_filename(os.path.basename(name)))
+
+    def save_upload(self, uploaded_file, name=None):
+        # Uploads spooled to disk are moved into place, anything else is copied
+        # over chunk by chunk
+        path = self.file_path(name or uploaded_file.name)
+        if hasattr(uploaded_file, "temporary_file_path"):
+            file_move_safe(uploaded_file.temporary_file_path(), path)
+        else:
+            with open(path, "wb") as f:
+                for chunk in uploaded_file.chunks():
+                    f.write(chunk)
+        return path
+
+    def keep(self):
+        # Whoever calls this takes over removing the workspace
+        self._kept = True
+        return self.cleanup
+
+    def file_response(self, path, filename, content_type):
+        # `path` may also be a file that is already open
+        return WorkspaceFileResponse(
+            self,
+            open(path, "rb") if isinstance(path, str) else path,
+            as_attachment=True,
+            filename=filename,
+            content_type=content_type,
+        )
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class WorkspaceFileResponse(FileResponse):
+    # Streams a file out of a workspace (through the server's sendfile support
+    # where it has one) and removes the workspace once the response is closed
+    def __init__(self, workspace, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._resource_closers.append(workspace.keep())
+
+
+class WorkspaceUploadMixin:
+    # Spool uploads to a temporary file as they arrive instead of holding
+    # them in memory, they are moved into the request's workspace from there
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from jobs.store import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete expired jobs and their results"
+
+    def handle(self, *args, **options):
+        purged = purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} expired job(s)"))
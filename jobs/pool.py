@@ -0,0 +1,134 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from RemoveImageBG.metrics import observe
+from RemoveImageBG.threads import limit_threads, thread_budget
+
+from .store import job_dir, purge_expired, update_job
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    pass
+
+
+_lock = threading.Lock()
+_executor = None
+_pending = 0
+_last_purge = 0.0
+_job_process = False
+
+
+def in_job_process():
+    # True in the pool's processes, which run one job at a time
+    return _job_process
+
+
+def _init_process(settings_module):
+    # Pool processes are spawned, not forked, so they don't inherit model sessions
+    # or ONNX Runtime threads from the web worker; they set Django up themselves
+    global _job_process
+    _job_process = True
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    limit_threads(thread_budget(settings.JOBS_MAX_WORKERS))
+
+    import django
+
+    django.setup()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.JOBS_MAX_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process,
+            initargs=(os.environ["DJANGO_SETTINGS_MODULE"],),
+        )
+    return _executor
+
+
+def run_job(job_id, task, args):
+    # Runs inside a pool process. `task` is the dotted path of a function taking
+    # the job directory and `args`, and returning (result file name, content type).
+    started_at = time.time()
+    job = update_job(job_id, status="running", started_at=started_at)
+    if job is not None:
+        observe("queue_wait_seconds", started_at - job["created_at"], queue=job["kind"])
+    try:
+        result_name, content_type = import_string(task)(job_dir(job_id), *args)
+    except Exception as e:
+        logger.exception("Job %s failed", job_id)
+        _failed(job_id, str(e))
+        return
+
+    finished_at = time.time()
+    update_job(
+        job_id,
+        status="done",
+        result=result_name,
+        content_type=content_type,
+        finished_at=finished_at,
+        expires_at=finished_at + settings.JOBS_RESULT_TTL,
+    )
+
+
+def _failed(job_id, error):
+    finished_at = time.time()
+    update_job(
+        job_id,
+        status="failed",
+        error=error,
+        finished_at=finished_at,
+        expires_at=finished_at + settings.JOBS_RESULT_TTL,
+    )
+
+
+def _job_finished(job_id, future):
+    global _executor, _pending
+    with _lock:
+        _pending -= 1
+
+    error = future.exception()
+    if error is not None:
+        # The pool process died (e.g. killed for memory), start a fresh pool
+        if isinstance(error, BrokenProcessPool):
+            with _lock:
+                _executor = None
+        _failed(job_id, str(error))
+
+
+def submit(job_id, task, *args):
+    global _executor, _pending, _last_purge
+    with _lock:
+        if _pending >= settings.JOBS_MAX_PENDING:
+            raise QueueFull
+        _pending += 1
+        executor = _get_executor()
+        purge_due = time.monotonic() - _last_purge > 60
+        if purge_due:
+            _last_purge = time.monotonic()
+
+    try:
+        future = executor.submit(run_job, job_id, task, args)
+    except BaseException as e:
+        with _lock:
+            _pending -= 1
+            if isinstance(e, BrokenProcessPool):
+                _executor = None
+        raise
+    future.add_done_callback(lambda f: _job_finished(job_id, f))
+
+    # Piggyback expiry on submissions so no separate scheduler is needed
+    if purge_due:
+        purge_expired()
@@ -0,0 +1,116 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+from django.conf import settings
+
+# Jobs live on the filesystem so every gunicorn worker (and the pool processes
+# running the work) sees the same state: JOBS_DIR/<job id>/job.json plus the
+# job's inputs and result next to it.
+JOB_FILE = "job.json"
+
+_JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def job_dir(job_id):
+    return os.path.join(settings.JOBS_DIR, job_id)
+
+
+def _write_job(job):
+    directory = job_dir(job["id"])
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    with os.fdopen(fd, "w") as f:
+        json.dump(job, f)
+    os.replace(tmp_path, os.path.join(directory, JOB_FILE))
+
+
+def create_job(kind, download_name):
+    now = time.time()
+    job = {
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        "status": "queued",
+        "download_name": download_name,
+        "created_at": now,
+        # Set once the job has finished, results are kept for JOBS_RESULT_TTL
+        "expires_at": None,
+    }
+    os.makedirs(job_dir(job["id"]))
+    _write_job(job)
+    return job
+
+
+def delete_job(job_id):
+    shutil.rmtree(job_dir(job_id), ignore_errors=True)
+
+
+def _expired(job, now):
+    # A job only expires once it has finished. One that never does, because the
+    # worker it was queued on went away, is dropped after JOBS_MAX_AGE.
+    expires_at = job.get("expires_at")
+    if expires_at is None:
+        expires_at = job.get("created_at", 0) + settings.JOBS_MAX_AGE
+    return expires_at < now
+
+
+def save_input(job, name, data):
+    # Uploaded files are written chunk by chunk, plain strings/bytes in one go
+    path = os.path.join(job_dir(job["id"]), name)
+    with open(path, "wb") as f:
+        if hasattr(data, "chunks"):
+            for chunk in data.chunks():
+                f.write(chunk)
+        else:
+            f.write(data.encode() if isinstance(data, str) else data)
+    return path
+
+
+def load_job(job_id):
+    if not _JOB_ID_RE.match(job_id):
+        return None
+    try:
+        with open(os.path.join(job_dir(job_id), JOB_FILE)) as f:
+            job = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if _expired(job, time.time()):
+        return None
+    return job
+
+
+def update_job(job_id, **fields):
+    job = load_job(job_id)
+    if job is None:
+        return None
+    job.update(fields)
+    _write_job(job)
+    return job
+
+
+def purge_expired():
+    # Remove every job whose result has expired, returns how many were removed
+    try:
+        job_ids = os.listdir(settings.JOBS_DIR)
+    except FileNotFoundError:
+        return 0
+
+    purged = 0
+    now = time.time()
+    for job_id in job_ids:
+        path = os.path.join(settings.JOBS_DIR, job_id, JOB_FILE)
+        try:
+            with open(path) as f:
+                expired = _expired(json.load(f), now)
+        except FileNotFoundError:
+            # A job directory that is still being created, or a stray file
+            continue
+        except (ValueError, AttributeError):
+            expired = True
+        if expired:
+            delete_job(job_id)
+            purged += 1
+    return purged
@@ -0,0 +1,130 @@
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from .pool import QueueFull, run_job
+from .store import (
+    JOB_FILE,
+    create_job,
+    job_dir,
+    load_job,
+    purge_expired,
+    save_input,
+    update_job,
+)
+from .views import enqueue_job
+
+
+def write_result(directory, text):
+    with open(os.path.join(directory, "result.txt"), "w") as f:
+        f.write(text)
+    return "result.txt", "text/plain"
+
+
+def fail(directory):
+    raise ValueError("Nothing to do")
+
+
+class JobsTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(
+            JOBS_DIR=directory.name,
+            JOBS_RESULT_TTL=60,
+            JOBS_MAX_AGE=3600,
+            METRICS_DIR=None,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+
+class StoreTests(JobsTestCase):
+    def test_create_and_update(self):
+        job = create_job("removebg", "image.png")
+        self.assertEqual(load_job(job["id"]), job)
+        self.assertEqual(job["status"], "queued")
+        self.assertIsNone(job["expires_at"])
+
+        update_job(job["id"], status="running")
+        self.assertEqual(load_job(job["id"])["status"], "running")
+
+    def test_save_input(self):
+        job = create_job("html-pdf", "document.pdf")
+        path = save_input(job, "input.html", "<p>Hi</p>")
+        with open(path) as f:
+            self.assertEqual(f.read(), "<p>Hi</p>")
+
+    def test_unknown_and_malformed_ids(self):
+        self.assertIsNone(load_job("0" * 32))
+        self.assertIsNone(load_job("../settings"))
+        self.assertIsNone(update_job("0" * 32, status="done"))
+
+    def test_expired_jobs_are_gone(self):
+        job = create_job("removebg", "image.png")
+        kept = create_job("removebg", "image.png")
+        update_job(job["id"], expires_at=time.time() - 1)
+
+        self.assertIsNone(load_job(job["id"]))
+        self.assertEqual(purge_expired(), 1)
+        self.assertFalse(os.path.exists(job_dir(job["id"])))
+        self.assertIsNotNone(load_job(kept["id"]))
+
+    def test_unfinished_jobs_are_kept_until_the_max_age(self):
+        job = create_job("removebg", "image.png")
+        stale = create_job("removebg", "image.png")
+        update_job(stale["id"], created_at=time.time() - 3601)
+
+        self.assertEqual(purge_expired(), 1)
+        self.assertIsNone(load_job(stale["id"]))
+        self.assertIsNotNone(load_job(job["id"]))
+
+    def test_unreadable_job_file_is_purged(self):
+        job = create_job("removebg", "image.png")
+        with open(os.path.join(job_dir(job["id"]), JOB_FILE), "w") as f:
+            json.dump([], f)
+        self.assertEqual(purge_expired(), 1)
+
+
+class RunJobTests(JobsTestCase):
+    def test_done(self):
+        job = create_job("test", "result.txt")
+        # Queued for longer than the result is kept
+        update_job(job["id"], created_at=time.time() - 120)
+        run_job(job["id"], "jobs.tests.write_result", ("done",))
+
+        job = load_job(job["id"])
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["result"], "result.txt")
+        self.assertEqual(job["content_type"], "text/plain")
+        self.assertEqual(job["expires_at"], job["finished_at"] + 60)
+        with open(os.path.join(job_dir(job["id"]), job["result"])) as f:
+            self.assertEqual(f.read(), "done")
+
+    def test_failed(self):
+        job = create_job("test", "result.txt")
+        with self.assertLogs("jobs.pool", "ERROR"):
+            run_job(job["id"], "jobs.tests.fail", ())
+
+        job = load_job(job["id"])
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(job["error"], "Nothing to do")
+        self.assertEqual(job["expires_at"], job["finished_at"] + 60)
+
+
+class EnqueueJobTests(JobsTestCase):
+    @mock.patch("jobs.views.submit", side_effect=QueueFull)
+    def test_queue_full_leaves_nothing_behind(self, submit):
+        request = RequestFactory().post("/removebg/jobs/")
+
+        response = enqueue_job(
+            request, "test", "jobs.tests.write_result", [("input.txt", b"text")]
+        )
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(os.listdir(self.directory), [])
@@ -0,0 +1,8 @@
+from django.urls import path
+
+from .views import JobResultView, JobStatusView
+
+urlpatterns = [
+    path("jobs/<str:job_id>/", JobStatusView.as_view(), name="job-status"),
+    path("jobs/<str:job_id>/result/", JobResultView.as_view(), name="job-result"),
+]
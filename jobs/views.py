@@ -0,0 +1,87 @@
+import os
+
+from django.http import FileResponse
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from RemoveImageBG.executors import OffloadViewMixin
+
+from .pool import QueueFull, submit
+from .store import create_job, delete_job, job_dir, load_job, save_input
+
+
+def _job_payload(request, job):
+    payload = {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "expires_at": job["expires_at"],
+        "status_url": request.build_absolute_uri(
+            reverse("job-status", args=[job["id"]])
+        ),
+    }
+    if job["status"] == "done":
+        payload["result_url"] = request.build_absolute_uri(
+            reverse("job-result", args=[job["id"]])
+        )
+    if job["status"] == "failed":
+        payload["error"] = job.get("error")
+    return payload
+
+
+def enqueue_job(request, kind, task, inputs, args=(), download_name="result"):
+    # Store the inputs with a new job and hand it to the worker pool. `inputs` is a
+    # list of (file name, uploaded file or bytes) saved into the job directory.
+    job = create_job(kind, download_name)
+    for name, data in inputs:
+        save_input(job, name, data)
+
+    try:
+        submit(job["id"], task, *args)
+    except QueueFull:
+        # Nothing will ever pick the job up, its inputs can go straight away
+        delete_job(job["id"])
+        return Response(
+            {"error": "Too many jobs are waiting, try again later"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+
+    return Response(_job_payload(request, job), status=status.HTTP_202_ACCEPTED)
+
+
+class JobStatusView(OffloadViewMixin, APIView):
+    def get(self, request, job_id, *args, **kwargs):
+        job = load_job(job_id)
+
+        if job is None:
+            return Response(
+                {"error": "Job not found or expired"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        return Response(_job_payload(request, job), status=status.HTTP_200_OK)
+
+
+class JobResultView(OffloadViewMixin, APIView):
+    def get(self, request, job_id, *args, **kwargs):
+        job = load_job(job_id)
+
+        if job is None:
+            return Response(
+                {"error": "Job not found or expired"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        if job["status"] != "done":
+            return Response(
+                {"error": f"Job is {job['status']}"}, status=status.HTTP_409_CONFLICT
+            )
+
+        result_file = open(os.path.join(job_dir(job_id), job["result"]), "rb")
+        return FileResponse(
+            result_file,
+            as_attachment=True,
+            filename=job["download_name"],
+            content_type=job["content_type"],
+        )
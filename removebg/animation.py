@@ -0,0 +1,212 @@
+import itertools
+import os
+
+from PIL import Image, ImageChops, ImageSequence, ImageStat
+
+from RemoveImageBG.metrics import count, stage
+
+from .batch import predict_masks
+from .pipeline import ImageTooLarge, compose_output, downscale, open_header
+
+# Optional: PyAV decodes short video clips (MP4, MOV, WebM) a frame at a time.
+# Animated GIF, WebP and APNG uploads only need Pillow.
+try:
+    import av
+except ImportError:
+    av = None
+
+VIDEO_EXTENSIONS = (".mp4", ".m4v", ".mov", ".webm", ".mkv")
+
+# Frames are compared as small grayscale thumbnails, cheap enough to do for every
+# frame and blind to sensor noise and compression artefacts
+THUMBNAIL_SIZE = (64, 64)
+
+# Frame duration for formats that don't store one
+DEFAULT_DURATION = 100  # ms
+
+
+class ImageAnimation:
+    # A multi-frame image. Pillow decodes one frame at a time as it seeks.
+    def __init__(self, img):
+        self.img = img
+        self.frame_count = img.n_frames
+        self.size = img.size
+        # A GIF without a loop count plays once
+        self.loop = img.info.get("loop", 1)
+
+    def __iter__(self):
+        for frame in ImageSequence.Iterator(self.img):
+            yield frame.convert("RGB"), frame.info.get("duration") or DEFAULT_DURATION
+
+
+class VideoAnimation:
+    # The first video stream of a clip, decoded a frame at a time with PyAV
+    loop = 0
+
+    def __init__(self, uploaded_file, frame_count, size, duration):
+        self.uploaded_file = uploaded_file
+        self.frame_count = frame_count
+        self.size = size
+        self.duration = duration
+
+    def __iter__(self):
+        # Exactly `frame_count` frames, as promised in the APNG header. A count
+        # worked out from the clip's duration can be off by a frame or two: extra
+        # frames are dropped and missing ones repeat the last.
+        self.uploaded_file.seek(0)
+        img = None
+        yielded = 0
+        with av.open(self.uploaded_file) as container:
+            frames = container.decode(video=0)
+            for frame in itertools.islice(frames, self.frame_count):
+                img = frame.to_image()
+                yield img, self.duration
+                yielded += 1
+        if img is None:
+            raise ValueError("The video has no frames")
+        for _ in range(self.frame_count - yielded):
+            yield img, self.duration
+
+
+def _check_limits(size, frame_count, max_pixels, max_frames):
+    # Frames are processed one after the other, so the limit is per frame
+    width, height = size
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(
+            f"The frames are {width}x{height} pixels, at most "
+            f"{max_pixels / 1e6:g} megapixels are accepted"
+        )
+    if max_frames and frame_count > max_frames:
+        raise ImageTooLarge(
+            f"The animation has {frame_count} frames, at most {max_frames} are "
+            "accepted"
+        )
+
+
+def _frame_count(container, stream, rate, max_frames):
+    # The frame count the container declares, or else its duration times the frame
+    # rate. Only a clip that has neither is decoded once to count its frames
+    # (without converting them), giving up once over the limit.
+    if stream.frames:
+        return stream.frames
+    seconds = None
+    if stream.duration is not None and stream.time_base:
+        seconds = float(stream.duration * stream.time_base)
+    elif container.duration is not None:
+        seconds = container.duration / av.time_base
+    if seconds and rate:
+        return max(1, round(seconds * float(rate)))
+
+    frame_count = 0
+    for _ in container.decode(stream):
+        frame_count += 1
+        if max_frames and frame_count > max_frames:
+            break
+    return frame_count
+
+
+def _open_video(uploaded_file, max_pixels, max_frames):
+    if av is None:
+        raise ValueError("Video uploads need PyAV installed on the server")
+    try:
+        with av.open(uploaded_file) as container:
+            stream = container.streams.video[0]
+            size = (stream.codec_context.width, stream.codec_context.height)
+            rate = stream.average_rate or stream.guessed_rate
+            # The APNG header needs the frame count up front
+            frame_count = _frame_count(container, stream, rate, max_frames)
+    except (av.FFmpegError, IndexError):
+        raise ValueError(f"{uploaded_file.name} is not a valid video")
+
+    _check_limits(size, frame_count, max_pixels, max_frames)
+    duration = round(1000 / float(rate)) if rate else DEFAULT_DURATION
+    return VideoAnimation(uploaded_file, frame_count, size, duration)
+
+
+def open_animation(uploaded_file, max_pixels=None, max_frames=None):
+    # An animated upload (GIF, WebP, APNG or a video clip), None for a still image.
+    # Only headers are read here, frames are decoded as they are iterated.
+    extension = os.path.splitext(uploaded_file.name or "")[1].lower()
+    content_type = getattr(uploaded_file, "content_type", None) or ""
+    if extension in VIDEO_EXTENSIONS or content_type.startswith("video/"):
+        return _open_video(uploaded_file, max_pixels, max_frames)
+
+    img = open_header(uploaded_file)
+    if getattr(img, "n_frames", 1) < 2:
+        uploaded_file.seek(0)
+        return None
+    _check_limits(img.size, img.n_frames, max_pixels, max_frames)
+    return ImageAnimation(img)
+
+
+def _thumbnail(img):
+    return img.convert("L").resize(THUMBNAIL_SIZE, Image.Resampling.BILINEAR)
+
+
+def frame_difference(a, b):
+    # Mean absolute difference of two thumbnails, 0 (identical) to 255
+    return ImageStat.Stat(ImageChops.difference(a, b)).mean[0]
+
+
+class AnimationCutout:
+    # Removes the background of every frame of an animation, as a stream. The model
+    # only runs on keyframes: a frame that barely differs from the last keyframe
+    # (at most `threshold` apart) gets that keyframe's mask, for at most
+    # `max_reuse` frames in a row. Keyframes go through the model in batches, so
+    # at most `batch_size` frames are held at any time, whatever the clip length.
+    def __init__(self, session, options, batch_size, threshold, max_reuse):
+        self.session = session
+        self.options = options
+        self.batch_size = batch_size
+        self.threshold = threshold
+        self.max_reuse = max_reuse
+        self.inferred = 0
+        self.reused = 0
+
+    def _flush(self, window, mask):
+        keyframes = [img for _, img, _, is_key in window if is_key]
+        if keyframes:
+            with stage("inference"):
+                masks = iter(predict_masks(self.session, keyframes))
+        for original, img, duration, is_key in window:
+            if is_key:
+                mask = next(masks)
+            yield compose_output(original, img, mask, self.options), duration
+        window.clear()
+        # Frames after this window may still reuse the last keyframe's mask
+        self.last_mask = mask
+
+    def frames(self, animation):
+        # (output image, duration in ms) for every frame of `animation`
+        fullres = self.options["output"] == "fullres"
+        window = []
+        self.last_mask = None
+        key_thumbnail = None
+        reused = 0
+        for frame, duration in animation:
+            with stage("resize"):
+                img = downscale(frame)
+                thumbnail = _thumbnail(img)
+
+            is_key = (
+                key_thumbnail is None
+                or reused >= self.max_reuse
+                or frame_difference(thumbnail, key_thumbnail) > self.threshold
+            )
+            if is_key:
+                key_thumbnail, reused = thumbnail, 0
+                self.inferred += 1
+            else:
+                reused += 1
+                self.reused += 1
+            count(
+                "removebg_animation_frames_total",
+                inference="run" if is_key else "reused",
+            )
+
+            # The original is only kept when the output is at its size
+            window.append((frame if fullres else img, img, duration, is_key))
+            if len(window) >= self.batch_size:
+                yield from self._flush(window, self.last_mask)
+        if window:
+            yield from self._flush(window, self.last_mask)
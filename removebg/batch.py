@@ -0,0 +1,51 @@
+import numpy as np
+from PIL import Image
+
+# Normalization used by the U2Net family (and IS-Net) sessions in rembg, keyed by
+# model name: (mean, std, input size). These models end with the same single-channel
+# saliency head, so their inputs can be stacked into one forward pass.
+BATCHABLE_MODELS = {
+    "u2net": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2netp": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2net_human_seg": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "silueta": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "isnet-general-use": ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024)),
+}
+
+
+def supports_batching(session):
+    # Exported models with a fixed batch dimension of 1 can't take a stacked input
+    batch_dim = session.inner_session.get_inputs()[0].shape[0]
+    return session.model_name in BATCHABLE_MODELS and not isinstance(batch_dim, int)
+
+
+def _to_mask(pred, size):
+    # Same min-max scaling and resize rembg applies to a single prediction
+    ma = np.max(pred)
+    mi = np.min(pred)
+    pred = (pred - mi) / (ma - mi)
+
+    mask = Image.fromarray((pred.clip(0, 1) * 255).astype("uint8"), mode="L")
+    return mask.resize(size, Image.Resampling.LANCZOS)
+
+
+def predict_masks(session, images):
+    # A cascade (removebg.cascade) batches each of its models itself
+    if hasattr(session, "predict_masks"):
+        return session.predict_masks(images)
+
+    # Fall back to one forward pass per image when the model can't be batched
+    if len(images) == 1 or not supports_batching(session):
+        return [session.predict(img)[0] for img in images]
+
+    mean, std, size = BATCHABLE_MODELS[session.model_name]
+    input_name = session.inner_session.get_inputs()[0].name
+
+    # Reuse the session's own preprocessing and stack the tensors along the batch axis
+    batch = np.concatenate(
+        [session.normalize(img, mean, std, size)[input_name] for img in images]
+    )
+    ort_outs = session.inner_session.run(None, {input_name: batch})
+
+    preds = ort_outs[0][:, 0, :, :]
+    return [_to_mask(pred, img.size) for pred, img in zip(preds, images)]
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+
+from django.conf import settings
+
+from RemoveImageBG.cache import (
+    DiskLRUCache,
+    MemoryLRUCache,
+    SharedCounters,
+    TieredCache,
+)
+from RemoveImageBG.metrics import stage
+
+from .cascade import CASCADE_MODEL
+from .pipeline import PIPELINE_PARAMS, enhance_params, open_upload, render_cutout
+
+# Cut-outs keyed by the uploaded bytes, so a re-upload of the same photo is served
+# without running the model again. The disk tier is shared by all gunicorn workers.
+result_cache = TieredCache(
+    MemoryLRUCache(settings.REMOVEBG_CACHE_MEMORY_BYTES),
+    DiskLRUCache(
+        os.path.join(settings.REMOVEBG_CACHE_DIR, "results"),
+        settings.REMOVEBG_CACHE_DISK_BYTES,
+    ),
+    SharedCounters(os.path.join(settings.REMOVEBG_CACHE_DIR, "stats")),
+)
+
+
+def upload_hash(uploaded_file):
+    # Hash the upload in chunks
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def result_key(upload_digest, model_name, params):
+    # The upload's hash, then the model and post-processing parameters so a
+    # change to either never serves a stale result
+    digest = hashlib.sha256(upload_digest.encode())
+    digest.update(model_name.encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def cached_result(upload_digest, model_name, params, cache=result_cache):
+    # The cached result and the model that produced it, or (None, None). For a
+    # cascade the entry names the model it settled on, whose result is cached
+    # under that model.
+    if model_name == CASCADE_MODEL:
+        choice = cache.get(result_key(upload_digest, model_name, params))
+        if choice is None:
+            return None, None
+        model_name = choice.decode()
+    img_bytes = cache.get(result_key(upload_digest, model_name, params))
+    if img_bytes is None:
+        return None, None
+    return img_bytes, model_name
+
+
+def store_result(upload_digest, session, params, img_bytes):
+    # Cache a result rendered with `session`, returns the model that produced it
+    model_name = session.model_name
+    if model_name == CASCADE_MODEL:
+        model_name = session.tiers[-1]
+    result_cache.set(result_key(upload_digest, model_name, params), img_bytes)
+    if session.model_name == CASCADE_MODEL:
+        result_cache.set(
+            result_key(upload_digest, CASCADE_MODEL, params), model_name.encode()
+        )
+    return model_name
+
+
+def cutout_params(options):
+    # The result cache key parameters for the given cutout_options(): the enhance
+    # preset's settings rather than its name, and none at all for a mask
+    return {
+        **PIPELINE_PARAMS,
+        **options,
+        "enhance": (
+            enhance_params(options["enhance"]) if options["output"] != "mask" else None
+        ),
+    }
+
+
+def cached_cutout(session, uploaded_file, options):
+    # Serve repeat uploads of the same photo straight from the result cache.
+    # Returns the result and the model that produced it.
+    upload_digest = upload_hash(uploaded_file)
+    params = cutout_params(options)
+    img_bytes, model_name = cached_result(upload_digest, session.model_name, params)
+
+    if img_bytes is None:
+        # Decode the upload once and hand the pixels straight to the model
+        with stage("decode"):
+            img = open_upload(uploaded_file, options, settings.REMOVEBG_MAX_PIXELS)
+        img_bytes = render_cutout(session, img, options)
+        model_name = store_result(upload_digest, session, params, img_bytes)
+
+    return img_bytes, model_name
@@ -0,0 +1,69 @@
+from django.conf import settings
+
+from RemoveImageBG.metrics import count
+
+from .batch import predict_masks
+
+# ?model=cascade: the small, fast model segments most product shots just as well as
+# the full one, so it runs first and an image only goes through the full model
+# when the fast model's mask is unsure of too many pixels
+CASCADE_MODEL = "cascade"
+
+# Alpha values that are neither clearly background nor clearly subject
+AMBIGUOUS_ALPHA = (32, 223)
+
+
+def uncertainty(mask):
+    # Fraction of the mask's pixels with an ambiguous alpha. A mask with no subject
+    # at all means the model found nothing, which counts as fully uncertain.
+    histogram = mask.histogram()
+    low, high = AMBIGUOUS_ALPHA
+    if not any(histogram[high + 1 :]):
+        return 1.0
+    return sum(histogram[low : high + 1]) / (mask.width * mask.height)
+
+
+class CascadeSession:
+    # Stands in for a rembg session for one request. `tiers` lists the model that
+    # produced each mask predicted so far, in order.
+    model_name = CASCADE_MODEL
+
+    def __init__(self, registry, fast_model, full_model, threshold):
+        self.registry = registry
+        self.fast_model = fast_model
+        self.full_model = full_model
+        self.threshold = threshold
+        self.tiers = []
+
+    def predict(self, img):
+        return self.predict_masks([img])
+
+    def predict_masks(self, images):
+        # The fast model on every image, then the full model, batched, on the
+        # ones it was unsure about
+        masks = predict_masks(self.registry.get(self.fast_model), images)
+        tiers = [self.fast_model] * len(images)
+        unsure = [
+            index
+            for index, mask in enumerate(masks)
+            if uncertainty(mask) > self.threshold
+        ]
+        if unsure:
+            full_masks = predict_masks(
+                self.registry.get(self.full_model), [images[index] for index in unsure]
+            )
+            for index, mask in zip(unsure, full_masks):
+                masks[index] = mask
+                tiers[index] = self.full_model
+
+        for tier in tiers:
+            count("removebg_cascade_total", model=tier)
+        self.tiers.extend(tiers)
+        return masks
+
+
+def cascade_session(registry):
+    fast_model, full_model = settings.REMOVEBG_CASCADE_MODELS
+    return CascadeSession(
+        registry, fast_model, full_model, settings.REMOVEBG_CASCADE_THRESHOLD
+    )
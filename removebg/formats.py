@@ -0,0 +1,262 @@
+import io
+import os
+import struct
+import time
+import zlib
+
+from django.conf import settings
+from PIL import features
+
+from RemoveImageBG.cache import SharedCounters
+
+# Encodings a result can be returned in, picked with ?format= or the Accept header.
+# "png-fast" trades size for speed: the lowest zlib level with run-length encoding.
+OUTPUT_FORMATS = {
+    "png": {
+        "format": "PNG",
+        "content_type": "image/png",
+        "extension": "png",
+        "options": {},
+    },
+    "png-fast": {
+        "format": "PNG",
+        "content_type": "image/png",
+        "extension": "png",
+        "options": {"compress_level": 1, "compress_type": zlib.Z_RLE},
+    },
+    "webp": {
+        "format": "WEBP",
+        "content_type": "image/webp",
+        "extension": "webp",
+        "options": {"quality": 90, "method": 4},
+    },
+    "webp-lossless": {
+        "format": "WEBP",
+        "content_type": "image/webp",
+        "extension": "webp",
+        "options": {"lossless": True, "quality": 25, "method": 2},
+    },
+    "avif": {
+        "format": "AVIF",
+        "content_type": "image/avif",
+        "extension": "avif",
+        "options": {"quality": 70, "speed": 8},
+    },
+}
+
+# Formats an animated result can be returned in: PNG ones as APNG, streamed a frame
+# at a time, WebP ones as animated WebP
+ANIMATED_FORMATS = ("png", "png-fast", "webp", "webp-lossless")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Accept header media types, in the order they are preferred on equal quality
+ACCEPT_FORMATS = {"image/avif": "avif", "image/webp": "webp", "image/png": "png"}
+
+_encode_counters = None
+
+
+def available_formats():
+    # AVIF needs a Pillow built with libavif
+    return [
+        name
+        for name, spec in OUTPUT_FORMATS.items()
+        if spec["format"] != "AVIF" or features.check("avif")
+    ]
+
+
+def output_format(name):
+    if name not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Unknown format '{name}', choose one of: {', '.join(available_formats())}"
+        )
+    if name not in available_formats():
+        raise ValueError(f"The {name} format is not available on this server")
+    return name
+
+
+def negotiate_format(accept):
+    # The available format the Accept header rates highest, None when it only
+    # has wildcards or nothing we produce
+    best, best_quality = None, 0.0
+    for entry in (accept or "").split(","):
+        media_type, *params = (part.strip() for part in entry.split(";"))
+        name = ACCEPT_FORMATS.get(media_type.lower())
+        if name is None or name not in available_formats():
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+def encode_counters():
+    global _encode_counters
+    if _encode_counters is None:
+        _encode_counters = SharedCounters(
+            os.path.join(settings.REMOVEBG_CACHE_DIR, "encode_stats")
+        )
+    return _encode_counters
+
+
+def encode(img_result, name="png", compress_level=None):
+    # Encode a result and record how long it took and how big it came out, per
+    # format and summed over all gunicorn workers
+    spec = OUTPUT_FORMATS[name]
+    options = dict(spec["options"])
+    if compress_level is not None and spec["format"] == "PNG":
+        options["compress_level"] = compress_level
+
+    start = time.perf_counter()
+    img_io = io.BytesIO()
+    img_result.save(img_io, format=spec["format"], **options)
+    data = img_io.getvalue()
+    milliseconds = (time.perf_counter() - start) * 1000
+
+    counters = encode_counters()
+    counters.incr(f"{name}.count")
+    counters.incr(f"{name}.ms", milliseconds)
+    counters.incr(f"{name}.bytes", len(data))
+    return data
+
+
+def animated_format(name):
+    # The format an animation goes out in when `name` was asked for, AVIF has no
+    # animation support in Pillow so it falls back to APNG
+    return name if name in ANIMATED_FORMATS else "png"
+
+
+def _png_chunks(data):
+    position = len(PNG_SIGNATURE)
+    while position < len(data):
+        (length,) = struct.unpack(">I", data[position : position + 4])
+        start = position + 8
+        yield data[position + 4 : start], data[start : start + length]
+        position = start + length + 4  # past the CRC
+
+
+def _png_chunk(kind, payload):
+    return (
+        struct.pack(">I", len(payload))
+        + kind
+        + payload
+        + struct.pack(">I", zlib.crc32(kind + payload))
+    )
+
+
+def stream_apng(frames, frame_count, name="png", compress_level=None, loop=0):
+    # Yield an APNG chunk by chunk from (image, duration in ms) pairs of the same
+    # size and mode, so only one frame is ever held. Each frame is encoded as a
+    # PNG whose image data is moved into the animation.
+    sequence = 0
+    for index, (frame, duration) in enumerate(frames):
+        chunks = list(_png_chunks(encode(frame, name, compress_level)))
+        data = b""
+        if index == 0:
+            ihdr = next(payload for kind, payload in chunks if kind == b"IHDR")
+            data += PNG_SIGNATURE + _png_chunk(b"IHDR", ihdr)
+            data += _png_chunk(b"acTL", struct.pack(">II", frame_count, loop))
+
+        # Every frame covers the whole canvas and replaces it, alpha included
+        data += _png_chunk(
+            b"fcTL",
+            struct.pack(
+                ">IIIIIHHBB",
+                sequence,
+                frame.width,
+                frame.height,
+                0,
+                0,
+                min(round(duration), 0xFFFF),
+                1000,
+                0,
+                0,
+            ),
+        )
+        sequence += 1
+        for kind, payload in chunks:
+            if kind != b"IDAT":
+                continue
+            if index == 0:
+                data += _png_chunk(b"IDAT", payload)
+            else:
+                data += _png_chunk(b"fdAT", struct.pack(">I", sequence) + payload)
+                sequence += 1
+        yield data
+    yield _png_chunk(b"IEND", b"")
+
+
+def _riff_chunks(data):
+    position = 12
+    while position < len(data):
+        (size,) = struct.unpack("<I", data[position + 4 : position + 8])
+        yield data[position : position + 4], data[position + 8 : position + 8 + size]
+        position += 8 + size + (size & 1)
+
+
+def _riff_chunk(kind, payload):
+    return kind + struct.pack("<I", len(payload)) + payload + b"\0" * (len(payload) & 1)
+
+
+def animated_webp(frames, output, name="webp", loop=0):
+    # Write an animated WebP of (image, duration in ms) pairs of the same size and
+    # mode to the binary file `output`, a frame at a time. The file starts with its
+    # total size, which is filled in once every frame is written.
+    start = output.tell()
+    for index, (frame, duration) in enumerate(frames):
+        width, height = frame.size
+        if index == 0:
+            # Mask frames have no alpha channel, the VP8X header only says there
+            # is alpha when the frames have one
+            vp8x_flags = 0x02 | (0x10 if "A" in frame.getbands() else 0)
+            output.write(b"RIFF" + bytes(4) + b"WEBP")
+            output.write(
+                _riff_chunk(
+                    b"VP8X",
+                    bytes([vp8x_flags, 0, 0, 0])
+                    + (width - 1).to_bytes(3, "little")
+                    + (height - 1).to_bytes(3, "little"),
+                )
+            )
+            output.write(_riff_chunk(b"ANIM", bytes(4) + loop.to_bytes(2, "little")))
+
+        # The bitstream of each frame encoded as a still WebP, minus its header
+        bitstream = b"".join(
+            _riff_chunk(kind, payload)
+            for kind, payload in _riff_chunks(encode(frame, name))
+            if kind in (b"ALPH", b"VP8 ", b"VP8L")
+        )
+        header = (
+            bytes(6)  # offset 0, 0
+            + (width - 1).to_bytes(3, "little")
+            + (height - 1).to_bytes(3, "little")
+            + min(round(duration), 0xFFFFFF).to_bytes(3, "little")
+            + b"\x02"  # replace the canvas rather than blend into it
+        )
+        output.write(_riff_chunk(b"ANMF", header + bitstream))
+
+    end = output.tell()
+    output.seek(start + 4)
+    output.write(struct.pack("<I", end - start - 8))
+    output.seek(end)
+
+
+def encode_stats():
+    totals = encode_counters().totals()
+    stats = {}
+    for name in OUTPUT_FORMATS:
+        count = totals.get(f"{name}.count", 0)
+        if count:
+            stats[name] = {
+                "count": count,
+                "avg_ms": round(totals[f"{name}.ms"] / count, 2),
+                "avg_bytes": round(totals[f"{name}.bytes"] / count),
+            }
+    return stats
@@ -0,0 +1,118 @@
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from PIL import UnidentifiedImageError
+
+from removebg.cache import (
+    cached_result,
+    cutout_params,
+    result_cache,
+    store_result,
+    upload_hash,
+)
+from removebg.formats import available_formats
+from removebg.pipeline import (
+    ENHANCE_PRESETS,
+    OUTPUT_MODES,
+    ImageTooLarge,
+    cutout_options,
+    open_upload,
+    render_cutout,
+)
+from removebg.sessions import UnknownModelError, sessions
+
+
+class Command(BaseCommand):
+    help = "Inspect, purge or warm the background removal result cache"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest="action", required=True)
+        subparsers.add_parser("stats", help="Print hit/miss/eviction counters")
+        subparsers.add_parser(
+            "purge", help="Delete every cached result and reset the counters"
+        )
+        warm = subparsers.add_parser(
+            "warm", help="Run the given images (or directories) through the model"
+        )
+        warm.add_argument("paths", nargs="+")
+        warm.add_argument("--model", default=settings.REMOVEBG_DEFAULT_MODEL)
+        warm.add_argument(
+            "--enhance",
+            default=settings.REMOVEBG_DEFAULT_ENHANCE,
+            choices=list(ENHANCE_PRESETS),
+        )
+        warm.add_argument(
+            "--output", default=settings.REMOVEBG_DEFAULT_OUTPUT, choices=OUTPUT_MODES
+        )
+        warm.add_argument(
+            "--format",
+            default=settings.REMOVEBG_DEFAULT_FORMAT,
+            choices=available_formats(),
+        )
+        warm.add_argument("--compress-level", type=int, choices=range(10))
+
+    def handle(self, *args, **options):
+        if options["action"] == "stats":
+            for name, value in result_cache.stats().items():
+                self.stdout.write(f"{name}: {value}")
+
+        elif options["action"] == "purge":
+            result_cache.clear()
+            self.stdout.write(self.style.SUCCESS("Result cache purged"))
+
+        elif options["action"] == "warm":
+            self.warm(
+                options["paths"],
+                options["model"],
+                cutout_options(
+                    options["enhance"],
+                    options["output"],
+                    options["format"],
+                    options["compress_level"],
+                ),
+            )
+
+    def warm(self, paths, model_name, cutout):
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files.extend(
+                    os.path.join(path, name) for name in sorted(os.listdir(path))
+                )
+            elif os.path.isfile(path):
+                files.append(path)
+            else:
+                raise CommandError(f"{path} does not exist")
+
+        try:
+            session = sessions.get(model_name)
+        except UnknownModelError as e:
+            raise CommandError(str(e))
+
+        warmed = 0
+        for path in files:
+            with open(path, "rb") as f:
+                image_file = File(f)
+                upload_digest = upload_hash(image_file)
+                params = cutout_params(cutout)
+                cached, _ = cached_result(
+                    upload_digest, session.model_name, params, result_cache.disk
+                )
+                if cached is not None:
+                    continue
+                try:
+                    img = open_upload(image_file, cutout, settings.REMOVEBG_MAX_PIXELS)
+                except UnidentifiedImageError:
+                    self.stderr.write(f"Skipping {path}: not an image")
+                    continue
+                except ImageTooLarge as e:
+                    self.stderr.write(f"Skipping {path}: {e}")
+                    continue
+                store_result(
+                    upload_digest, session, params, render_cutout(session, img, cutout)
+                )
+                warmed += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Warmed {warmed} image(s)"))
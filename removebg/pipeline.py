@@ -0,0 +1,284 @@
+import io
+
+from PIL import Image, ImageFilter, ImageOps, ImageStat, UnidentifiedImageError
+from rembg.bg import naive_cutout
+
+from RemoveImageBG.metrics import stage
+
+from .formats import encode, output_format
+
+# Largest side, in pixels, of the image handed to the model
+MAX_DIMENSION = 1500
+
+# Peak memory per pixel of an upload while it's processed (the decoded image, its
+# RGBA cut-out and the copies made while resizing), for admission control
+BYTES_PER_PIXEL = 12
+
+# Pixels per byte of upload assumed by admission control for uploads whose header
+# Pillow can't read (video clips): a photo compresses to well under a byte per
+# pixel as a JPEG
+PIXELS_PER_UPLOAD_BYTE = 4
+
+# Post-processing applied to the cut-out, chosen per request with ?enhance=.
+# "default" is the light sharpening and colour boost every result used to get.
+ENHANCE_PRESETS = {
+    "default": {
+        "unsharp_mask": (1, 125, 3),  # radius, percent, threshold
+        "contrast": 1.2,
+        "brightness": 1.05,
+        "color": 1.1,
+    },
+    "subtle": {
+        "unsharp_mask": (1, 60, 3),
+        "contrast": 1.08,
+        "brightness": 1.02,
+        "color": 1.05,
+    },
+    "none": None,
+}
+
+# What a request gets back, chosen with ?output=:
+#   cutout   the RGBA cut-out at the size the model worked on (at most MAX_DIMENSION)
+#   mask     only the 8-bit alpha matte at that size, a single-channel PNG
+#   fullres  the mask upsampled and applied to the upload at its original size
+OUTPUT_MODES = ("cutout", "mask", "fullres")
+
+# ITU-R 601-2 luma weights, as used by Image.convert("L")
+LUMA = (0.299, 0.587, 0.114)
+
+# Everything besides the model and the enhance preset that shapes the output. Part
+# of the result cache key, so changing any of these invalidates cached cut-outs.
+PIPELINE_PARAMS = {
+    "max_dimension": MAX_DIMENSION,
+    # Bumped whenever the same upload comes out differently. 2: the fused enhance
+    # colour matrix, EXIF orientation and JPEG draft decoding.
+    "version": 2,
+}
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def enhance_params(preset):
+    if preset not in ENHANCE_PRESETS:
+        raise ValueError(
+            f"Unknown enhance preset '{preset}', choose one of: {', '.join(ENHANCE_PRESETS)}"
+        )
+    return ENHANCE_PRESETS[preset]
+
+
+def output_mode(output):
+    if output not in OUTPUT_MODES:
+        raise ValueError(
+            f"Unknown output '{output}', choose one of: {', '.join(OUTPUT_MODES)}"
+        )
+    return output
+
+
+def cutout_options(enhance="default", output="cutout", fmt="png", compress_level=None):
+    # Validated per-request options, as passed to render_cutout and the job pool
+    enhance_params(enhance)
+    output_mode(output)
+    output_format(fmt)
+    if compress_level in (None, ""):
+        compress_level = None
+    else:
+        try:
+            compress_level = int(compress_level)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid compress_level '{compress_level}'")
+        if not 0 <= compress_level <= 9:
+            raise ValueError("compress_level must be between 0 and 9")
+    return {
+        "enhance": enhance,
+        "output": output,
+        "format": fmt,
+        "compress_level": compress_level,
+    }
+
+
+def working_size(size):
+    # The size downscale() brings an image of the given size to
+    max_dimension = max(size)
+    if max_dimension <= MAX_DIMENSION:
+        return size
+    resize_factor = MAX_DIMENSION / max_dimension
+    return (int(size[0] * resize_factor), int(size[1] * resize_factor))
+
+
+def open_header(uploaded_image):
+    # Image.open, which only reads the header. Pillow refuses images far beyond any
+    # pixel budget itself (Image.MAX_IMAGE_PIXELS) before we get to check them.
+    try:
+        return Image.open(uploaded_image)
+    except Image.DecompressionBombError:
+        raise ImageTooLarge(
+            f"The image is over {2 * Image.MAX_IMAGE_PIXELS / 1e6:.0f} megapixels"
+        )
+
+
+def open_image(uploaded_image, max_pixels=None, draft=False):
+    # Decode the upload once, everything after this works on the decoded pixels.
+    # Image.open only reads the header, so oversized images are refused before any
+    # pixel data is decoded. With `draft`, JPEGs are decoded with DCT scaling at
+    # the smallest 1/2, 1/4 or 1/8 scale that is still at least the working size,
+    # instead of at full size only to be shrunk straight after.
+    img = open_header(uploaded_image)
+    if max_pixels and img.width * img.height > max_pixels:
+        raise ImageTooLarge(
+            f"The image is {img.width}x{img.height} pixels, at most "
+            f"{max_pixels / 1e6:g} megapixels are accepted"
+        )
+    if draft:
+        img.draft(None, working_size(img.size))
+    img.load()
+
+    # Phone photos are stored sideways with an EXIF orientation tag
+    ImageOps.exif_transpose(img, in_place=True)
+    return img
+
+
+def open_upload(uploaded_image, options, max_pixels=None):
+    # Only a full resolution result needs the upload decoded at full size
+    return open_image(uploaded_image, max_pixels, draft=options["output"] != "fullres")
+
+
+def upload_pixels(uploaded_image):
+    # Pixels the upload decodes to, from its header alone
+    try:
+        img = open_header(uploaded_image)
+        return img.width * img.height
+    except UnidentifiedImageError:
+        return uploaded_image.size * PIXELS_PER_UPLOAD_BYTE
+    except ImageTooLarge:
+        # Refused before any pixel data is decoded
+        return 0
+    finally:
+        uploaded_image.seek(0)
+
+
+def memory_estimate(uploaded_images, max_pixels=None):
+    # Memory that processing the uploads is expected to need, for admission
+    # control. Uploads over `max_pixels` are refused before they're decoded, so no
+    # image counts for more than that.
+    total = 0
+    for uploaded_image in uploaded_images:
+        pixels = upload_pixels(uploaded_image)
+        if max_pixels:
+            pixels = min(pixels, max_pixels)
+        total += uploaded_image.size + pixels * BYTES_PER_PIXEL
+    return total
+
+
+def downscale(img):
+    # Resize large images moderately for performance, but not overly aggressive to avoid blur
+    new_size = working_size(img.size)
+    if new_size != img.size:  # Resize only if larger than 1500px
+        img = img.resize(new_size, Image.Resampling.LANCZOS)
+    return img
+
+
+def predict_mask(session, img):
+    # The session takes the decoded image directly and returns the 8-bit alpha matte
+    return session.predict(img)[0]
+
+
+def cutout(img, mask):
+    return naive_cutout(img, mask)
+
+
+def upscale_mask(mask, size):
+    # Only the single-channel matte is resized, the network never sees the full
+    # resolution image
+    if mask.size == size:
+        return mask
+    return mask.resize(size, Image.Resampling.BICUBIC)
+
+
+def _color_matrix(mean, contrast, brightness, color):
+    # Contrast around the mean luma, then brightness, then saturation,
+    # folded into the single affine RGB -> RGB matrix Image.convert takes
+    scale = contrast * brightness
+    offset = (1 - contrast) * brightness * mean
+    matrix = []
+    for row in range(3):
+        for column in range(3):
+            weight = (1 - color) * LUMA[column] + (color if row == column else 0)
+            matrix.append(scale * weight)
+        matrix.append(offset)
+    return tuple(matrix)
+
+
+def enhance(img_result, preset="default"):
+    # Sharpen and colour-correct the subject of an RGBA cut-out. Only the RGB bands
+    # are touched: the alpha matte is kept exactly as the model produced it.
+    params = enhance_params(preset)
+    if params is None:
+        return img_result
+
+    alpha = img_result.getchannel("A")
+    bbox = alpha.getbbox()
+    if bbox is None:
+        # Nothing was kept, there is nothing to enhance
+        return img_result
+
+    rgb = img_result.convert("RGB")
+
+    # Light sharpening to enhance edges, only within the subject
+    radius, percent, threshold = params["unsharp_mask"]
+    subject = rgb.crop(bbox).filter(
+        ImageFilter.UnsharpMask(radius=radius, percent=percent, threshold=threshold)
+    )
+    visible = alpha.crop(bbox).point(lambda value: 255 if value else 0)
+    rgb.paste(subject, bbox, visible)
+
+    # Contrast, brightness and colour in one pass over the pixels. The contrast
+    # pivot is the mean luma of the whole image, as ImageEnhance.Contrast used.
+    mean = ImageStat.Stat(rgb.convert("L")).mean[0]
+    rgb = rgb.convert(
+        "RGB",
+        _color_matrix(mean, params["contrast"], params["brightness"], params["color"]),
+    )
+
+    rgb.putalpha(alpha)
+    return rgb
+
+
+def encode_png(img_result):
+    # Ensure we save it in a format that supports transparency like PNG
+    img_io = io.BytesIO()
+    img_result.save(img_io, format="PNG")
+    return img_io.getvalue()
+
+
+def compose_output(original, img, mask, options):
+    # Turn the mask predicted for `img` (the downscaled `original`) into the
+    # requested output image, not yet encoded
+    if options["output"] == "mask":
+        return mask
+    with stage("enhance"):
+        if options["output"] == "fullres":
+            img, mask = original, upscale_mask(mask, original.size)
+        return enhance(cutout(img, mask), options["enhance"])
+
+
+def render_output(original, img, mask, options):
+    # compose_output(), encoded in the requested format
+    img_result = compose_output(original, img, mask, options)
+
+    # Encode exactly once, for the response
+    with stage("encode"):
+        return encode(img_result, options["format"], options["compress_level"])
+
+
+def render_cutout(session, img, options=None):
+    # Full single-image pipeline on a decoded upload, returns the response PNG
+    with stage("resize"):
+        original, img = img, downscale(img)
+
+    # Remove background using the rembg model session, the mask comes back decoded
+    with stage("inference"):
+        mask = predict_mask(session, img)
+
+    return render_output(original, img, mask, options or cutout_options())
@@ -0,0 +1,164 @@
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import onnxruntime as ort
+from django.conf import settings
+from rembg import new_session
+
+from RemoveImageBG.threads import process_threads
+
+from .cascade import CASCADE_MODEL, cascade_session
+
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disabled": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+class UnknownModelError(ValueError):
+    pass
+
+
+def _rss_bytes():
+    # Resident set size of this process, 0 where /proc isn't available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def session_options(
+    intra_op_threads=None,
+    inter_op_threads=None,
+    execution_mode=None,
+    graph_optimization=None,
+    allow_spinning=None,
+):
+    # ONNX Runtime options from the ORT_* settings, each can be overridden.
+    # Without them ORT starts a spinning thread per core in every process.
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = (
+        intra_op_threads or settings.ORT_INTRA_OP_THREADS or process_threads()
+    )
+    options.inter_op_num_threads = inter_op_threads or settings.ORT_INTER_OP_THREADS
+    options.execution_mode = EXECUTION_MODES[
+        execution_mode or settings.ORT_EXECUTION_MODE
+    ]
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[
+        graph_optimization or settings.ORT_GRAPH_OPTIMIZATION
+    ]
+    if allow_spinning is None:
+        allow_spinning = settings.ORT_ALLOW_SPINNING
+    for pool in ("intra_op", "inter_op"):
+        options.add_session_config_entry(
+            f"session.{pool}.allow_spinning", "1" if allow_spinning else "0"
+        )
+    return options
+
+
+class SessionRegistry:
+    # Loads rembg sessions on first use and keeps the most recently used ones
+    # resident, evicting the least recently used when either the session count or
+    # their combined resident memory goes over the limit
+    def __init__(self, allowed_models, max_sessions, max_memory_bytes):
+        self.allowed_models = allowed_models
+        self.max_sessions = max_sessions
+        self.max_memory_bytes = max_memory_bytes
+        self._sessions = OrderedDict()
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._load_locks = defaultdict(threading.Lock)
+
+    def get(self, model_name):
+        if model_name not in self.allowed_models:
+            raise UnknownModelError(
+                f"Unknown model '{model_name}', choose one of: {', '.join(self.allowed_models)}"
+            )
+
+        # A cascade is per request, its models are loaded as it needs them
+        if model_name == CASCADE_MODEL:
+            return cascade_session(self)
+
+        session = self._lookup(model_name)
+        if session is not None:
+            return session
+
+        # Only one thread loads a given model, the others wait for it
+        with self._load_locks[model_name]:
+            session = self._lookup(model_name)
+            if session is None:
+                session = self._load(model_name)
+        return session
+
+    def _lookup(self, model_name):
+        with self._lock:
+            session = self._sessions.get(model_name)
+            if session is not None:
+                self._sessions.move_to_end(model_name)
+                self._stats[model_name]["uses"] += 1
+                self._stats[model_name]["last_used"] = time.time()
+            return session
+
+    def _load(self, model_name):
+        rss_before = _rss_bytes()
+        start = time.perf_counter()
+        session = new_session(model_name, sess_opts=session_options())
+        load_seconds = time.perf_counter() - start
+
+        with self._lock:
+            stats = self._stats.setdefault(model_name, {"loads": 0, "uses": 0})
+            stats.update(
+                loaded=True,
+                loads=stats["loads"] + 1,
+                uses=stats["uses"] + 1,
+                load_seconds=round(load_seconds, 3),
+                resident_bytes=max(_rss_bytes() - rss_before, 0),
+                last_used=time.time(),
+            )
+            self._sessions[model_name] = session
+            self._evict()
+        return session
+
+    def _evict(self):
+        # Never evict the session that was just loaded
+        evicted = False
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions
+            or self._resident_bytes() > self.max_memory_bytes
+        ):
+            model_name, _ = self._sessions.popitem(last=False)
+            self._stats[model_name]["loaded"] = False
+            evicted = True
+
+        # Requests still holding the evicted session keep it alive until they finish
+        if evicted:
+            gc.collect()
+
+    def _resident_bytes(self):
+        return sum(self._stats[name]["resident_bytes"] for name in self._sessions)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "resident_models": list(self._sessions),
+                "resident_bytes": self._resident_bytes(),
+                "models": {name: dict(stats) for name, stats in self._stats.items()},
+            }
+
+
+sessions = SessionRegistry(
+    settings.REMOVEBG_MODELS,
+    settings.REMOVEBG_MAX_RESIDENT_SESSIONS,
+    settings.REMOVEBG_SESSIONS_MEMORY_BYTES,
+)
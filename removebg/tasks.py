@@ -0,0 +1,56 @@
+import os
+import zipfile
+
+from django.conf import settings
+from django.core.files import File
+from PIL import UnidentifiedImageError
+
+from .batch import predict_masks
+from .cache import cached_cutout
+from .formats import OUTPUT_FORMATS
+from .pipeline import downscale, open_image, render_output
+from .sessions import sessions
+
+# Job pool entry points, see jobs.pool.run_job
+
+
+def remove_background(job_dir, input_name, model_name, options):
+    session = sessions.get(model_name)
+
+    with open(os.path.join(job_dir, input_name), "rb") as f:
+        img_bytes, _ = cached_cutout(session, File(f), options)
+
+    spec = OUTPUT_FORMATS[options["format"]]
+    result_name = "result." + spec["extension"]
+    with open(os.path.join(job_dir, result_name), "wb") as f:
+        f.write(img_bytes)
+
+    return result_name, spec["content_type"]
+
+
+def remove_background_batch(job_dir, entries, model_name, options):
+    # `entries` are (input file, name in the ZIP) pairs. All the images go through
+    # the model together, as with /removebg/batch/.
+    session = sessions.get(model_name)
+
+    images = []
+    for input_name, _ in entries:
+        with open(os.path.join(job_dir, input_name), "rb") as f:
+            try:
+                img = open_image(File(f), settings.REMOVEBG_MAX_PIXELS, draft=True)
+            except UnidentifiedImageError:
+                raise ValueError(f"{input_name} is not a valid image")
+        images.append(downscale(img))
+
+    masks = predict_masks(session, images)
+
+    with zipfile.ZipFile(os.path.join(job_dir, "result.zip"), "w") as archive:
+        for (input_name, name), img, mask in zip(entries, images, masks):
+            original = img
+            if options["output"] == "fullres":
+                # Decode the upload again rather than keep every original in memory
+                with open(os.path.join(job_dir, input_name), "rb") as f:
+                    original = open_image(File(f))
+            archive.writestr(name, render_output(original, img, mask, options))
+
+    return "result.zip", "application/zip"
@@ -1,3 +1,739 @@
-from django.test import TestCase
+import asyncio
+import fcntl
+import io
+import json
+import os
+import struct
+import subprocess
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import onnxruntime as ort
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from PIL import Image, ImageFilter
+from rembg import remove
+from rembg.sessions.u2net import U2netSession
+
+from benchmarks.fixtures import photo
+from benchmarks.removebg_enhance import four_pass, synthetic_cutout
+from RemoveImageBG import admission
+from RemoveImageBG.admission import AdmissionControl, Overloaded
+from RemoveImageBG.cache import (
+    FOLDED_FILE,
+    DiskLRUCache,
+    MemoryLRUCache,
+    SharedCounters,
+)
+
+from . import formats
+from .animation import VideoAnimation, _frame_count
+from .formats import (
+    PNG_SIGNATURE,
+    _png_chunks,
+    _riff_chunks,
+    animated_webp,
+    encode,
+    negotiate_format,
+    stream_apng,
+)
+from .batch import predict_masks
+from .cascade import CascadeSession, uncertainty
+from .pipeline import (
+    BYTES_PER_PIXEL,
+    PIXELS_PER_UPLOAD_BYTE,
+    cutout_options,
+    downscale,
+    enhance,
+    memory_estimate,
+    predict_mask,
+    render_cutout,
+    upscale_mask,
+)
+from .sessions import SessionRegistry, UnknownModelError
+
+# The benchmark suite's stand-in for the U2Net models: same input and output
+# layout, a fraction of the inference cost
+TINY_MODEL = os.path.join(settings.BASE_DIR, "benchmarks", "data", "tiny_u2net.onnx")
+
+
+# What require_client_secret expects
+CLIENT_HEADERS = {
+    "CLIENT-KEY": settings.WW_PLATFORM_SECRET_ENV_VAR["WWS_WW_PLATFORM_SECRET"],
+    "CLIENT-SECRET": settings.WW_PLATFORM_SECRET_VAR_KEY["WWS_WW_PLATFORM_SECRET"],
+}
+
+
+def tiny_session(model_name="u2net"):
+    # rembg's U2Net session, preprocessing and all, running the tiny model
+    session = U2netSession.__new__(U2netSession)
+    session.model_name = model_name
+    session.inner_session = ort.InferenceSession(
+        TINY_MODEL, providers=["CPUExecutionProvider"]
+    )
+    return session
+
+
+def decoded_photo(size):
+    return Image.open(io.BytesIO(photo(size))).convert("RGB")
+
+
+def max_difference(a, b):
+    return int(np.abs(np.asarray(a, np.int16) - np.asarray(b, np.int16)).max())
+
+
+class EncodingTestCase(SimpleTestCase):
+    # Encoder statistics go to a temporary directory
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(
+            REMOVEBG_CACHE_DIR=directory.name, METRICS_DIR=None
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        formats._encode_counters = None
+        self.addCleanup(setattr, formats, "_encode_counters", None)
+
+
+class PredictMasksTests(SimpleTestCase):
+    def test_batch_matches_one_image_at_a_time(self):
+        session = tiny_session()
+        images = [decoded_photo((320, 240)), decoded_photo((200, 300))]
+
+        masks = predict_masks(session, images)
+
+        self.assertEqual(len(masks), 2)
+        for mask, img in zip(masks, images):
+            self.assertEqual(mask.mode, "L")
+            self.assertEqual(mask.size, img.size)
+            self.assertLessEqual(max_difference(mask, session.predict(img)[0]), 1)
+
+    def test_model_without_batching_runs_one_image_at_a_time(self):
+        session = tiny_session("u2net_cloth_seg")
+        images = [decoded_photo((320, 240)), decoded_photo((200, 300))]
+
+        masks = predict_masks(session, images)
+
+        for mask, img in zip(masks, images):
+            self.assertEqual(max_difference(mask, session.predict(img)[0]), 0)
+
+
+@override_settings(METRICS_DIR=None)
+class AdmissionControlTests(SimpleTestCase):
+    def control(self, limit=1, queue=0, max_wait=0, memory_bytes=1000):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return AdmissionControl(
+            directory.name,
+            {"removebg": limit},
+            {"removebg": queue},
+            max_wait,
+            memory_bytes,
+        )
+
+    def test_admits_up_to_the_limit(self):
+        control = self.control(limit=2)
+        first = control.acquire("removebg", 0)
+        second = control.acquire("removebg", 0)
+        self.assertNotEqual(first, second)
+
+        with self.assertRaises(Overloaded) as refused:
+            control.acquire("removebg", 0)
+        self.assertEqual(str(refused.exception), "Too many requests are waiting")
+        self.assertGreaterEqual(refused.exception.wait, 1)
+
+    def test_released_slot_is_reused(self):
+        control = self.control()
+        control.release(control.acquire("removebg", 0))
+        control.acquire("removebg", 0)
+
+    def test_waiting_request_times_out(self):
+        control = self.control(queue=1, max_wait=0.05)
+        control.acquire("removebg", 0)
+        with self.assertRaises(Overloaded) as refused:
+            control.acquire("removebg", 0)
+        self.assertEqual(str(refused.exception), "No capacity within 0.05 seconds")
+
+        # The request that gave up no longer counts as waiting
+        _, [(_, queued)] = control.gauges()["admission_queued"]
+        self.assertEqual(queued, 0)
+
+    def test_memory_budget(self):
+        control = self.control(limit=3, memory_bytes=1000)
+        control.acquire("removebg", 600)
+        with self.assertRaises(Overloaded):
+            control.acquire("removebg", 600)
+        control.acquire("removebg", 400)
+
+    def test_request_over_the_budget_runs_alone(self):
+        control = self.control(limit=2, memory_bytes=1000)
+        ticket = control.acquire("removebg", 5000)
+        with self.assertRaises(Overloaded):
+            control.acquire("removebg", 1)
+        control.release(ticket)
+        control.acquire("removebg", 1)
+
+    def test_waiting_on_the_lock_leaves_the_event_loop_free(self):
+        control = self.control()
+        os.makedirs(control.directory, exist_ok=True)
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        async def acquire_while_locked():
+            ticker = asyncio.create_task(tick())
+            # Another worker holds the state file's lock for a while
+            with open(os.path.join(control.directory, ".lock"), "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                acquiring = asyncio.create_task(control.acquire_async("removebg", 0))
+                await asyncio.sleep(0.2)
+                self.assertFalse(acquiring.done())
+            ticket = await acquiring
+            ticker.cancel()
+            return ticket
+
+        ticket = asyncio.run(acquire_while_locked())
+
+        self.assertGreater(ticks, 5)
+        _, [(_, running)] = control.gauges()["admission_running"]
+        self.assertEqual(running, 1)
+        control.release(ticket)
+
+    def test_request_that_goes_away_gives_its_place_back(self):
+        control = self.control(queue=1, max_wait=10)
+        ticket = control.acquire("removebg", 0)
+
+        async def give_up():
+            waiting = asyncio.create_task(control.acquire_async("removebg", 0))
+            await asyncio.sleep(0.1)
+            waiting.cancel()
+            await asyncio.sleep(0.1)
+
+        asyncio.run(give_up())
+
+        _, [(_, queued)] = control.gauges()["admission_queued"]
+        self.assertEqual(queued, 0)
+        control.release(ticket)
+        control.release(control.acquire("removebg", 0))
+
+
+class AdmissionTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(
+            ADMISSION_DIR=directory.name,
+            ADMISSION_LIMITS={"removebg": 1, "office": 1},
+            ADMISSION_QUEUE={"removebg": 0, "office": 0},
+            ADMISSION_MAX_WAIT=0,
+            METRICS_DIR=None,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        admission._control = None
+        self.addCleanup(setattr, admission, "_control", None)
+
+    def post(self, **headers):
+        return self.client.post("/removebg/", {"image": b""}, headers=headers)
+
+    def test_refused_with_retry_after_when_the_pool_is_full(self):
+        ticket = admission.get_control().acquire("removebg", 0)
+        self.addCleanup(admission.get_control().release, ticket)
+
+        response = self.post(**CLIENT_HEADERS)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {"error": "Too many requests are waiting"})
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+
+    def test_authenticated_before_admission(self):
+        ticket = admission.get_control().acquire("removebg", 0)
+        self.addCleanup(admission.get_control().release, ticket)
+
+        response = self.post()
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(
+            response.json()["message"],
+            "You need to be authenticated to access this resource",
+        )
+        _, [(_, queued), _] = admission.get_control().gauges()["admission_queued"]
+        self.assertEqual(queued, 0)
+
+    def test_admitted_once_the_slot_is_released(self):
+        ticket = admission.get_control().acquire("removebg", 0)
+        admission.get_control().release(ticket)
+
+        response = self.post(**CLIENT_HEADERS)
+
+        # Past admission, the view itself refuses the empty upload
+        self.assertEqual(response.status_code, 400)
+
+
+class MemoryEstimateTests(SimpleTestCase):
+    def upload(self, data):
+        return SimpleUploadedFile("upload", data)
+
+    def test_from_the_image_dimensions(self):
+        upload = self.upload(photo((400, 300)))
+
+        self.assertEqual(
+            memory_estimate([upload]), upload.size + 400 * 300 * BYTES_PER_PIXEL
+        )
+        # The view still reads the upload from the start
+        self.assertEqual(Image.open(upload).size, (400, 300))
+
+    def test_capped_at_max_pixels(self):
+        upload = self.upload(photo((400, 300)))
+        self.assertEqual(
+            memory_estimate([upload], 1000), upload.size + 1000 * BYTES_PER_PIXEL
+        )
+
+    def test_every_upload_counts(self):
+        uploads = [self.upload(photo((400, 300))), self.upload(photo((100, 100)))]
+        self.assertEqual(
+            memory_estimate(uploads),
+            sum(upload.size for upload in uploads)
+            + (400 * 300 + 100 * 100) * BYTES_PER_PIXEL,
+        )
+
+    def test_unreadable_header_goes_by_the_size(self):
+        upload = self.upload(b"\0" * 100)
+        self.assertEqual(
+            memory_estimate([upload]),
+            100 + 100 * PIXELS_PER_UPLOAD_BYTE * BYTES_PER_PIXEL,
+        )
+
+
+class DecodedPipelineTests(EncodingTestCase):
+    def test_same_cutout_as_rembg_remove(self):
+        session = tiny_session()
+        img = decoded_photo((320, 240))
+
+        data = render_cutout(session, img, cutout_options(enhance="none"))
+
+        result = Image.open(io.BytesIO(data))
+        self.assertEqual(result.mode, "RGBA")
+        self.assertEqual(max_difference(result, remove(img, session=session)), 0)
+
+
+class OutputModeTests(EncodingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.session = tiny_session()
+        # Larger than MAX_DIMENSION, so the model works on a downscaled copy
+        self.original = decoded_photo((2000, 1000))
+        self.mask = predict_mask(self.session, downscale(self.original))
+
+    def render(self, output):
+        data = render_cutout(
+            self.session, self.original, cutout_options(enhance="none", output=output)
+        )
+        return Image.open(io.BytesIO(data))
+
+    def test_mask_is_the_matte_alone(self):
+        result = self.render("mask")
+
+        self.assertEqual(result.mode, "L")
+        self.assertEqual(result.size, (1500, 750))
+        self.assertEqual(max_difference(result, self.mask), 0)
+
+    def test_fullres_applies_the_upscaled_matte_to_the_upload(self):
+        result = self.render("fullres")
+
+        self.assertEqual(result.mode, "RGBA")
+        self.assertEqual(result.size, self.original.size)
+        alpha = upscale_mask(self.mask, self.original.size)
+        self.assertEqual(max_difference(result.getchannel("A"), alpha), 0)
+        # The upload's own pixels, not upsampled from the working copy
+        opaque = np.asarray(alpha) == 255
+        self.assertEqual(
+            max_difference(
+                np.asarray(result)[..., :3][opaque],
+                np.asarray(self.original)[opaque],
+            ),
+            0,
+        )
+
+
+class NegotiateFormatTests(SimpleTestCase):
+    def test_highest_quality_wins(self):
+        self.assertEqual(negotiate_format("image/png;q=0.5, image/webp;q=0.9"), "webp")
+        self.assertEqual(negotiate_format("image/webp;q=0.2, image/png"), "png")
+
+    def test_wildcards_and_unknown_types_are_ignored(self):
+        self.assertIsNone(negotiate_format("image/*, */*;q=0.8"))
+        self.assertIsNone(negotiate_format("image/jpeg"))
+        self.assertIsNone(negotiate_format(None))
+
+    def test_malformed_quality_counts_as_zero(self):
+        self.assertIsNone(negotiate_format("image/webp;q=abc"))
+        self.assertEqual(negotiate_format("image/webp;q=abc, image/png"), "png")
+
+
+class CutoutOptionsTests(SimpleTestCase):
+    def test_defaults(self):
+        self.assertEqual(
+            cutout_options(),
+            {
+                "enhance": "default",
+                "output": "cutout",
+                "format": "png",
+                "compress_level": None,
+            },
+        )
+
+    def test_compress_level(self):
+        self.assertEqual(cutout_options(compress_level="3")["compress_level"], 3)
+        self.assertIsNone(cutout_options(compress_level="")["compress_level"])
+
+    def test_invalid_options(self):
+        for kwargs in (
+            {"enhance": "sparkle"},
+            {"output": "thumbnail"},
+            {"fmt": "gif"},
+            {"compress_level": "fast"},
+            {"compress_level": 10},
+        ):
+            with self.subTest(**kwargs), self.assertRaises(ValueError):
+                cutout_options(**kwargs)
+
+
+class EncodeTests(EncodingTestCase):
+    def test_lossless_formats_keep_every_visible_pixel(self):
+        img = synthetic_cutout((120, 80))
+        visible = np.asarray(img.getchannel("A")) > 0
+        for name in ("png", "png-fast", "webp-lossless"):
+            with self.subTest(name=name):
+                result = Image.open(io.BytesIO(encode(img, name)))
+                self.assertEqual(result.format, formats.OUTPUT_FORMATS[name]["format"])
+                # Lossless WebP may change the colour of fully transparent pixels
+                self.assertEqual(
+                    max_difference(
+                        np.asarray(result.convert("RGBA"))[visible],
+                        np.asarray(img)[visible],
+                    ),
+                    0,
+                )
+
+    def test_compress_level_trades_size_for_speed(self):
+        img = synthetic_cutout((120, 80))
+        self.assertGreater(len(encode(img, "png", 0)), len(encode(img, "png", 9)))
+
+
+class SharedCountersTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, counts):
+        with open(os.path.join(self.directory, name), "w") as f:
+            json.dump(counts, f)
+
+    def test_files_of_exited_processes_are_folded(self):
+        exited = subprocess.Popen(["true"])
+        exited.wait()
+        counters = SharedCounters(self.directory)
+        counters.incr("hits")
+        self.write(f"{exited.pid}-1.json", {"hits": 2})
+        self.write(f"{exited.pid}-2.json", {"misses": 1})
+        # An earlier process that had this one's pid
+        self.write(f"{os.getpid()}-1.json", {"hits": 4})
+
+        self.assertEqual(counters.totals(), {"hits": 7, "misses": 1})
+        self.assertEqual(
+            sorted(
+                name for name in os.listdir(self.directory) if name.endswith(".json")
+            ),
+            sorted([FOLDED_FILE, counters._filename]),
+        )
+
+        counters.incr("hits")
+        counters.flush()
+        self.assertEqual(counters.totals(), {"hits": 8, "misses": 1})
+
+
+class MemoryLRUCacheTests(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        cache = MemoryLRUCache(10)
+        cache.set("a", b"1234")
+        cache.set("b", b"1234")
+        cache.get("a")
+
+        self.assertEqual(cache.set("c", b"1234"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"1234")
+        self.assertEqual(cache.get("c"), b"1234")
+
+    def test_replacing_an_entry_frees_its_size(self):
+        cache = MemoryLRUCache(10)
+        cache.set("a", b"12345678")
+        self.assertEqual(cache.set("a", b"12345678"), 0)
+        self.assertEqual(len(cache), 1)
+
+    def test_entry_over_the_cap_is_not_stored(self):
+        cache = MemoryLRUCache(10)
+        cache.set("a", b"1234")
+        self.assertEqual(cache.set("b", b"x" * 11), 0)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"1234")
+
+
+class DiskLRUCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = DiskLRUCache(directory.name, 100, low_watermark=0.6)
+        # Fills the directory without evicting along the way
+        self.writer = DiskLRUCache(directory.name, 10**9)
+
+    def set_at(self, key, data, mtime):
+        self.writer.set(key, data)
+        os.utime(self.writer._path(key), (mtime, mtime))
+
+    def test_evicts_oldest_down_to_the_low_watermark(self):
+        now = time.time()
+        for age, key in enumerate(("aa4", "aa3", "aa2", "aa1")):
+            self.set_at(key, b"x" * 30, now - age * 10)
+
+        self.assertEqual(self.cache.evict(), 2)
+        self.assertIsNone(self.cache.get("aa1"))
+        self.assertIsNone(self.cache.get("aa2"))
+        self.assertEqual(self.cache.usage(), (2, 60))
+
+    def test_read_entries_are_kept(self):
+        now = time.time()
+        for age, key in enumerate(("aa4", "aa3", "aa2", "aa1")):
+            self.set_at(key, b"x" * 30, now - 100 - age * 10)
+        self.cache.get("aa1")
+
+        self.cache.evict()
+        self.assertEqual(self.cache.get("aa1"), b"x" * 30)
+
+    def test_nothing_evicted_under_the_cap(self):
+        self.cache.set("aa1", b"x" * 60)
+        self.assertEqual(self.cache.evict(), 0)
+        self.assertEqual(self.cache.get("aa1"), b"x" * 60)
+
+
+@mock.patch(
+    "removebg.sessions.new_session",
+    side_effect=lambda model_name, sess_opts: tiny_session(model_name),
+)
+class SessionRegistryTests(SimpleTestCase):
+    def test_loaded_once_on_first_use(self, new_session):
+        registry = SessionRegistry(("u2net", "u2netp"), 2, 10**12)
+        self.assertEqual(new_session.call_count, 0)
+
+        session = registry.get("u2net")
+        self.assertIs(registry.get("u2net"), session)
+        self.assertEqual(new_session.call_count, 1)
+        self.assertEqual(registry.stats()["models"]["u2net"]["uses"], 2)
+
+    def test_least_recently_used_is_evicted(self, new_session):
+        registry = SessionRegistry(("u2net", "u2netp", "silueta"), 2, 10**12)
+        registry.get("u2net")
+        registry.get("u2netp")
+        registry.get("u2net")
+        registry.get("silueta")
+
+        self.assertEqual(registry.stats()["resident_models"], ["u2net", "silueta"])
+        self.assertFalse(registry.stats()["models"]["u2netp"]["loaded"])
+
+    @override_settings(
+        REMOVEBG_CASCADE_MODELS=("u2netp", "u2net"),
+        REMOVEBG_CASCADE_THRESHOLD=1.0,
+        METRICS_DIR=None,
+    )
+    def test_cascade_loads_the_full_model_only_to_escalate(self, new_session):
+        registry = SessionRegistry(("u2net", "u2netp", "cascade"), 2, 10**12)
+        cascade = registry.get("cascade")
+
+        predict_masks(cascade, [decoded_photo((320, 240))])
+
+        self.assertEqual(cascade.tiers, ["u2netp"])
+        self.assertEqual(registry.stats()["resident_models"], ["u2netp"])
+
+    def test_unknown_model(self, new_session):
+        registry = SessionRegistry(("u2net",), 2, 10**12)
+        with self.assertRaises(UnknownModelError):
+            registry.get("u2netp")
+
+
+class EnhanceTests(SimpleTestCase):
+    def test_matches_the_four_passes_inside_the_subject(self):
+        img = synthetic_cutout((300, 200))
+
+        result = np.asarray(enhance(img), np.int16)
+        expected = np.asarray(four_pass(img), np.int16)
+
+        # Away from the soft edge, where the old passes also sharpened the alpha.
+        # Rounding after every one of the four passes adds up to a few levels, 5
+        # at most over a few hundred of these (random) cut-outs.
+        inside = np.asarray(img.getchannel("A").filter(ImageFilter.MinFilter(7)))
+        difference = np.abs(result[..., :3] - expected[..., :3])[inside == 255]
+        self.assertLessEqual(difference.max(), 6)
+        self.assertLess(difference.mean(), 1)
+
+    def test_alpha_is_kept(self):
+        img = synthetic_cutout((300, 200))
+        self.assertEqual(
+            max_difference(enhance(img).getchannel("A"), img.getchannel("A")), 0
+        )
+
+    def test_nothing_to_enhance(self):
+        img = synthetic_cutout((300, 200))
+        self.assertIs(enhance(img, "none"), img)
+
+        transparent = Image.new("RGBA", (30, 20), 0)
+        self.assertIs(enhance(transparent), transparent)
+
+
+class FakeSession:
+    # A model that is sure of the images tagged "easy" (red top-left pixel) and
+    # unsure of the others, and remembers what it was given
+    def __init__(self, model_name, sure=False):
+        self.model_name = model_name
+        self.sure = sure
+        self.batches = []
+
+    def predict_masks(self, images):
+        self.batches.append(images)
+        masks = []
+        for img in images:
+            if self.sure or img.getpixel((0, 0)) == (255, 0, 0):
+                mask = Image.new("L", img.size, 0)
+                mask.paste(255, (0, 0, img.width // 2, img.height))
+            else:
+                mask = Image.new("L", img.size, 128)
+            masks.append(mask)
+        return masks
+
+
+@override_settings(METRICS_DIR=None)
+class CascadeTests(SimpleTestCase):
+    def setUp(self):
+        self.fast = FakeSession("fast")
+        self.full = FakeSession("full", sure=True)
+        registry = mock.Mock()
+        registry.get.side_effect = {"fast": self.fast, "full": self.full}.get
+        self.cascade = CascadeSession(registry, "fast", "full", 0.03)
+
+    def test_unsure_images_go_through_the_full_model_together(self):
+        easy = Image.new("RGB", (40, 20), (255, 0, 0))
+        hard = [Image.new("RGB", (40, 20), (0, 0, 255)) for _ in range(2)]
+        images = [hard[0], easy, hard[1]]
+
+        masks = predict_masks(self.cascade, images)
+
+        self.assertEqual(self.cascade.tiers, ["full", "fast", "full"])
+        self.assertEqual(self.full.batches, [hard])
+        for mask in masks:
+            self.assertEqual(uncertainty(mask), 0)
+
+    def test_full_model_only_when_needed(self):
+        masks = predict_masks(self.cascade, [Image.new("RGB", (40, 20), (255, 0, 0))])
+
+        self.assertEqual(self.cascade.tiers, ["fast"])
+        self.assertEqual(self.full.batches, [])
+        self.assertEqual(uncertainty(masks[0]), 0)
+
+    def test_uncertainty(self):
+        mask = Image.new("L", (10, 10), 0)
+        # Nothing found at all
+        self.assertEqual(uncertainty(mask), 1.0)
+
+        mask.paste(255, (0, 0, 5, 10))
+        self.assertEqual(uncertainty(mask), 0)
+        mask.paste(128, (0, 0, 1, 10))
+        self.assertEqual(uncertainty(mask), 0.1)
+
+
+class AnimatedFormatTests(EncodingTestCase):
+    def frames(self, mode):
+        colors = {"RGBA": [(value, 0, 0, 255) for value in (0, 100, 200)]}
+        colors["L"] = [0, 100, 200]
+        return [(Image.new(mode, (8, 6), color), 40) for color in colors[mode]]
+
+    def test_apng_frame_count(self):
+        frames = self.frames("RGBA")
+        data = b"".join(stream_apng(iter(frames), len(frames)))
+
+        self.assertTrue(data.startswith(PNG_SIGNATURE))
+        chunks = list(_png_chunks(data))
+        kinds = [kind for kind, _ in chunks]
+        actl = next(payload for kind, payload in chunks if kind == b"acTL")
+        self.assertEqual(struct.unpack(">II", actl), (3, 0))
+        self.assertEqual(kinds.count(b"fcTL"), 3)
+        self.assertEqual(kinds[-1], b"IEND")
+
+        with Image.open(io.BytesIO(data)) as img:
+            self.assertEqual(img.n_frames, 3)
+
+    def webp(self, frames):
+        output = io.BytesIO(b"unrelated")
+        output.seek(0, io.SEEK_END)
+        animated_webp(iter(frames), output, "webp-lossless")
+        return output.getvalue()[len(b"unrelated") :]
+
+    def test_webp_written_frame_by_frame(self):
+        frames = self.frames("RGBA")
+        data = self.webp(frames)
+
+        self.assertEqual(struct.unpack("<I", data[4:8])[0], len(data) - 8)
+        with Image.open(io.BytesIO(data)) as img:
+            self.assertEqual(img.n_frames, 3)
+            for index, (frame, duration) in enumerate(frames):
+                img.seek(index)
+                img.load()
+                self.assertEqual(img.info["duration"], duration)
+                self.assertEqual(max_difference(img.convert("RGBA"), frame), 0)
+
+    def test_webp_alpha_flag_only_for_frames_with_alpha(self):
+        for mode, has_alpha in (("RGBA", True), ("L", False)):
+            with self.subTest(mode=mode):
+                chunks = dict(_riff_chunks(self.webp(self.frames(mode))))
+                self.assertEqual(bool(chunks[b"VP8X"][0] & 0x10), has_alpha)
+                self.assertTrue(chunks[b"VP8X"][0] & 0x02)
+
+
+class VideoFrameCountTests(SimpleTestCase):
+    def stream(self, frames=0, duration=None):
+        return mock.Mock(frames=frames, duration=duration, time_base=None)
+
+    @mock.patch("removebg.animation.av", time_base=1_000_000)
+    def test_from_the_container_without_decoding(self, av):
+        container = mock.Mock(duration=2_000_000)
+
+        self.assertEqual(_frame_count(container, self.stream(frames=48), 25, 0), 48)
+        self.assertEqual(_frame_count(container, self.stream(), 25, 0), 50)
+        container.decode.assert_not_called()
+
+    @mock.patch("removebg.animation.av")
+    def test_decoded_when_the_container_does_not_say(self, av):
+        container = mock.Mock(duration=None)
+        container.decode.return_value = iter(range(30))
+
+        self.assertEqual(_frame_count(container, self.stream(), 25, 10), 11)
+
+    @mock.patch("removebg.animation.av")
+    def test_exactly_the_declared_number_of_frames(self, av):
+        images = [Image.new("RGB", (8, 6), value) for value in (0, 100)]
+        decoded = [mock.Mock(**{"to_image.return_value": img}) for img in images]
+        container = av.open.return_value.__enter__.return_value
+        upload = io.BytesIO()
+
+        for frame_count, expected in ((1, images[:1]), (4, images + images[1:] * 2)):
+            with self.subTest(frame_count=frame_count):
+                container.decode.return_value = iter(decoded)
+                animation = VideoAnimation(upload, frame_count, (8, 6), 40)
+                self.assertEqual([img for img, _ in animation], expected)
@@ -6,4 +6,14 @@ urlpatterns = [
     path(
         "removebg/", views.remove_background, name="home"
     ),  # Example URL pattern for the home view
+    path("removebg/batch/", views.remove_background_batch, name="removebg-batch"),
+    path("removebg/jobs/", views.submit_remove_background, name="removebg-jobs"),
+    path(
+        "removebg/batch/jobs/",
+        views.submit_remove_background_batch,
+        name="removebg-batch-jobs",
+    ),
+    path("removebg/cache/stats/", views.cache_stats, name="removebg-cache-stats"),
+    path("removebg/formats/stats/", views.format_stats, name="removebg-format-stats"),
+    path("removebg/models/", views.model_stats, name="removebg-models"),
 ]
@@ -1,22 +1,139 @@
-import io
+import os
+import tempfile
 
-from django.http import HttpResponse
-from PIL import Image, ImageEnhance, ImageFilter
-from rembg import new_session, remove
+from django.conf import settings
+from django.core.exceptions import SuspiciousOperation
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.http.multipartparser import MultiPartParserError
+from PIL import UnidentifiedImageError
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
+from jobs.views import enqueue_job
+from RemoveImageBG.admission import admit, upload_size
+from RemoveImageBG.executors import offload
+from RemoveImageBG.metrics import stage
+from RemoveImageBG.streaming import stream_zip
+
+from .animation import AnimationCutout, open_animation
+from .batch import predict_masks
+from .cache import cached_cutout, result_cache
+from .formats import (
+    OUTPUT_FORMATS,
+    animated_format,
+    animated_webp,
+    encode_stats,
+    negotiate_format,
+    stream_apng,
+)
+from .pipeline import (
+    ImageTooLarge,
+    cutout_options,
+    downscale,
+    memory_estimate,
+    open_image,
+    render_output,
+)
 from .secret import (
+    client_secret_refusal,
     require_client_secret,
 )  # Assuming the decorator is in a module named `authentication_decorators`
+from .sessions import sessions
+
+
+def _requested_session(request):
+    # Pick the model per request, e.g. u2net_human_seg for portraits or the small
+    # u2netp for bulk thumbnails, sessions are loaded on first use
+    model_name = request.query_params.get("model", settings.REMOVEBG_DEFAULT_MODEL)
+    return sessions.get(model_name)
+
+
+def _requested_options(request):
+    # Per request: ?enhance= post-processing preset, ?output=mask for just the
+    # alpha matte or fullres for the upload's original resolution, and the format
+    # from ?format= or else the Accept header (image/webp, image/avif, ...)
+    params = request.query_params
+    return cutout_options(
+        params.get("enhance", settings.REMOVEBG_DEFAULT_ENHANCE),
+        params.get("output", settings.REMOVEBG_DEFAULT_OUTPUT),
+        params.get("format")
+        or negotiate_format(request.headers.get("Accept"))
+        or settings.REMOVEBG_DEFAULT_FORMAT,
+        params.get("compress_level"),
+    )
+
+
+def _output_name(prefix, options, extension=None):
+    suffix = "mask" if options["output"] == "mask" else "without_bg"
+    extension = extension or OUTPUT_FORMATS[options["format"]]["extension"]
+    return f"{prefix}_{suffix}.{extension}"
+
+
+def _uploads_estimate(request, field):
+    # admit() runs this on a thread, the body is parsed here to read the image
+    # headers and DRF picks the parsed files up from the request afterwards
+    try:
+        uploaded_images = request.FILES.getlist(field)
+    except (MultiPartParserError, SuspiciousOperation):
+        # A malformed body, the view refuses it
+        return upload_size(request)
+    return memory_estimate(uploaded_images, settings.REMOVEBG_MAX_PIXELS)
+
 
-# Create a session with the U2Net model, you can try different models for accuracy vs speed trade-off
-session = new_session(
-    "u2net"
-)  # You can also use "u2net_human_seg" if you are working with human images.
+def _memory_estimate(request):
+    return _uploads_estimate(request, "image")
 
 
+def _batch_memory_estimate(request):
+    return _uploads_estimate(request, "images")
+
+
+def _animation_response(session, animation, options):
+    # Animations skip the result cache and come back as an APNG, streamed as the
+    # frames are done, or an animated WebP
+    options = dict(options, format=animated_format(options["format"]))
+    fmt = options["format"]
+    frames = AnimationCutout(
+        session,
+        options,
+        settings.REMOVEBG_ANIMATION_BATCH_SIZE,
+        settings.REMOVEBG_ANIMATION_REUSE_THRESHOLD,
+        settings.REMOVEBG_ANIMATION_MAX_REUSE,
+    ).frames(animation)
+
+    content_type = OUTPUT_FORMATS[fmt]["content_type"]
+    if OUTPUT_FORMATS[fmt]["format"] == "PNG":
+        response = StreamingHttpResponse(
+            stream_apng(
+                frames,
+                animation.frame_count,
+                fmt,
+                options["compress_level"],
+                animation.loop,
+            ),
+            content_type=content_type,
+        )
+    else:
+        # Written to a temporary file as the frames are done, then sent from there
+        output = tempfile.TemporaryFile()
+        try:
+            animated_webp(frames, output, fmt, animation.loop)
+        except BaseException:
+            output.close()
+            raise
+        output.seek(0)
+        response = FileResponse(output, content_type=content_type)
+    response["Content-Disposition"] = (
+        f'attachment; filename="{_output_name("image", options)}"'
+    )
+    response["Vary"] = "Accept"
+    response["X-Removebg-Model"] = session.model_name
+    return response
+
+
+@admit("removebg", _memory_estimate, client_secret_refusal)
+@offload("removebg")
 @api_view(["POST"])
 @require_client_secret
 def remove_background(request):
@@ -27,57 +144,234 @@ def remove_background(request):
 
     uploaded_image = request.FILES["image"]
 
-    # Open the uploaded image and determine its format
-    img = Image.open(uploaded_image)
-    img_format = img.format
+    try:
+        session = _requested_session(request)
+        options = _requested_options(request)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Resize large images moderately for performance, but not overly aggressive to avoid blur
-    max_dimension = max(img.size)
-    if max_dimension > 1500:  # Resize only if larger than 1500px
-        resize_factor = 1500 / max_dimension
-        new_size = (int(img.width * resize_factor), int(img.height * resize_factor))
-        img = img.resize(new_size, Image.Resampling.LANCZOS)
+    try:
+        # Animated GIF/WebP/APNG and video clips are processed frame by frame
+        animation = open_animation(
+            uploaded_image,
+            settings.REMOVEBG_MAX_PIXELS,
+            settings.REMOVEBG_ANIMATION_MAX_FRAMES,
+        )
+        if animation is not None:
+            return _animation_response(session, animation, options)
+        img_bytes, model_name = cached_cutout(session, uploaded_image, options)
+    except ImageTooLarge as e:
+        return Response(
+            {"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+    except UnidentifiedImageError:
+        return Response(
+            {"error": f"{uploaded_image.name} is not a valid image"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    except ValueError as e:
+        # A video upload that can't be read
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Convert the image to bytes and process with rembg
-    img_byte_arr = io.BytesIO()
-    img.save(img_byte_arr, format=img_format)
+    # Send the processed image back as a response
+    response = HttpResponse(
+        img_bytes, content_type=OUTPUT_FORMATS[options["format"]]["content_type"]
+    )
+    response["Content-Disposition"] = (
+        f'attachment; filename="{_output_name("image", options)}"'
+    )
+    response["Vary"] = "Accept"
+    # With ?model=cascade, which of the cascade's models produced the result
+    response["X-Removebg-Model"] = model_name
 
-    # Remove background using the rembg model session
-    result = remove(img_byte_arr.getvalue(), session=session)
+    return response
 
-    # Convert the result back to an image, keeping transparency
-    img_result = Image.open(io.BytesIO(result))
 
-    # Apply Image Enhancements to improve quality, but without making it blurry
+@admit("removebg", _batch_memory_estimate, client_secret_refusal)
+@offload("removebg")
+@api_view(["POST"])
+@require_client_secret
+def remove_background_batch(request):
+    uploaded_images = request.FILES.getlist("images")
 
-    # Apply light sharpening to enhance edges without overdoing it
-    img_result = img_result.filter(
-        ImageFilter.UnsharpMask(radius=1, percent=125, threshold=3)
-    )
+    if not uploaded_images:
+        return Response(
+            {"error": "No images provided"}, status=status.HTTP_400_BAD_REQUEST
+        )
 
-    # Enhance contrast slightly to avoid over-processing
-    enhancer = ImageEnhance.Contrast(img_result)
-    img_result = enhancer.enhance(1.2)  # Adjust contrast, but keep it moderate
+    if len(uploaded_images) > settings.REMOVEBG_MAX_BATCH_SIZE:
+        return Response(
+            {
+                "error": f"A batch can contain at most {settings.REMOVEBG_MAX_BATCH_SIZE} images"
+            },
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
-    # Enhance brightness slightly, but don't over-brighten
-    enhancer = ImageEnhance.Brightness(img_result)
-    img_result = enhancer.enhance(
-        1.05
-    )  # Small brightness boost to maintain natural look
+    try:
+        session = _requested_session(request)
+        options = _requested_options(request)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Optionally enhance color saturation slightly to make the image more vivid
-    enhancer = ImageEnhance.Color(img_result)
-    img_result = enhancer.enhance(1.1)  # Small color boost for natural tones
+    # Decode and downscale every upload up front, the model needs them all at once.
+    # JPEGs are decoded near the working size even for fullres, whose originals are
+    # decoded again one at a time while the ZIP is streamed.
+    images = []
+    for uploaded_image in uploaded_images:
+        try:
+            with stage("decode"):
+                img = open_image(
+                    uploaded_image, settings.REMOVEBG_MAX_PIXELS, draft=True
+                )
+            with stage("resize"):
+                images.append(downscale(img))
+        except ImageTooLarge as e:
+            return Response(
+                {"error": f"{uploaded_image.name}: {e}"},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+        except UnidentifiedImageError:
+            return Response(
+                {"error": f"{uploaded_image.name} is not a valid image"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-    # Convert the processed image to bytes and prepare the response
-    img_io = io.BytesIO()
+    # Run all images through a single forward pass on the requested session
+    with stage("inference"):
+        masks = predict_masks(session, images)
+    model_names = getattr(session, "tiers", None) or [session.model_name] * len(masks)
 
-    # Ensure we save it in a format that supports transparency like PNG
-    img_result.save(img_io, format="PNG")
-    img_io.seek(0)
+    def entries():
+        # Cut out, enhance and encode one image at a time while the ZIP is streamed
+        for index, (uploaded_image, img, mask) in enumerate(
+            zip(uploaded_images, images, masks), start=1
+        ):
+            original = img
+            if options["output"] == "fullres":
+                # Decode the upload again rather than keep every original in memory
+                uploaded_image.seek(0)
+                original = open_image(uploaded_image)
 
-    # Send the processed image back as a response
-    response = HttpResponse(img_io, content_type="image/png")
-    response["Content-Disposition"] = 'attachment; filename="image_without_bg.png"'
+            name = os.path.splitext(os.path.basename(uploaded_image.name))[0]
+            yield (
+                _output_name(f"{index:03d}_{name}", options),
+                render_output(original, img, mask, options),
+            )
+
+    response = StreamingHttpResponse(
+        stream_zip(entries()), content_type="application/zip"
+    )
+    response["Content-Disposition"] = (
+        f'attachment; filename="{_output_name("images", options, "zip")}"'
+    )
+    response["X-Removebg-Model"] = ",".join(model_names)
 
     return response
+
+
+@offload("default")
+@api_view(["POST"])
+@require_client_secret
+def submit_remove_background(request):
+    # Same as remove_background, but runs in the job pool and returns a job id
+    if "image" not in request.FILES:
+        return Response(
+            {"error": "No image provided"}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    uploaded_image = request.FILES["image"]
+    model_name = request.query_params.get("model", settings.REMOVEBG_DEFAULT_MODEL)
+
+    if model_name not in settings.REMOVEBG_MODELS:
+        return Response(
+            {"error": f"Unknown model '{model_name}'"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    try:
+        options = _requested_options(request)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return enqueue_job(
+        request,
+        "removebg",
+        "removebg.tasks.remove_background",
+        [("input", uploaded_image)],
+        args=("input", model_name, options),
+        download_name=_output_name("image", options),
+    )
+
+
+@offload("default")
+@api_view(["POST"])
+@require_client_secret
+def submit_remove_background_batch(request):
+    # Same as remove_background_batch, but runs in the job pool and returns a job id
+    uploaded_images = request.FILES.getlist("images")
+
+    if not uploaded_images:
+        return Response(
+            {"error": "No images provided"}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if len(uploaded_images) > settings.REMOVEBG_MAX_BATCH_SIZE:
+        return Response(
+            {
+                "error": f"A batch can contain at most {settings.REMOVEBG_MAX_BATCH_SIZE} images"
+            },
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    model_name = request.query_params.get("model", settings.REMOVEBG_DEFAULT_MODEL)
+
+    if model_name not in settings.REMOVEBG_MODELS:
+        return Response(
+            {"error": f"Unknown model '{model_name}'"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    try:
+        options = _requested_options(request)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # (input file, name in the ZIP) for every image, in upload order
+    inputs, entries = [], []
+    for index, uploaded_image in enumerate(uploaded_images, start=1):
+        name = os.path.splitext(os.path.basename(uploaded_image.name))[0]
+        input_name = f"input_{index:03d}"
+        inputs.append((input_name, uploaded_image))
+        entries.append((input_name, _output_name(f"{index:03d}_{name}", options)))
+
+    return enqueue_job(
+        request,
+        "removebg-batch",
+        "removebg.tasks.remove_background_batch",
+        inputs,
+        args=(entries, model_name, options),
+        download_name=_output_name("images", options, "zip"),
+    )
+
+
+@offload("default")
+@api_view(["GET"])
+@require_client_secret
+def cache_stats(request):
+    return Response(result_cache.stats(), status=status.HTTP_200_OK)
+
+
+@offload("default")
+@api_view(["GET"])
+@require_client_secret
+def format_stats(request):
+    # Encode count, average time and size per output format, over all workers
+    return Response(encode_stats(), status=status.HTTP_200_OK)
+
+
+@offload("default")
+@api_view(["GET"])
+@require_client_secret
+def model_stats(request):
+    # Load time and resident memory of the models loaded by this worker
+    return Response(sessions.stats(), status=status.HTTP_200_OK)